@@ -5,17 +5,33 @@
 提供API接口和静态文件服务
 """
 
-from flask import Flask, jsonify, send_from_directory, send_file, request
+from flask import Flask, Response, jsonify, send_from_directory, send_file, request
+import bisect
 import threading
 import time
 import json
 import os
-import requests
 from datetime import datetime, timedelta
 import pytz
 from scraper import MeterDataScraper
-from collections import defaultdict
-from database import db_manager, is_database_available
+from collections import defaultdict, OrderedDict, deque
+from itertools import islice
+import hmac
+from storage import get_storage_backend, get_bucket_keys, copy_bucket, JsonFileStorage, USAGE_STAT_TYPES
+from persistence import PersistenceQueue
+from runtime import RUNTIME_DIR, IngesterLock, SharedStateFile, RefreshSignal
+from http_cache import DataVersion, ResponseCache, RawBody, cached_json
+from events import EventBroker
+from geoip import UNKNOWN_LOCATION, IpRangeDatabase, LocationResolver
+from hyperloglog import HyperLogLog
+from traffic_stats import VISIT_DETAILS_SIZE, DAILY_SKETCH_DAYS, sketch_cutoff_day
+from metrics import RequestMetrics, Counter, Histogram, PrometheusWriter, summarize_histogram, resident_memory_bytes
+from rate_limit import TokenBucketLimiter, limited_response, parse_limit_spec, rate_limited, retry_after_seconds
+from static_assets import StaticAssets
+from series_format import BINARY_MIMETYPE, parse_format, usage_columns, records_columns, encode_binary
+from monitor_state import MonitorState
+from series_query import (SortedKeyIndex, parse_time_range, parse_limit, bucket_key_range, records_window,
+                          records_page, encode_cursor, decode_cursor)
 
 # 设置北京时区
 BEIJING_TZ = pytz.timezone('Asia/Shanghai')
@@ -28,174 +44,440 @@ app = Flask(__name__)
 
 # 全局变量
 scraper = MeterDataScraper()
-latest_data = None
-data_lock = threading.Lock()
+data_lock = threading.Lock()  # 只在替换 app_state 引用时持有，读取方不加锁
 
 # 访问统计数据
+# 独立访客数用固定大小的 HyperLogLog 草图估计（全部时间一个，另按天各一个），不保存全部IP；
+# 具体的IP只保留最近访问的 VISITOR_INDEX_SIZE 个，通过需要管理令牌的分页接口查询
 visit_stats = {
     'total_visits': 0,
-    'unique_visitors': set(),
+    'unique_visitors': HyperLogLog(),
+    'daily_unique_visitors': {},
     'daily_visits': defaultdict(int),
-    'visitor_details': [],
+    'visitor_details': deque(maxlen=VISIT_DETAILS_SIZE),
+    'visitor_index': OrderedDict(),  # IP -> 首次/最近访问时间和次数，按最近访问排序
     'refresh_count': 0
 }
 stats_lock = threading.Lock()
 
-# 多时间维度数据存储
-historical_data = []  # 原始数据记录
-ten_minute_usage = {}  # 每10分钟用电量
-hourly_usage_data = {}  # 每小时用电量
-daily_usage_data = {}   # 每日用电量
-weekly_usage_data = {}  # 每周用电量
-monthly_usage_data = {} # 每月用电量
+def new_visit_pending():
+    """尚未合并到存储的访问统计增量"""
+    return {
+        'total_visits': 0,
+        'refresh_count': 0,
+        'daily_visits': defaultdict(int),
+        'visitor_details': deque(maxlen=VISIT_DETAILS_SIZE),
+        'sketch_days': set(),   # 草图有变化的日期
+        'sketch_dirty': False   # 全部时间的草图有变化
+    }
+
+# 访问统计由后台线程每 VISIT_FLUSH_SECONDS 秒合并到存储一次，请求线程不读写存储
+visit_pending = new_visit_pending()
+VISIT_FLUSH_SECONDS = float(os.getenv('VISIT_FLUSH_SECONDS', '60'))
+visit_flush_info = {'loaded_from': None, 'flushes': 0, 'failures': 0, 'last_flush_at': None}
+VISITOR_INDEX_SIZE = int(os.getenv('VISITOR_INDEX_SIZE', '10000'))
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '')
+
+# 地理位置查询队列：请求线程只入队，队列满时直接丢弃（只缺少地理位置，访问计数已在请求线程中更新），不等待
+visit_queue = PersistenceQueue(maxsize=int(os.getenv('VISIT_QUEUE_SIZE', '1000')), put_timeout=0, name='visit-geolocation')
+
+# IP地理位置：本地IP段数据库 + LRU缓存，IP_LOOKUP_REMOTE=1 时查不到的IP回退到远程查询
+location_resolver = LocationResolver(
+    IpRangeDatabase(os.getenv('IP_DB_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ip_ranges.csv'))),
+    cache_size=int(os.getenv('IP_LOCATION_CACHE_SIZE', '4096')),
+    remote=os.getenv('IP_LOOKUP_REMOTE', '0') == '1'
+)
+
+# 当前监控状态（历史记录、多时间维度用电统计、最新电表数据）：不可变，更新时整体替换引用
+app_state = MonitorState()
+state_save_lock = threading.RLock()  # 保证状态按替换顺序交给持久化队列（保存时会同时发布共享快照，可重入）
+
+# 各维度保留的时长和时间桶键格式，早于保留期的时间桶在写入新读数时清理
+USAGE_RETENTION = {
+    'ten_minute': (timedelta(hours=24), '%Y-%m-%d %H:%M'),
+    'hourly': (timedelta(days=30), '%Y-%m-%d-%H'),
+    'daily': (timedelta(days=365), '%Y-%m-%d'),
+    'weekly': (timedelta(weeks=52), '%Y-W%U'),
+    'monthly': (timedelta(days=730), '%Y-%m'),  # 约24个月
+}
 
 DATA_HISTORY_FILE = 'data_history.json'
 MAX_HISTORY_RECORDS = 1000  # 增加历史记录数量
 MAX_DETAILED_RECORDS = 144  # 每天144个10分钟记录
+STORAGE_STARTUP_WAIT = 5  # 启动时等待存储后端就绪的最长时间（秒）
+HOT_HISTORY_RECORDS = 200  # 启动时加载的最近历史记录条数（覆盖 /api/historical-data 的默认返回量）
+HISTORY_QUERY_MAX_LIMIT = 2000  # /api/historical-data 单次最多返回的记录数
+DASHBOARD_SECTIONS = ('meter', 'summary', 'historical', 'ten_minute', 'hourly', 'daily', 'weekly', 'monthly')  # /api/dashboard 可选的部分
 data_file = 'meter_data.json'
 url = "http://www.wap.cnyiot.com/nat/pay.aspx?mid=18100071580"
 
+# 存储后端（由 STORAGE_BACKEND 环境变量选择），本地JSON文件作为备用
+storage = get_storage_backend()
+fallback_storage = storage if isinstance(storage, JsonFileStorage) else JsonFileStorage(DATA_HISTORY_FILE)
+loaded_from = fallback_storage  # 实际加载数据的存储后端
+
+# 数据版本号：每次写入新数据时递增，用于接口的ETag和条件请求
+data_version = DataVersion()
+
+# 预序列化响应缓存：每个数据版本只序列化一次
+response_cache = ResponseCache(max_bytes=int(float(os.getenv('RESPONSE_CACHE_MB', '16')) * 1024 * 1024))
+
+# 静态资源：启动时预压缩，按内容哈希生成ETag，HTML中的引用带版本号
+static_assets = StaticAssets(
+    os.path.dirname(os.path.abspath(__file__)),
+    ['style.css', 'script.js', 'chart.min.js'],
+    html_names=['index.html', 'monitor.html']
+)
+
+# 实时推送：每写入一条读数发布一个事件，/api/stream 的连接数有上限，每个连接最长保持 STREAM_MAX_SECONDS 秒
+event_broker = EventBroker(max_connections=int(os.getenv('SSE_MAX_CONNECTIONS', '8')))
+STREAM_HEARTBEAT_SECONDS = 15
+STREAM_MAX_SECONDS = int(os.getenv('SSE_MAX_SECONDS', '300'))
+STREAM_REPLAY_LIMIT = 100  # 重连时最多补发的读数条数，更多时让客户端重新获取完整数据
+
+# 限流：手动刷新会请求电表网站，历史查询和仪表盘可能查询数据库，按客户端IP和全局两级令牌桶限流
+# 配置格式为 "次数/秒数"，0 表示不限流。令牌桶保存在各工作进程的内存中：
+#   - 按客户端IP的限流和查询的全局限流在每个工作进程分别计数，实际上限是配置值 × 工作进程数
+#   - 请求电表网站的全局限流只在采集进程中计数（跟随进程的刷新请求也由采集进程执行），不随工作进程数放大
+refresh_limiter = TokenBucketLimiter(
+    'refresh',
+    per_client=parse_limit_spec(os.getenv('REFRESH_LIMIT_PER_IP', '2/60'))
+)
+upstream_refresh_limiter = TokenBucketLimiter(
+    'refresh_upstream',
+    global_limit=parse_limit_spec(os.getenv('REFRESH_LIMIT_GLOBAL', '6/60'))
+)
+query_limiter = TokenBucketLimiter(
+    'query',
+    per_client=parse_limit_spec(os.getenv('QUERY_LIMIT_PER_IP', '20/10')),
+    global_limit=parse_limit_spec(os.getenv('QUERY_LIMIT_GLOBAL', '200/10'))
+)
+
+# 耗时统计：每个路由的请求数、进行中的请求数和延迟直方图，以及抓取、解析、统计更新和持久化各阶段的耗时
+request_metrics = RequestMetrics(app)
+stage_latency = Histogram()        # 阶段 (fetch/parse/rollup) -> 耗时
+persistence_latency = Histogram()  # (存储后端, 操作) -> 耗时
+scrape_results = Counter()         # success/failure -> 抓取次数
+
+# 持久化队列：写盘由专门的写线程完成，不占用请求线程和 data_lock
+persistence_queue = PersistenceQueue(
+    maxsize=int(os.getenv('PERSISTENCE_QUEUE_SIZE', '100')),
+    put_timeout=float(os.getenv('PERSISTENCE_PUT_TIMEOUT', '0.5'))
+)
+
+# 多进程运行时：通过文件锁选出唯一的采集进程，其他工作进程加载它发布的共享快照
+ingester_lock = IngesterLock(os.path.join(RUNTIME_DIR, 'ingester.lock'))
+shared_state = SharedStateFile(os.path.join(RUNTIME_DIR, 'state.snapshot'))
+refresh_signal = RefreshSignal(os.path.join(RUNTIME_DIR, 'refresh.request'))
+SHARED_STATE_POLL_SECONDS = float(os.getenv('SHARED_STATE_POLL_SECONDS', '1'))
+FETCH_INTERVAL_SECONDS = 120
+runtime_lock = threading.Lock()
+runtime_info = {
+    'role': None,  # ingester（采集进程）或 follower（跟随进程）
+    'pid': None,
+    'started_at': None,
+    'promoted_at': None,
+    'snapshot_loads': 0,
+    'snapshot_bytes': None
+}
+last_reading = None  # 最近一次发布的读数事件（随共享快照同步给跟随进程）
+
+# 启动时只加载热数据，各维度更早的时间桶按需加载
+usage_loaded = {stat_type: True for stat_type, _ in USAGE_STAT_TYPES}
+usage_boundary_keys = {}  # 启动时各维度当前时间桶的键，早于它的时间桶尚未加载
+lazy_load_lock = threading.Lock()
+startup_stats = {
+    'started_at': None,
+    'ready_at': None,
+    'time_to_ready': None,
+    'backend': None
+}
+
 def get_ip_location(ip):
-    """获取IP地址的地理位置信息"""
-    try:
-        # 使用免费的IP地理位置API
-        response = requests.get(f'http://ip-api.com/json/{ip}?lang=zh-CN', timeout=5)
-        if response.status_code == 200:
-            data = response.json()
-            if data['status'] == 'success':
-                return {
-                    'country': data.get('country', '未知'),
-                    'region': data.get('regionName', '未知'),
-                    'city': data.get('city', '未知'),
-                    'isp': data.get('isp', '未知'),
-                    'lat': data.get('lat', 0),
-                    'lon': data.get('lon', 0)
-                }
-    except Exception as e:
-        print(f"获取IP地理位置失败: {e}")
-    
-    return {
-        'country': '未知',
-        'region': '未知', 
-        'city': '未知',
-        'isp': '未知',
-        'lat': 0,
-        'lon': 0
-    }
+    """获取IP地址的地理位置信息（缓存、本地IP数据库，必要时远程查询）"""
+    return location_resolver.resolve(ip)
 
 def record_visit(ip, user_agent, path):
-    """记录访问信息"""
+    """记录访问信息：计数和草图在请求线程中直接更新（都是O(1)操作），地理位置查询放入访问记录队列由后台线程补充
+
+    队列满时只会缺少这次访问的地理位置，计数不受影响。
+    """
+    visited_at = get_beijing_time()
     with stats_lock:
+        today = visited_at.strftime('%Y-%m-%d')
         visit_stats['total_visits'] += 1
-        visit_stats['unique_visitors'].add(ip)
-        
-        today = get_beijing_time().strftime('%Y-%m-%d')
         visit_stats['daily_visits'][today] += 1
+        visit_pending['total_visits'] += 1
+        visit_pending['daily_visits'][today] += 1
+        
+        if visit_stats['unique_visitors'].add(ip):
+            visit_pending['sketch_dirty'] = True
+        daily_unique = visit_stats['daily_unique_visitors']
+        if today not in daily_unique:
+            daily_unique[today] = HyperLogLog()
+            for day in sorted(daily_unique)[:-DAILY_SKETCH_DAYS]:
+                del daily_unique[day]
+        if daily_unique[today].add(ip):
+            visit_pending['sketch_days'].add(today)
         
-        # 获取地理位置信息
-        location = get_ip_location(ip)
+        # 最近访问的IP（有容量上限，超出时淘汰最久未访问的）
+        visitor_index = visit_stats['visitor_index']
+        visitor = visitor_index.pop(ip, None) or {'first_seen': visited_at.isoformat(), 'visits': 0}
+        visitor['last_seen'] = visited_at.isoformat()
+        visitor['visits'] += 1
+        visitor_index[ip] = visitor
+        while len(visitor_index) > VISITOR_INDEX_SIZE:
+            visitor_index.popitem(last=False)
         
-        # 记录访问详情
+        # 记录访问详情，地理位置由后台线程补充（补充之前为"未知"）
         visit_detail = {
             'ip': ip,
             'user_agent': user_agent,
             'path': path,
-            'timestamp': get_beijing_time().isoformat(),
-            'location': location
+            'timestamp': visited_at.isoformat(),
+            'location': dict(UNKNOWN_LOCATION)
         }
         
+        # 定长队列，只保留最近 VISIT_DETAILS_SIZE 条访问记录
         visit_stats['visitor_details'].append(visit_detail)
+        visit_pending['visitor_details'].append(visit_detail)
+    
+    visit_queue.submit('locate_visit', locate_visit, visit_detail)
+
+def locate_visit(visit_detail):
+    """后台线程：查询访问记录的地理位置（stats_lock 只在写入结果时持有）"""
+    location = get_ip_location(visit_detail['ip'])
+    with stats_lock:
+        visit_detail['location'] = location
+
+def take_visit_delta():
+    """取出尚未合并到存储的增量（草图为完整的序列化草图），没有增量时返回None"""
+    global visit_pending
+    with stats_lock:
+        pending = visit_pending
+        if not (pending['total_visits'] or pending['refresh_count'] or pending['sketch_dirty'] or pending['sketch_days']):
+            return None
+        visit_pending = new_visit_pending()
+        daily_unique = visit_stats['daily_unique_visitors']
+        return {
+            'total_visits': pending['total_visits'],
+            'refresh_count': pending['refresh_count'],
+            'daily_visits': dict(pending['daily_visits']),
+            'unique_visitors': visit_stats['unique_visitors'].to_bytes() if pending['sketch_dirty'] else None,
+            'daily_unique_visitors': {day: daily_unique[day].to_bytes()
+                                      for day in pending['sketch_days'] if day in daily_unique},
+            'visitor_details': list(pending['visitor_details'])
+        }
+
+def restore_visit_delta(delta):
+    """合并到存储失败时把增量放回，下次再合并"""
+    with stats_lock:
+        visit_pending['total_visits'] += delta['total_visits']
+        visit_pending['refresh_count'] += delta['refresh_count']
+        for day, count in delta['daily_visits'].items():
+            visit_pending['daily_visits'][day] += count
+        visit_pending['sketch_dirty'] = visit_pending['sketch_dirty'] or bool(delta['unique_visitors'])
+        visit_pending['sketch_days'].update(delta['daily_unique_visitors'])
+        details = delta['visitor_details'] + list(visit_pending['visitor_details'])
+        visit_pending['visitor_details'] = deque(details, maxlen=VISIT_DETAILS_SIZE)
+
+def adopt_visit_stats(stored):
+    """以存储中的统计（包含所有进程已合并的部分）加上本进程尚未合并的增量作为当前统计"""
+    with stats_lock:
+        daily_visits = defaultdict(int, stored['daily_visits'])
+        for day, count in visit_pending['daily_visits'].items():
+            daily_visits[day] += count
+        
+        # 本进程的草图包含尚未合并的访客，与存储中的草图合并（重复合并不会重复计数）
+        unique_visitors = HyperLogLog.from_bytes(stored['unique_visitors']) if stored['unique_visitors'] else HyperLogLog()
+        unique_visitors.merge(visit_stats['unique_visitors'])
+        daily_unique = {day: HyperLogLog.from_bytes(sketch) for day, sketch in stored['daily_unique_visitors'].items()}
+        for day, sketch in visit_stats['daily_unique_visitors'].items():
+            daily_unique[day] = daily_unique[day].merge(sketch) if day in daily_unique else sketch
+        for day in sorted(daily_unique)[:-DAILY_SKETCH_DAYS]:
+            del daily_unique[day]
         
-        # 只保留最近1000条访问记录
-        if len(visit_stats['visitor_details']) > 1000:
-            visit_stats['visitor_details'] = visit_stats['visitor_details'][-1000:]
+        visit_stats.update({
+            'total_visits': stored['total_visits'] + visit_pending['total_visits'],
+            'refresh_count': stored['refresh_count'] + visit_pending['refresh_count'],
+            'daily_visits': daily_visits,
+            'unique_visitors': unique_visitors,
+            'daily_unique_visitors': daily_unique,
+            'visitor_details': deque(list(stored['visitor_details']) + list(visit_pending['visitor_details']),
+                                     maxlen=VISIT_DETAILS_SIZE)
+        })
+
+def load_visit_stats():
+    """启动时从存储加载访问统计"""
+    storage.wait_until_available(STORAGE_STARTUP_WAIT)
+    for backend in get_storage_chain():
+        try:
+            stored = backend.load_visit_stats()
+        except Exception as e:
+            print(f"从{backend.label}加载访问统计失败: {e}")
+            continue
+        adopt_visit_stats(stored)
+        visit_flush_info['loaded_from'] = backend.name
+        print(f"✅ 已从{backend.label}加载访问统计: 共 {stored['total_visits']} 次访问")
+        return True
+    return False
+
+def flush_visit_stats():
+    """把累积的访问统计增量合并到存储，并采用合并后的结果（包含其他进程的访问）"""
+    delta = take_visit_delta()
+    if delta is None:
+        return True
+    
+    cutoff_day = sketch_cutoff_day(today=get_beijing_time().date())
+    for backend in get_storage_chain():
+        try:
+            with persistence_latency.time((backend.name, 'merge_visit_stats')):
+                stored = backend.merge_visit_stats(delta, cutoff_day)
+        except Exception as e:
+            print(f"保存访问统计到{backend.label}失败: {e}")
+            continue
+        adopt_visit_stats(stored)
+        visit_flush_info['flushes'] += 1
+        visit_flush_info['last_flush_at'] = get_beijing_time().isoformat()
+        return True
+    
+    restore_visit_delta(delta)
+    visit_flush_info['failures'] += 1
+    return False
+
+def visit_flush_background():
+    """后台线程：加载访问统计，然后定期把增量合并到存储"""
+    try:
+        load_visit_stats()
+    except Exception as e:
+        print(f"❌ 加载访问统计异常: {e}")
+    while True:
+        time.sleep(VISIT_FLUSH_SECONDS)
+        try:
+            flush_visit_stats()
+        except Exception as e:
+            print(f"❌ 保存访问统计异常: {e}")
 
 def fetch_data_background():
     """后台定时获取数据"""
-    global latest_data
-    
     while True:
         try:
             print(f"[{get_beijing_time().strftime('%Y-%m-%d %H:%M:%S')}] 开始获取电表数据...")
             
             # 获取电表数据
-            data = scraper.fetch_meter_data(url)
+            data = fetch_meter_data()
             
             if data:
-                with data_lock:
-                    latest_data = data
-                    # 保存到文件
-                    scraper.save_data(data, data_file)
-                    # 更新历史数据
-                    update_historical_data(data)
-                    print(f"✅ 数据更新成功: {data['name']} - 剩余电量: {data['remaining_power']} kWh")
+                # 保存到文件（由持久化队列完成）
+                schedule_meter_data_save(data)
+                # 更新历史数据和最新电表数据
+                update_historical_data(data)
+                print(f"✅ 数据更新成功: {data['name']} - 剩余电量: {data['remaining_power']} kWh")
             else:
                 print("❌ 数据获取失败")
                 
         except Exception as e:
             print(f"❌ 后台数据获取异常: {e}")
         
-        # 等待2分钟
-        time.sleep(120)
+        # 等待2分钟（跟随进程请求刷新时提前开始）
+        wait_for_next_fetch(FETCH_INTERVAL_SECONDS)
+
+def fetch_meter_data():
+    """抓取并解析电表数据，记录请求和解析的耗时"""
+    data = scraper.fetch_meter_data(url)
+    for stage, seconds in scraper.last_timings.items():
+        stage_latency.observe(stage, seconds)
+    scrape_results.inc('success' if data else 'failure')
+    return data
+
+def wait_for_next_fetch(interval):
+    """等待下一次定时抓取，期间收到跟随进程的刷新请求时提前返回"""
+    deadline = time.monotonic() + interval
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        time.sleep(min(SHARED_STATE_POLL_SECONDS, remaining))
+        if refresh_signal.consume():
+            if upstream_refresh_limiter.acquire(None):
+                print("⚠️ 跟随进程的刷新请求超过全局限流，等待下一次定时抓取")
+                continue
+            print("🔄 收到跟随进程的刷新请求")
+            return
 
 def periodic_save_background():
-    """定期保存数据到文件"""
+    """定期保存数据到文件，每天执行一次历史记录的过期清理"""
+    last_prune = None
     while True:
         try:
             time.sleep(600)  # 每10分钟保存一次
-            save_historical_data()
+            schedule_state_save()
             print(f"[{get_beijing_time().strftime('%Y-%m-%d %H:%M:%S')}] 📁 定期保存数据完成")
+            
+            today = get_beijing_time().date()
+            if today != last_prune:
+                last_prune = today
+                persistence_queue.submit('prune_history', prune_history, coalesce_key='prune_history')
         except Exception as e:
             print(f"❌ 定期保存数据异常: {e}")
 
+def prune_history():
+    """按存储后端的保留策略删除过期的历史记录（在持久化线程中执行）"""
+    deleted = storage.prune_history()
+    if deleted:
+        print(f"🧹 已清理 {deleted} 条过期历史记录")
+
+def get_client_ip():
+    """当前请求的客户端IP（经过反向代理时取 X-Forwarded-For 的第一个地址）"""
+    client_ip = request.environ.get('HTTP_X_FORWARDED_FOR', request.remote_addr)
+    if client_ip and ',' in client_ip:
+        client_ip = client_ip.split(',')[0].strip()
+    return client_ip
+
 @app.route('/')
 def index():
     """主页"""
     # 记录访问
-    client_ip = request.environ.get('HTTP_X_FORWARDED_FOR', request.remote_addr)
-    if client_ip and ',' in client_ip:
-        client_ip = client_ip.split(',')[0].strip()
+    client_ip = get_client_ip()
     user_agent = request.headers.get('User-Agent', '')
     record_visit(client_ip, user_agent, '/')
     
-    return send_file('monitor.html')
+    return static_assets.response('monitor.html') or send_file('monitor.html')
 
 @app.route('/chart.min.js')
 def get_chart_js():
     """提供Chart.js库文件"""
-    return send_file('chart.min.js', mimetype='application/javascript')
+    return static_assets.response('chart.min.js') or ("File not found", 404)
 
 @app.route('/<path:filename>')
 def static_files(filename):
-    """提供静态文件"""
-    if filename in ['index.html', 'monitor.html', 'style.css', 'script.js', 'chart.min.js']:
-        return send_file(filename)
-    return "File not found", 404
+    """提供静态文件（预压缩版本）"""
+    return static_assets.response(filename) or ("File not found", 404)
 
 @app.route('/api/meter-data')
 def get_meter_data():
     """获取电表数据API"""
     try:
-        with data_lock:
-            if latest_data:
-                # 确保返回数据包含success字段
-                response_data = latest_data.copy()
-                response_data['success'] = True
-                return jsonify(response_data)
+        latest_data = app_state.latest_data
+        if latest_data:
+            # 确保返回数据包含success字段
+            response_data = latest_data.copy()
+            response_data['success'] = True
+            return jsonify(response_data)
+        else:
+            # 尝试从文件读取
+            if os.path.exists(data_file):
+                with open(data_file, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                    # 确保返回数据包含success字段
+                    data['success'] = True
+                    return jsonify(data)
             else:
-                # 尝试从文件读取
-                if os.path.exists(data_file):
-                    with open(data_file, 'r', encoding='utf-8') as f:
-                        data = json.load(f)
-                        # 确保返回数据包含success字段
-                        data['success'] = True
-                        return jsonify(data)
-                else:
-                    return jsonify({
-                        'success': False,
-                        'error': '暂无数据',
-                        'message': '系统正在初始化，请稍后刷新'
-                    }), 503
+                return jsonify({
+                    'success': False,
+                    'error': '暂无数据',
+                    'message': '系统正在初始化，请稍后刷新'
+                }), 503
     except Exception as e:
         return jsonify({
             'success': False,
@@ -214,28 +496,49 @@ def get_meter_data_file():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def refresh_limited(wait):
+    """刷新超过限流时立即返回当前缓存的读数"""
+    return jsonify({
+        'success': False,
+        'message': '刷新过于频繁，已返回缓存数据',
+        'data': app_state.latest_data,
+        'retry_after': retry_after_seconds(wait)
+    }), 429
+
 @app.route('/api/refresh')
+@rate_limited(refresh_limiter, get_client_ip, on_limited=refresh_limited)
 def refresh_data():
     """手动刷新数据"""
     try:
         # 记录刷新统计
         with stats_lock:
             visit_stats['refresh_count'] += 1
+            visit_pending['refresh_count'] += 1
+        
+        # 跟随进程不抓取数据，通知采集进程刷新后返回当前数据
+        if runtime_info['role'] == 'follower':
+            refresh_signal.request()
+            return jsonify({
+                'success': True,
+                'message': '已通知采集进程刷新数据',
+                'data': app_state.latest_data
+            })
+        
+        wait = upstream_refresh_limiter.acquire(None)
+        if wait:
+            return limited_response(wait, refresh_limited)
         
         print(f"[{get_beijing_time().strftime('%Y-%m-%d %H:%M:%S')}] 手动刷新数据...")
         
         # 获取电表数据
-        data = scraper.fetch_meter_data(url)
+        data = fetch_meter_data()
         
         if data:
-            with data_lock:
-                global latest_data
-                latest_data = data
-                # 保存到文件
-                scraper.save_data(data, data_file)
-                # 更新历史数据
-                update_historical_data(data)
-                
+            # 保存到文件（由持久化队列完成）
+            schedule_meter_data_save(data)
+            # 更新历史数据和最新电表数据
+            update_historical_data(data)
+            
             return jsonify({
                 'success': True,
                 'message': '数据刷新成功',
@@ -253,88 +556,344 @@ def refresh_data():
             'message': f'刷新失败: {str(e)}'
         }), 500
 
+@app.route('/api/stream')
+def stream_events():
+    """实时推送新读数（Server-Sent Events），支持 Last-Event-ID 断线续传"""
+    if not event_broker.try_connect():
+        response = jsonify({
+            'success': False,
+            'error': '实时连接数已满，请稍后重试'
+        })
+        response.status_code = 503
+        response.headers['Retry-After'] = '30'
+        return response
+    
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('lastEventId')
+    records = app_state.historical_data
+    response = Response(
+        event_broker.stream(last_event_id, STREAM_HEARTBEAT_SECONDS, STREAM_MAX_SECONDS,
+                            replay=missed_readings, resync_id=records[-1]['timestamp'] if records else ''),
+        mimetype='text/event-stream'
+    )
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # 关闭反向代理缓冲
+    response.call_on_close(event_broker.disconnect)
+    return response
+
+def missed_readings(last_event_id):
+    """由当前状态的历史记录重建 Last-Event-ID 之后的读数事件
+    
+    读数事件的ID就是读数的时间戳，各进程共享同一份历史记录，所以重连到任何进程都能续传。
+    客户端已经收到比本进程更新的读数时没有需要补发的；该时间戳不在内存中、格式不对
+    或错过的读数超过 STREAM_REPLAY_LIMIT 条时返回None，由客户端重新获取完整数据。
+    """
+    try:
+        datetime.fromisoformat(last_event_id)
+    except ValueError:
+        return None
+    records = app_state.historical_data
+    if not records or last_event_id > records[-1]['timestamp']:
+        return []
+    position = bisect.bisect_left(records, last_event_id, key=lambda r: r.get('timestamp', ''))
+    if records[position].get('timestamp') != last_event_id or len(records) - position - 1 > STREAM_REPLAY_LIMIT:
+        return None
+    missed = []
+    for i in range(position + 1, len(records)):
+        previous, record = records[i - 1], records[i]
+        usage = max(0, previous.get('remaining_power', 0) - record.get('remaining_power', 0))
+        missed.append((record['timestamp'], 'reading', dict(record, usage=usage)))
+    return missed
+
+def get_storage_chain():
+    """返回按优先级排列的存储后端（配置的后端优先，本地文件兜底）"""
+    if storage is fallback_storage:
+        return [storage]
+    return [storage, fallback_storage]
+
+def current_state():
+    """当前内存中的监控状态（字典形式，与 app_state 共享数据，不能修改）"""
+    return app_state.as_dict()
+
+def commit_state(build):
+    """以当前状态为基础构建新状态并替换引用，返回 build 的第二个返回值
+
+    build(base) 返回 (新状态, 结果)，构建在锁外进行，data_lock 只保护引用替换和版本号；
+    构建期间状态已被其他写入方替换时，以最新的状态为基础重新构建。
+    """
+    global app_state
+    while True:
+        base = app_state
+        new_state, result = build(base)
+        with data_lock:
+            if app_state is base:
+                # 先替换再更新版本号：读到新版本号的请求一定能读到新状态
+                app_state = new_state
+                data_version.bump()
+                new_state.version = data_version.current()
+                return result
+
 def load_historical_data():
-    """加载历史数据"""
-    global historical_data, ten_minute_usage, hourly_usage_data, daily_usage_data, weekly_usage_data, monthly_usage_data
-    
-    # 初始化数据结构
-    historical_data = []
-    ten_minute_usage = {}
-    hourly_usage_data = {}
-    daily_usage_data = {}
-    weekly_usage_data = {}
-    monthly_usage_data = {}
-    
-    # 优先从云数据库加载数据
-    if is_database_available():
+    """加载启动所需的热数据（最近的历史记录和各维度当前时间桶）"""
+    global loaded_from
+    
+    usage_boundary_keys.update(get_bucket_keys(get_beijing_time()))
+    
+    # 数据库连接在后台建立，启动时最多等待一小段时间
+    if not storage.wait_until_available(STORAGE_STARTUP_WAIT):
+        print(f"⚠️ {storage.label}暂不可用，使用本地文件")
+    
+    # 优先从配置的存储后端加载，失败时使用本地文件
+    for backend in get_storage_chain():
         try:
-            # 从云数据库加载历史数据
-            historical_data = db_manager.get_historical_data()
-            
-            # 从云数据库加载用电统计数据
-            ten_minute_usage = db_manager.get_usage_stats('ten_minute')
-            hourly_usage_data = db_manager.get_usage_stats('hourly')
-            daily_usage_data = db_manager.get_usage_stats('daily')
-            weekly_usage_data = db_manager.get_usage_stats('weekly')
-            monthly_usage_data = db_manager.get_usage_stats('monthly')
-            
-            print(f"✅ 已从云数据库加载监控数据: {len(historical_data)} 条历史记录")
-            return
+            state = backend.load_hot_state(HOT_HISTORY_RECORDS, usage_boundary_keys)
         except Exception as e:
-            print(f"从云数据库加载数据失败: {e}，尝试本地文件")
+            print(f"从{backend.label}加载数据失败: {e}，尝试本地文件")
+            continue
+        
+        # 接替采集时其他线程正在读取共享快照中的数据，整体替换状态（保留最新电表数据）
+        loaded = MonitorState.from_state(state)
+        commit_state(lambda base: (loaded.replace(latest_data=base.latest_data), None))
+        loaded_from = backend
+        for stat_type, _ in USAGE_STAT_TYPES:
+            usage_loaded[stat_type] = not backend.supports_lazy_loading
+        print(f"✅ 已从{backend.label}加载监控数据: {len(state['historical_data'])} 条历史记录")
+        return
+
+def ensure_usage_loaded(stat_type):
+    """按需加载某个维度启动时未加载的旧时间桶"""
+    if usage_loaded[stat_type]:
+        return
     
-    # 备用方案：从本地文件加载数据
-    if os.path.exists(DATA_HISTORY_FILE):
+    with lazy_load_lock:
+        if usage_loaded[stat_type]:
+            return
         try:
-            with open(DATA_HISTORY_FILE, 'r', encoding='utf-8') as f:
-                history = json.load(f)
-                historical_data = history.get('historical_data', [])
-                ten_minute_usage = history.get('ten_minute_usage', {})
-                hourly_usage_data = history.get('hourly_usage_data', {})
-                daily_usage_data = history.get('daily_usage_data', {})
-                weekly_usage_data = history.get('weekly_usage_data', {})
-                monthly_usage_data = history.get('monthly_usage_data', {})
-                
-                print(f"✅ 已从本地文件加载监控数据: {len(historical_data)} 条历史记录")
+            older = loaded_from.load_usage_before(stat_type, usage_boundary_keys[stat_type])
         except Exception as e:
-            print(f"加载本地监控数据失败: {e}")
+            print(f"按需加载{stat_type}统计失败: {e}")
+            return
+        
+        def merge_older(base):
+            # 内存中的时间桶在启动后可能已更新，以内存为准
+            buckets = dict(older)
+            buckets.update(base.usage[stat_type])
+            return base.replace(usage=dict(base.usage, **{stat_type: buckets})), None
+        
+        commit_state(merge_older)
+        usage_loaded[stat_type] = True
+        schedule_shared_state_publish()
+        print(f"✅ 已按需加载{stat_type}统计: {len(older)} 个时间桶")
+
+def warm_up_background():
+    """服务就绪后在后台加载剩余的旧时间桶"""
+    for stat_type, _ in USAGE_STAT_TYPES:
+        ensure_usage_loaded(stat_type)
+
+def query_usage(stat_type):
+    """按请求的 from/to/limit 参数取出某个维度窗口内的时间桶"""
+    ensure_usage_loaded(stat_type)
+    start, end = parse_time_range(request.args)
+    limit = parse_limit(request.args)
+    start_key, end_key = bucket_key_range(stat_type, start, end)
+    return app_state.window(stat_type, start_key, end_key, limit)
+
+def query_stored_records(in_memory, limit, before=None, after=None, start=None):
+    """从存储后端按时间戳索引查询一页记录，并与内存中尚未写入的记录合并
+
+    指定 after 时取其后最早的 limit 条，否则取 before 之前最近的 limit 条（不早于 start）
+    """
+    try:
+        stored = loaded_from.get_records_page(before=before, after=after, limit=limit)
+    except Exception as e:
+        print(f"从{loaded_from.label}查询历史记录失败: {e}")
+        return in_memory
+    
+    merged = {record['timestamp']: record for record in stored if not start or record['timestamp'] >= start}
+    merged.update((record['timestamp'], record) for record in in_memory)
+    ordered = sorted(merged)
+    ordered = ordered[:limit] if after else ordered[-limit:]
+    return [merged[ts] for ts in ordered]
+
+def get_historical_page(before, after, limit, start=None, end=None):
+    """按游标返回一页历史记录（内存中没有的部分从存储后端查询），只返回 [start, end) 窗口内的记录"""
+    # 多取一条，用于判断翻页方向上是否还有记录
+    records = app_state.historical_data
+    if after:
+        upper = min(filter(None, (before, end)), default=None)
+        page, complete = records_page(records, upper, after, limit + 1)
+        if not complete and loaded_from.stores_records_individually:
+            page = query_stored_records(page, limit + 1, before=upper, after=after)
+    else:
+        page, complete = records_window(records, start, before, limit + 1)
+        if not complete and loaded_from.stores_records_individually:
+            page = query_stored_records(page, limit + 1, before=before, start=start)
+    total = len(records)
+    
+    has_more = len(page) > limit
+    if after:
+        page = page[:limit]
+        cursors = page_cursors(page, True, has_more, start, end)
+    else:
+        page = page[-limit:]
+        cursors = page_cursors(page, has_more, True, start, end)
+    
+    return {
+        'success': True,
+        'data': page,
+        'count': len(page),
+        'total': total,
+        'cursors': cursors
+    }
+
+def usage_response(stat_type, data, fmt):
+    """按请求的格式（json/columns/binary）返回某个维度的时间桶"""
+    if fmt == 'json':
+        return {'success': True, 'data': data, 'count': len(data)}
+    return columns_response(usage_columns(stat_type, data), fmt)
 
-def save_historical_data():
+def historical_response(payload, fmt):
+    """按请求的格式返回历史记录，列式和二进制格式同样带总数和翻页游标"""
+    if fmt == 'json':
+        return payload
+    
+    extra = {'total': payload['total'], 'cursors': payload['cursors']}
+    headers = {'X-Total-Count': str(payload['total'])}
+    for name, cursor in payload['cursors'].items():
+        if cursor:
+            headers[f'X-Cursor-{name.capitalize()}'] = cursor
+    return columns_response(records_columns(payload['data']), fmt, extra, headers)
+
+def columns_response(columns, fmt, extra=None, headers=None):
+    """列式JSON，或小端序的二进制（字段说明在响应头中）"""
+    if fmt == 'binary':
+        body, series_headers = encode_binary(columns)
+        return RawBody(body, BINARY_MIMETYPE, dict(series_headers, **(headers or {})))
+    return dict({
+        'success': True,
+        'format': 'columns',
+        'count': len(columns['t']),
+        'columns': columns
+    }, **(extra or {}))
+
+def page_cursors(page, has_older, has_newer, start=None, end=None):
+    """翻页游标：prev 用于 ?before= 获取更早的一页，next 用于 ?after= 获取更新的一页（游标带上 from/to 窗口）"""
+    if not page:
+        return {'prev': None, 'next': None}
+    return {
+        'prev': encode_cursor(page[0]['timestamp'], start, end) if has_older else None,
+        'next': encode_cursor(page[-1]['timestamp'], start, end) if has_newer else None
+    }
+
+def save_historical_data(state=None):
     """保存历史数据"""
-    # 优先保存到云数据库
-    if is_database_available():
+    if state is None:
+        state = current_state()
+    
+    # 优先保存到配置的存储后端，失败时保存到本地文件
+    for backend in get_storage_chain():
         try:
-            # 保存用电统计数据到云数据库
-            db_manager.save_usage_stats('ten_minute', 'data', ten_minute_usage)
-            db_manager.save_usage_stats('hourly', 'data', hourly_usage_data)
-            db_manager.save_usage_stats('daily', 'data', daily_usage_data)
-            db_manager.save_usage_stats('weekly', 'data', weekly_usage_data)
-            db_manager.save_usage_stats('monthly', 'data', monthly_usage_data)
-            
-            print("✅ 数据已保存到云数据库")
+            with persistence_latency.time((backend.name, 'save_state')):
+                backend.save_state(state)
+            print(f"✅ 数据已保存到{backend.label}")
             return
         except Exception as e:
-            print(f"保存到云数据库失败: {e}，尝试本地文件")
+            print(f"保存到{backend.label}失败: {e}，尝试本地文件")
     
-    # 备用方案：保存到本地文件
-    try:
-        history = {
-            'historical_data': historical_data,
-            'ten_minute_usage': ten_minute_usage,
-            'hourly_usage_data': hourly_usage_data,
-            'daily_usage_data': daily_usage_data,
-            'weekly_usage_data': weekly_usage_data,
-            'monthly_usage_data': monthly_usage_data
+    print("保存历史数据失败")
+
+def published_state():
+    """取得当前状态（短暂持有 data_lock，保证状态的版本号已设置）"""
+    with data_lock:
+        return app_state
+
+def schedule_state_save():
+    """把当前状态交给持久化队列保存（状态不可变，不需要复制；排队中的旧状态会被替换）"""
+    with state_save_lock:
+        current = published_state()
+        persistence_queue.submit('save_state', save_historical_data, current.as_dict(), coalesce_key='save_state')
+        schedule_shared_state_publish(current)
+
+def schedule_shared_state_publish(current=None):
+    """采集进程把当前状态写入共享快照，供其他工作进程加载"""
+    if runtime_info['role'] != 'ingester':
+        return
+    with state_save_lock:
+        if current is None:
+            current = published_state()
+        version_tag, updated_at = current.version or data_version.current()
+        meta = {
+            'pid': os.getpid(),
+            'version': version_tag,
+            'updated_at': updated_at,
+            'backend': loaded_from.name,
+            'latest_data': current.latest_data,
+            'last_reading': last_reading
         }
-        with open(DATA_HISTORY_FILE, 'w', encoding='utf-8') as f:
-            json.dump(history, f, ensure_ascii=False, indent=2)
-        print("✅ 数据已保存到本地文件")
-    except Exception as e:
-        print(f"保存历史数据失败: {e}")
+        persistence_queue.submit('publish_shared_state', publish_shared_state, meta, current.as_dict(),
+                                 coalesce_key='publish_shared_state')
+
+def publish_shared_state(meta, state):
+    """写入共享快照文件（在持久化队列的写线程中执行）"""
+    with persistence_latency.time(('shared_snapshot', 'publish')):
+        shared_state.publish(meta, state, USAGE_STAT_TYPES)
+
+def adopt_shared_state():
+    """共享快照变化时换用新的映射，返回是否加载了新快照
+
+    历史记录和时间桶替换为映射上的只读视图，访问时才解码，进程内不再保存数据副本。
+    """
+    global app_state, loaded_from, last_reading
+    
+    snapshot = shared_state.load_if_changed()
+    if snapshot is None or snapshot.meta['pid'] == os.getpid():
+        return False
+    
+    meta = snapshot.meta
+    usage_index = {}
+    for stat_type, buckets in snapshot.usage.items():
+        usage_index[stat_type] = SortedKeyIndex()
+        usage_index[stat_type].attach(buckets.keys_sequence)
+    mapped = MonitorState(snapshot.records, dict(snapshot.usage), usage_index, meta['latest_data'])
+    
+    loaded_from = storage if meta['backend'] == storage.name else fallback_storage
+    # 旧时间桶由采集进程加载后随快照发布，跟随进程不再按需加载
+    for stat_type, _ in USAGE_STAT_TYPES:
+        usage_loaded[stat_type] = True
+    with data_lock:
+        app_state = mapped
+        data_version.adopt(meta['version'], meta['updated_at'])
+        mapped.version = data_version.current()
+    
+    # 把新读数转发给本进程的实时连接（首次加载时只记录，不重复推送）
+    reading = meta.get('last_reading')
+    if reading and last_reading is not None and reading != last_reading:
+        event_broker.publish('reading', reading, reading['timestamp'])
+    last_reading = reading
+    runtime_info['snapshot_loads'] += 1
+    runtime_info['snapshot_bytes'] = snapshot.size
+    return True
+
+def schedule_meter_data_save(data):
+    """把最新电表数据交给持久化队列写入文件"""
+    persistence_queue.submit('save_meter_data', scraper.save_data, dict(data), data_file, coalesce_key='save_meter_data')
+
+def flush_persistence(timeout=None):
+    """等待持久化队列中的任务全部完成（用于测试和退出前落盘）"""
+    return persistence_queue.flush(timeout)
+
+def append_historical_record(record):
+    """持久化单条历史记录"""
+    for backend in get_storage_chain():
+        try:
+            with persistence_latency.time((backend.name, 'append_record')):
+                backend.append_record(record)
+            return
+        except Exception as e:
+            print(f"保存历史记录到{backend.label}失败: {e}")
 
 def update_historical_data(data):
-    """更新历史数据和多时间维度用电统计"""
-    global historical_data, ten_minute_usage, hourly_usage_data, daily_usage_data, weekly_usage_data, monthly_usage_data
+    """写入新读数：构建包含新记录、更新后的多时间维度用电统计和最新电表数据的新状态，然后替换"""
+    global last_reading
     
     now = get_beijing_time()
     timestamp = now.isoformat()
@@ -346,125 +905,86 @@ def update_historical_data(data):
         'remaining_amount': data.get('remaining_amount', 0),
         'unit_price': data.get('unit_price', 0)
     }
+    bucket_keys = get_bucket_keys(now)
+    cutoff_keys = expired_bucket_cutoffs(now)
     
-    historical_data.append(record)
-    
-    # 保持最大记录数
-    if len(historical_data) > MAX_HISTORY_RECORDS:
-        historical_data = historical_data[-MAX_HISTORY_RECORDS:]
-    
-    # 立即保存数据以增强持久化
-    save_historical_data()
-    
-    # 计算用电量变化（基于剩余电量差值）
-    usage = 0
-    if len(historical_data) >= 2:
-        prev_power = historical_data[-2].get('remaining_power', 0)
-        curr_power = data.get('remaining_power', 0)
-        usage = max(0, prev_power - curr_power)  # 用电量为正值
-    
-    # 更新10分钟用电数据
-    ten_min_rounded = now.replace(minute=(now.minute // 10) * 10, second=0, microsecond=0)
-    ten_min_key = ten_min_rounded.strftime('%Y-%m-%d %H:%M')
-    if ten_min_key not in ten_minute_usage:
-        ten_minute_usage[ten_min_key] = {'usage': 0, 'count': 0, 'avg_power': 0}
-    ten_minute_usage[ten_min_key]['usage'] += usage
-    ten_minute_usage[ten_min_key]['count'] += 1
-    ten_minute_usage[ten_min_key]['avg_power'] = data.get('remaining_power', 0)
-    
-    # 更新每小时用电数据
-    hour_key = now.strftime('%Y-%m-%d-%H')
-    if hour_key not in hourly_usage_data:
-        hourly_usage_data[hour_key] = {'usage': 0, 'count': 0, 'avg_power': 0}
-    hourly_usage_data[hour_key]['usage'] += usage
-    hourly_usage_data[hour_key]['count'] += 1
-    hourly_usage_data[hour_key]['avg_power'] = data.get('remaining_power', 0)
-    
-    # 更新每日用电数据
-    day_key = now.strftime('%Y-%m-%d')
-    if day_key not in daily_usage_data:
-        daily_usage_data[day_key] = {'usage': 0, 'count': 0, 'avg_power': 0, 'peak_power': 0}
-    daily_usage_data[day_key]['usage'] += usage
-    daily_usage_data[day_key]['count'] += 1
-    daily_usage_data[day_key]['avg_power'] = data.get('remaining_power', 0)
-    daily_usage_data[day_key]['peak_power'] = max(daily_usage_data[day_key]['peak_power'], data.get('remaining_power', 0))
-    
-    # 更新每周用电数据
-    week_start = now - timedelta(days=now.weekday())
-    week_key = week_start.strftime('%Y-W%U')
-    if week_key not in weekly_usage_data:
-        weekly_usage_data[week_key] = {'usage': 0, 'count': 0, 'avg_power': 0}
-    weekly_usage_data[week_key]['usage'] += usage
-    weekly_usage_data[week_key]['count'] += 1
-    weekly_usage_data[week_key]['avg_power'] = data.get('remaining_power', 0)
-    
-    # 更新每月用电数据
-    month_key = now.strftime('%Y-%m')
-    if month_key not in monthly_usage_data:
-        monthly_usage_data[month_key] = {'usage': 0, 'count': 0, 'avg_power': 0}
-    monthly_usage_data[month_key]['usage'] += usage
-    monthly_usage_data[month_key]['count'] += 1
-    monthly_usage_data[month_key]['avg_power'] = data.get('remaining_power', 0)
+    def add_reading(base):
+        # 计算用电量变化（基于剩余电量差值）
+        usage = 0
+        if base.historical_data:
+            prev_power = base.historical_data[-1].get('remaining_power', 0)
+            usage = max(0, prev_power - record['remaining_power'])  # 用电量为正值
+        
+        # 保持最大记录数
+        historical = base.historical_data[-(MAX_HISTORY_RECORDS - 1):]
+        historical.append(record)
+        
+        usage_state = {}
+        usage_index = {}
+        for stat_type, _ in USAGE_STAT_TYPES:
+            usage_state[stat_type], usage_index[stat_type] = roll_up_usage(
+                stat_type, base.usage[stat_type], base.usage_index[stat_type],
+                bucket_keys[stat_type], cutoff_keys[stat_type], usage, record['remaining_power'])
+        return MonitorState(historical, usage_state, usage_index, data), usage
     
-    # 清理过期数据
-    cleanup_expired_data(now)
+    with stage_latency.time('rollup'):
+        usage = commit_state(add_reading)
     
-    save_historical_data()
+    # 立即保存记录以增强持久化（由持久化队列完成）
+    persistence_queue.submit('append_record', append_historical_record, record)
+    last_reading = dict(record, usage=usage)
+    event_broker.publish('reading', last_reading, record['timestamp'])
+    schedule_state_save()
 
-def cleanup_expired_data(current_time):
-    """清理过期数据"""
-    global ten_minute_usage, hourly_usage_data, daily_usage_data, weekly_usage_data, monthly_usage_data
+def roll_up_usage(stat_type, buckets, index, key, cutoff_key, usage, power):
+    """把本次用电量累加到 key 时间桶并清理早于 cutoff_key 的时间桶，返回新的时间桶字典和索引（不修改原有的）"""
+    if key in buckets:
+        bucket = copy_bucket(buckets[key])
+    else:
+        bucket = {'usage': 0, 'count': 0, 'avg_power': 0}
+        if stat_type == 'daily':
+            bucket['peak_power'] = 0
+    bucket['usage'] += usage
+    bucket['count'] += 1
+    bucket['avg_power'] = power
+    if stat_type == 'daily':
+        bucket['peak_power'] = max(bucket.get('peak_power', 0), power)
     
-    try:
-        # 清理10分钟数据（保留最近24小时）
-        cutoff_10min = current_time - timedelta(hours=24)
-        cutoff_10min_key = cutoff_10min.strftime('%Y-%m-%d %H:%M')
-        keys_to_remove = [k for k in ten_minute_usage.keys() if k < cutoff_10min_key]
-        for key in keys_to_remove:
-            del ten_minute_usage[key]
-        
-        # 清理小时数据（保留最近30天）
-        cutoff_hour = current_time - timedelta(days=30)
-        cutoff_hour_key = cutoff_hour.strftime('%Y-%m-%d-%H')
-        keys_to_remove = [k for k in hourly_usage_data.keys() if k < cutoff_hour_key]
-        for key in keys_to_remove:
-            del hourly_usage_data[key]
-        
-        # 清理日数据（保留最近365天）
-        cutoff_day = current_time - timedelta(days=365)
-        cutoff_day_key = cutoff_day.strftime('%Y-%m-%d')
-        keys_to_remove = [k for k in daily_usage_data.keys() if k < cutoff_day_key]
-        for key in keys_to_remove:
-            del daily_usage_data[key]
-        
-        # 清理周数据（保留最近52周）
-        cutoff_week = current_time - timedelta(weeks=52)
-        cutoff_week_key = cutoff_week.strftime('%Y-W%U')
-        keys_to_remove = [k for k in weekly_usage_data.keys() if k < cutoff_week_key]
-        for key in keys_to_remove:
-            del weekly_usage_data[key]
-        
-        # 清理月数据（保留最近24个月）
-        cutoff_month = current_time - timedelta(days=730)  # 约24个月
-        cutoff_month_key = cutoff_month.strftime('%Y-%m')
-        keys_to_remove = [k for k in monthly_usage_data.keys() if k < cutoff_month_key]
-        for key in keys_to_remove:
-            del monthly_usage_data[key]
-            
-    except Exception as e:
-        print(f"清理过期数据失败: {e}")
+    updated = {k: v for k, v in buckets.items() if k >= cutoff_key}
+    updated[key] = bucket
+    updated_index = index.copy()
+    updated_index.add(key)
+    updated_index.discard_before(cutoff_key)
+    return updated, updated_index
+
+def expired_bucket_cutoffs(current_time):
+    """各维度过期时间桶的分界键，早于它的时间桶会被清理"""
+    return {
+        stat_type: (current_time - keep).strftime(key_format)
+        for stat_type, (keep, key_format) in USAGE_RETENTION.items()
+    }
 
 @app.route('/api/status')
 def get_status():
     """获取系统状态"""
     try:
+        current = app_state
+        latest_data = current.latest_data
         status = {
             'success': True,
             'server_time': get_beijing_time().isoformat(),
             'data_available': latest_data is not None,
             'data_file_exists': os.path.exists(data_file),
-            'historical_records': len(historical_data),
-            'hourly_records': len(hourly_usage_data),
+            'historical_records': len(current.historical_data),
+            'hourly_records': len(current.usage['hourly']),
+            'usage_loaded': dict(usage_loaded),
+            'startup': startup_stats,
+            'persistence': persistence_queue.stats(),
+            'response_cache': response_cache.stats(),
+            'stream': event_broker.stats(),
+            'visits': {'queue': visit_queue.stats(), 'geoip': location_resolver.stats(), 'flush': dict(visit_flush_info)},
+            'rate_limits': {limiter.name: limiter.stats() for limiter in (refresh_limiter, upstream_refresh_limiter, query_limiter)},
+            'runtime': dict(runtime_info, ingester_pid=ingester_lock.holder_pid()),
             'system_status': 'running'
         }
         
@@ -480,22 +1000,119 @@ def get_status():
             'system_status': 'error'
         }), 500
 
+@app.route('/api/metrics')
+def get_metrics():
+    """各路由的请求数、错误数、进行中的请求数和延迟，以及内部各阶段的耗时（延迟为直方图估计值）"""
+    return jsonify({
+        'success': True,
+        'data': {
+            'routes': request_metrics.summary(),
+            'stages': {stage: summarize_histogram(stage_latency.buckets, entry)
+                       for stage, entry in stage_latency.snapshot().items()},
+            'persistence': {f'{backend}/{operation}': summarize_histogram(persistence_latency.buckets, entry)
+                            for (backend, operation), entry in persistence_latency.snapshot().items()},
+            'server_time': get_beijing_time().isoformat()
+        }
+    })
+
+def data_age_seconds(current):
+    """最新一条历史记录距今的秒数（没有记录时返回None）"""
+    if not len(current.historical_data):
+        return None
+    try:
+        last = datetime.fromisoformat(current.historical_data[-1]['timestamp'])
+    except (KeyError, ValueError):
+        return None
+    return max(0.0, time.time() - last.timestamp())
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus 文本格式的指标
+
+    只读取状态引用和各计数器的分段，不获取 data_lock、stats_lock 和队列的锁；
+    gunicorn 下每个工作进程各自计数，pid 和 role 见 meter_monitor_worker_info。
+    """
+    current = app_state
+    writer = PrometheusWriter()
+    writer.metric('meter_monitor_worker_info', 'gauge', '当前工作进程（值恒为1）',
+                  {(os.getpid(), runtime_info['role'] or 'none'): 1}, ('pid', 'role'))
+    scrapes = scrape_results.snapshot()
+    writer.metric('meter_monitor_scrapes_total', 'counter', '抓取电表数据的次数',
+                  {result: scrapes.get(result, 0) for result in ('success', 'failure')}, ('result',))
+    writer.histogram('meter_monitor_stage_duration_seconds', '内部阶段耗时（fetch 为请求电表网站，parse 为解析页面，rollup 为更新统计）',
+                     stage_latency, ('stage',))
+    writer.histogram('meter_monitor_persistence_duration_seconds', '持久化耗时（按存储后端和操作）',
+                     persistence_latency, ('backend', 'operation'))
+    writer.metric('meter_monitor_queue_depth', 'gauge', '队列中等待执行的任务数',
+                  {'persistence': persistence_queue.depth(), 'visit': visit_queue.depth()}, ('queue',))
+    writer.metric('meter_monitor_history_records', 'gauge', '内存中的历史记录条数',
+                  {(): len(current.historical_data)})
+    writer.metric('meter_monitor_usage_buckets', 'gauge', '内存中各维度的时间桶数',
+                  {stat_type: len(buckets) for stat_type, buckets in current.usage.items()}, ('stat_type',))
+    age = data_age_seconds(current)
+    if age is not None:
+        writer.metric('meter_monitor_data_age_seconds', 'gauge', '最新读数距今的秒数', {(): round(age, 3)})
+    rss = resident_memory_bytes()
+    if rss is not None:
+        writer.metric('process_resident_memory_bytes', 'gauge', '进程常驻内存（字节）', {(): rss})
+    writer.metric('meter_monitor_http_requests_total', 'counter', 'HTTP请求数（按方法、路由规则和状态码）',
+                  request_metrics.requests.snapshot(), ('method', 'route', 'status'))
+    writer.metric('meter_monitor_http_requests_in_flight', 'gauge', '正在处理的HTTP请求数',
+                  request_metrics.in_flight.snapshot(), ('method', 'route'))
+    writer.histogram('meter_monitor_http_request_duration_seconds', 'HTTP请求延迟（按方法和路由规则）',
+                     request_metrics.latency, ('method', 'route'))
+    return Response(writer.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
 @app.route('/api/historical-data')
+@cached_json(data_version, response_cache)
+@rate_limited(query_limiter, get_client_ip)
 def get_historical_data():
-    """获取历史数据"""
+    """获取历史数据
+
+    - from/to: 时间窗口，返回窗口内最近的 limit 条
+    - before/after: 分页游标（来自上一页返回的 cursors.prev / cursors.next），分别向更早/更新的方向翻页
+    """
     try:
-        # 支持查询参数控制返回数据量
-        limit = request.args.get('limit', default=100, type=int)
-        limit = min(limit, 200)  # 最多返回200条记录
+        start, end = parse_time_range(request.args)
+        limit = parse_limit(request.args, default=100, maximum=HISTORY_QUERY_MAX_LIMIT)
+        before = decode_cursor(request.args.get('before'))
+        after = decode_cursor(request.args.get('after'))
+        fmt = parse_format(request.args)
+        if (before or after) and (start or end):
+            raise ValueError('before/after 不能与 from/to 同时使用')
         
-        # 返回最近的数据
-        recent_data = historical_data[-limit:] if len(historical_data) > limit else historical_data
-        return jsonify({
+        if before or after:
+            # 来自 from/to 窗口的游标带有窗口的起止时间，翻页时不会超出窗口
+            _, window_start, window_end = before or after
+            page = get_historical_page(before and before[0], after and after[0], limit, window_start, window_end)
+            return historical_response(page, fmt)
+        
+        start_ts = start.isoformat() if start else None
+        end_ts = end.isoformat() if end else None
+        
+        # 多取一条，用于判断是否还有更早的记录
+        records = app_state.historical_data
+        recent_data, complete = records_window(records, start_ts, end_ts, limit + 1)
+        total = len(records)
+        
+        if not complete and loaded_from.stores_records_individually:
+            # 窗口早于内存中的记录，从存储后端按时间戳索引查询
+            recent_data = query_stored_records(recent_data, limit + 1, before=end_ts, start=start_ts)
+        
+        has_older = len(recent_data) > limit
+        recent_data = recent_data[-limit:]
+        return historical_response({
             'success': True,
             'data': recent_data,
             'count': len(recent_data),
-            'total': len(historical_data)
-        })
+            'total': total,
+            'cursors': page_cursors(recent_data, has_older, False, start_ts, end_ts)
+        }, fmt)
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
     except Exception as e:
         return jsonify({
             'success': False,
@@ -503,14 +1120,17 @@ def get_historical_data():
         }), 500
 
 @app.route('/api/10min-usage')
+@cached_json(data_version, response_cache)
 def get_10min_usage():
     """获取每10分钟用电量数据"""
     try:
+        fmt = parse_format(request.args)
+        return usage_response('ten_minute', query_usage('ten_minute'), fmt)
+    except ValueError as e:
         return jsonify({
-            'success': True,
-            'data': ten_minute_usage,
-            'count': len(ten_minute_usage)
-        })
+            'success': False,
+            'error': str(e)
+        }), 400
     except Exception as e:
         return jsonify({
             'success': False,
@@ -518,14 +1138,17 @@ def get_10min_usage():
         }), 500
 
 @app.route('/api/hourly-usage')
+@cached_json(data_version, response_cache)
 def get_hourly_usage():
     """获取每小时用电量数据"""
     try:
+        fmt = parse_format(request.args)
+        return usage_response('hourly', query_usage('hourly'), fmt)
+    except ValueError as e:
         return jsonify({
-            'success': True,
-            'data': hourly_usage_data,
-            'count': len(hourly_usage_data)
-        })
+            'success': False,
+            'error': str(e)
+        }), 400
     except Exception as e:
         return jsonify({
             'success': False,
@@ -533,14 +1156,17 @@ def get_hourly_usage():
         }), 500
 
 @app.route('/api/daily-usage')
+@cached_json(data_version, response_cache)
 def get_daily_usage():
     """获取每日用电量数据"""
     try:
+        fmt = parse_format(request.args)
+        return usage_response('daily', query_usage('daily'), fmt)
+    except ValueError as e:
         return jsonify({
-            'success': True,
-            'data': daily_usage_data,
-            'count': len(daily_usage_data)
-        })
+            'success': False,
+            'error': str(e)
+        }), 400
     except Exception as e:
         return jsonify({
             'success': False,
@@ -548,14 +1174,17 @@ def get_daily_usage():
         }), 500
 
 @app.route('/api/weekly-usage')
+@cached_json(data_version, response_cache)
 def get_weekly_usage():
     """获取每周用电量数据"""
     try:
+        fmt = parse_format(request.args)
+        return usage_response('weekly', query_usage('weekly'), fmt)
+    except ValueError as e:
         return jsonify({
-            'success': True,
-            'data': weekly_usage_data,
-            'count': len(weekly_usage_data)
-        })
+            'success': False,
+            'error': str(e)
+        }), 400
     except Exception as e:
         return jsonify({
             'success': False,
@@ -563,14 +1192,17 @@ def get_weekly_usage():
         }), 500
 
 @app.route('/api/monthly-usage')
+@cached_json(data_version, response_cache)
 def get_monthly_usage():
     """获取每月用电量数据"""
     try:
+        fmt = parse_format(request.args)
+        return usage_response('monthly', query_usage('monthly'), fmt)
+    except ValueError as e:
         return jsonify({
-            'success': True,
-            'data': monthly_usage_data,
-            'count': len(monthly_usage_data)
-        })
+            'success': False,
+            'error': str(e)
+        }), 400
     except Exception as e:
         return jsonify({
             'success': False,
@@ -582,19 +1214,21 @@ def get_traffic_stats():
     """获取流量统计数据"""
     try:
         with stats_lock:
-            # 转换set为list以便JSON序列化
-            unique_visitors_list = list(visit_stats['unique_visitors'])
             daily_visits_dict = dict(visit_stats['daily_visits'])
+            daily_unique = visit_stats['daily_unique_visitors']
+            recent_days = sorted(daily_unique)[-7:]
             
             # 获取最近的访问记录
-            recent_visitors = visit_stats['visitor_details'][-50:]  # 最近50条记录
+            recent_visitors = list(islice(reversed(visit_stats['visitor_details']), 50))[::-1]  # 最近50条记录
             
             return jsonify({
                 'success': True,
                 'data': {
                     'total_visits': visit_stats['total_visits'],
-                    'unique_visitors_count': len(unique_visitors_list),
-                    'unique_visitors': unique_visitors_list,
+                    # 独立访客数是 HyperLogLog 估计值（误差约1.6%），IP列表见 /api/admin/visitors
+                    'unique_visitors_count': visit_stats['unique_visitors'].count(),
+                    'daily_unique_visitors': {day: sketch.count() for day, sketch in daily_unique.items()},
+                    'unique_visitors_7d': HyperLogLog.union(daily_unique[day] for day in recent_days).count(),
                     'daily_visits': daily_visits_dict,
                     'refresh_count': visit_stats['refresh_count'],
                     'recent_visitors': recent_visitors,
@@ -607,37 +1241,64 @@ def get_traffic_stats():
             'error': str(e)
         }), 500
 
+def admin_authorized():
+    """请求是否带有正确的管理令牌（X-Admin-Token 头或 Authorization: Bearer）；未配置 ADMIN_TOKEN 时一律拒绝"""
+    if not ADMIN_TOKEN:
+        return False
+    token = request.headers.get('X-Admin-Token', '')
+    authorization = request.headers.get('Authorization', '')
+    if not token and authorization.startswith('Bearer '):
+        token = authorization[len('Bearer '):].strip()
+    return hmac.compare_digest(token.encode('utf-8'), ADMIN_TOKEN.encode('utf-8'))
+
+@app.route('/api/admin/visitors')
+@rate_limited(query_limiter, get_client_ip)
+def get_admin_visitors():
+    """管理接口：分页列出最近访问的IP（按最近访问时间倒序）
+
+    参数：offset（默认0）、limit（默认100，最大1000）
+    """
+    if not admin_authorized():
+        return jsonify({
+            'success': False,
+            'error': '需要管理令牌' if ADMIN_TOKEN else '管理接口未启用（未配置 ADMIN_TOKEN）'
+        }), 403
+    try:
+        limit = parse_limit(request.args, default=100, maximum=1000)
+        offset = int(request.args.get('offset') or 0)
+        if offset < 0:
+            raise ValueError('offset 不能为负数')
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+
+    with stats_lock:
+        visitor_index = visit_stats['visitor_index']
+        total = len(visitor_index)
+        page = [dict(visitor, ip=ip) for ip, visitor in islice(reversed(visitor_index.items()), offset, offset + limit)]
+
+    next_offset = offset + len(page)
+    return jsonify({
+        'success': True,
+        'data': {
+            'visitors': page,
+            'total': total,
+            'capacity': VISITOR_INDEX_SIZE,
+            'next_offset': next_offset if next_offset < total else None
+        }
+    })
+
 @app.route('/api/usage-summary')
 def get_usage_summary():
     """获取用电量汇总数据"""
+    ensure_usage_loaded('ten_minute')
     try:
-        current_time = get_beijing_time()
-        
-        # 今日用电量
-        today_key = current_time.strftime('%Y-%m-%d')
-        today_usage = daily_usage_data.get(today_key, {'usage': 0, 'avg_power': 0})
-        
-        # 本周用电量
-        week_start = current_time - timedelta(days=current_time.weekday())
-        week_key = week_start.strftime('%Y-W%U')
-        week_usage = weekly_usage_data.get(week_key, {'usage': 0, 'avg_power': 0})
-        
-        # 本月用电量
-        month_key = current_time.strftime('%Y-%m')
-        month_usage = monthly_usage_data.get(month_key, {'usage': 0, 'avg_power': 0})
-        
-        # 最近24小时用电量
-        recent_24h_usage = sum([data.get('usage', 0) for data in ten_minute_usage.values()])
-        
+        summary = build_usage_summary(app_state)
         return jsonify({
             'success': True,
-            'data': {
-                'today': today_usage,
-                'this_week': week_usage,
-                'this_month': month_usage,
-                'recent_24h': recent_24h_usage,
-                'current_power': latest_data.get('remaining_power', 0) if latest_data else 0
-            }
+            'data': summary
         })
     except Exception as e:
         return jsonify({
@@ -645,57 +1306,250 @@ def get_usage_summary():
             'error': str(e)
         }), 500
 
-def initialize_data():
-    """初始化数据"""
-    global latest_data
+def build_usage_summary(current):
+    """按给定的状态计算用电量汇总"""
+    current_time = get_beijing_time()
+    
+    # 今日用电量
+    today_key = current_time.strftime('%Y-%m-%d')
+    today_usage = current.usage['daily'].get(today_key, {'usage': 0, 'avg_power': 0})
     
+    # 本周用电量
+    week_start = current_time - timedelta(days=current_time.weekday())
+    week_key = week_start.strftime('%Y-W%U')
+    week_usage = current.usage['weekly'].get(week_key, {'usage': 0, 'avg_power': 0})
+    
+    # 本月用电量
+    month_key = current_time.strftime('%Y-%m')
+    month_usage = current.usage['monthly'].get(month_key, {'usage': 0, 'avg_power': 0})
+    
+    # 最近24小时用电量
+    recent_24h_usage = sum([data.get('usage', 0) for data in current.usage['ten_minute'].values()])
+    
+    return {
+        'today': today_usage,
+        'this_week': week_usage,
+        'this_month': month_usage,
+        'recent_24h': recent_24h_usage,
+        'current_power': current.latest_data.get('remaining_power', 0) if current.latest_data else 0
+    }
+
+def summary_period():
+    """用电量汇总的统计周期：今日（北京时间）和今日零点的时间戳
+
+    汇总中的今日、本周、本月都由当前日期决定，日期变化后即使没有新数据，缓存的响应也要重新构建。
+    """
+    midnight = get_beijing_time().replace(hour=0, minute=0, second=0, microsecond=0)
+    return midnight.strftime('%Y-%m-%d'), midnight.timestamp()
+
+@app.route('/api/dashboard')
+@cached_json(data_version, response_cache, vary=summary_period)
+@rate_limited(query_limiter, get_client_ip)
+def get_dashboard():
+    """一次返回页面需要的全部数据（同一时刻的一致快照），sections 参数选择需要的部分"""
+    try:
+        sections = parse_dashboard_sections(request.args.get('sections'))
+        fmt = parse_format(request.args, allowed=('json', 'columns'))
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    
+    try:
+        for stat_type, _ in USAGE_STAT_TYPES:
+            if stat_type in sections:
+                ensure_usage_loaded(stat_type)
+        if 'summary' in sections:
+            ensure_usage_loaded('ten_minute')
+        
+        # 所有部分都从同一个状态读取，保证彼此一致
+        current = app_state
+        result = {section: build_dashboard_section(current, section, fmt) for section in sections}
+        
+        # 响应按数据版本缓存，只包含由数据版本（和 summary_period）决定的内容
+        data_updated_at = (current.version or data_version.current())[1]
+        return {
+            'success': True,
+            'data_updated_at': datetime.fromtimestamp(data_updated_at, BEIJING_TZ).isoformat(),
+            'sections': result
+        }
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+def parse_dashboard_sections(value):
+    """解析 sections 参数（逗号分隔），未指定时返回全部"""
+    if not value:
+        return list(DASHBOARD_SECTIONS)
+    sections = [section.strip() for section in value.split(',') if section.strip()]
+    unknown = [section for section in sections if section not in DASHBOARD_SECTIONS]
+    if unknown:
+        raise ValueError(f"未知的sections: {', '.join(unknown)}（可选: {', '.join(DASHBOARD_SECTIONS)}）")
+    return list(dict.fromkeys(sections))
+
+def build_dashboard_section(current, section, fmt='json'):
+    """按给定的状态构建仪表盘的一个部分，格式与对应的单独接口一致"""
+    if section == 'meter':
+        # 只使用状态中的数据（启动时 meter_data.json 已载入状态），不读文件，保证与数据版本一致
+        if current.latest_data:
+            return dict(current.latest_data, success=True)
+        return {'success': False, 'error': '暂无数据', 'message': '系统正在初始化，请稍后刷新'}
+    if section == 'summary':
+        return {'success': True, 'data': build_usage_summary(current)}
+    if section == 'historical':
+        recent_data = current.historical_data[-100:]
+        total = len(current.historical_data)
+        if fmt == 'columns':
+            return columns_response(records_columns(recent_data), fmt, {'total': total})
+        return {'success': True, 'data': recent_data, 'count': len(recent_data), 'total': total}
+    return usage_response(section, current.window(section), fmt)
+
+def initialize_data():
+    """初始化数据（只加载热数据，首次抓取由后台线程完成）"""
+    started = time.perf_counter()
+    startup_stats['started_at'] = get_beijing_time().isoformat()
     print("正在初始化电表监控系统...")
     
     # 加载历史数据
     print("正在加载历史数据...")
     load_historical_data()
-    print(f"已加载 {len(historical_data)} 条历史记录")
+    print(f"已加载 {len(app_state.historical_data)} 条历史记录")
     
     # 尝试从文件加载现有数据
     if os.path.exists(data_file):
         try:
             with open(data_file, 'r', encoding='utf-8') as f:
                 latest_data = json.load(f)
-                print(f"✅ 加载现有数据: {latest_data.get('name', '未知电表')}")
+            commit_state(lambda base: (base.replace(latest_data=latest_data), None))
+            print(f"✅ 加载现有数据: {latest_data.get('name', '未知电表')}")
         except Exception as e:
             print(f"❌ 加载现有数据失败: {e}")
     
-    # 立即获取一次新数据
-    try:
-        print("正在获取最新电表数据...")
-        data = scraper.fetch_meter_data(url)
-        if data:
-            latest_data = data
-            scraper.save_data(data, data_file)
-            update_historical_data(data)
-            print(f"✅ 初始数据获取成功: {data['name']}")
-        else:
-            print("❌ 初始数据获取失败")
-    except Exception as e:
-        print(f"❌ 初始数据获取异常: {e}")
+    startup_stats['ready_at'] = get_beijing_time().isoformat()
+    startup_stats['time_to_ready'] = round(time.perf_counter() - started, 3)
+    startup_stats['backend'] = loaded_from.name
+    print(f"⏱️ 启动就绪耗时: {startup_stats['time_to_ready']}s（{loaded_from.label}）")
 
-if __name__ == '__main__':
-    print("="*50)
-    print("电表监控系统启动中...")
-    print("="*50)
+def start_runtime():
+    """启动当前进程的运行时（每个进程只启动一次）
+
+    取得采集锁的进程加载数据并启动抓取、预热和定期保存线程，其他进程跟随共享快照。
+    直接运行 app.py 时在启动Flask前调用，gunicorn 下由 gunicorn.conf.py 在每个工作进程启动后调用。
+    """
+    with runtime_lock:
+        if runtime_info['pid'] == os.getpid():
+            return runtime_info['role']
+        runtime_info['pid'] = os.getpid()
+        runtime_info['started_at'] = get_beijing_time().isoformat()
+    
+    # 每个进程都会收到访问请求，各自把访问统计增量合并到存储
+    visit_flush_thread = threading.Thread(target=visit_flush_background, daemon=True)
+    visit_flush_thread.start()
+    
+    if ingester_lock.try_acquire():
+        become_ingester()
+    else:
+        become_follower()
+    return runtime_info['role']
+
+def materialize_state():
+    """把映射上的只读视图复制为普通的列表和字典
+    
+    采集进程会在当前状态上追加读数并交给存储后端保存，接替后即使从存储重新加载失败也不会把视图交给后端。
+    内容和版本都不变，只替换容器。
+    """
+    global app_state
+    
+    with data_lock:
+        current = app_state
+        if isinstance(current.historical_data, list):
+            return
+        materialized = MonitorState(
+            current.historical_data[:],
+            {stat_type: dict(buckets.items()) for stat_type, buckets in current.usage.items()},
+            latest_data=current.latest_data
+        )
+        materialized.version = current.version
+        app_state = materialized
+
+def become_ingester(promoted=False):
+    """成为采集进程：从存储加载数据，发布共享快照并启动后台线程"""
+    runtime_info['role'] = 'ingester'
+    if promoted:
+        # 先加载上一个采集进程最后发布的快照，重新从存储加载期间继续提供数据，版本号也保持连续
+        adopt_shared_state()
+        materialize_state()
+        # 接替之前的刷新请求已由上一个采集进程处理，不再重复抓取
+        refresh_signal.reset()
+        runtime_info['promoted_at'] = get_beijing_time().isoformat()
+        print(f"✅ 进程 {os.getpid()} 接替成为采集进程")
     
-    # 初始化数据
     initialize_data()
+    schedule_shared_state_publish()
     
     # 启动后台数据获取线程
     background_thread = threading.Thread(target=fetch_data_background, daemon=True)
     background_thread.start()
-    print("✅ 后台数据获取线程已启动（每2分钟更新一次）")
+    print(f"✅ 后台数据获取线程已启动（每{FETCH_INTERVAL_SECONDS // 60}分钟更新一次）")
+    
+    # 启动旧数据预热线程
+    warm_up_thread = threading.Thread(target=warm_up_background, daemon=True)
+    warm_up_thread.start()
+    print("✅ 旧数据预热线程已启动（按需加载更早的时间桶）")
     
     # 启动定期保存线程
     save_thread = threading.Thread(target=periodic_save_background, daemon=True)
     save_thread.start()
     print("✅ 定期保存线程已启动（每10分钟保存一次）")
+
+def become_follower():
+    """成为跟随进程：加载共享快照，并在后台跟随快照变化、等待接替采集"""
+    runtime_info['role'] = 'follower'
+    started = time.perf_counter()
+    startup_stats['started_at'] = get_beijing_time().isoformat()
+    print(f"📡 进程 {os.getpid()} 作为跟随进程启动（采集进程: {ingester_lock.holder_pid()}）")
+    
+    if adopt_shared_state():
+        print(f"✅ 已加载共享快照: {len(app_state.historical_data)} 条历史记录")
+    else:
+        print("⚠️ 共享快照尚未生成，等待采集进程发布")
+    
+    startup_stats['ready_at'] = get_beijing_time().isoformat()
+    startup_stats['time_to_ready'] = round(time.perf_counter() - started, 3)
+    startup_stats['backend'] = 'shared_snapshot'
+    
+    follow_thread = threading.Thread(target=follow_shared_state_background, daemon=True)
+    follow_thread.start()
+
+def follow_shared_state_background():
+    """跟随进程：定期加载共享快照，采集锁释放后接替采集"""
+    while True:
+        try:
+            if ingester_lock.try_acquire():
+                become_ingester(promoted=True)
+                return
+            adopt_shared_state()
+        except Exception as e:
+            print(f"❌ 跟随共享快照异常: {e}")
+        time.sleep(SHARED_STATE_POLL_SECONDS)
+
+def stop_runtime(timeout=30):
+    """进程退出前把排队中的数据和访问统计写盘，并释放采集锁"""
+    flush_persistence(timeout=timeout)
+    visit_queue.flush(timeout)
+    flush_visit_stats()
+    ingester_lock.release()
+
+if __name__ == '__main__':
+    print("="*50)
+    print("电表监控系统启动中...")
+    print("="*50)
+    
+    # 初始化数据并启动后台线程（单进程运行时本进程就是采集进程）
+    start_runtime()
     
     print("\n🌐 监控系统已启动！")
     print("📱 访问地址: http://localhost:8080")
@@ -710,4 +1564,7 @@ if __name__ == '__main__':
     except KeyboardInterrupt:
         print("\n👋 监控系统已停止")
     except Exception as e:
-        print(f"❌ 服务器启动失败: {e}")
\ No newline at end of file
+        print(f"❌ 服务器启动失败: {e}")
+    finally:
+        # 退出前把排队中的数据写盘并释放采集锁
+        stop_runtime(timeout=30)
\ No newline at end of file
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+监控数据备份与恢复工具
+从任意存储后端分块读取历史记录和用电统计，压缩写入 backups/ 目录：
+  - 备份文件为压缩的 JSON Lines（gzip 或 lzma），内存占用与历史记录总量无关
+  - 支持增量备份：只备份上次备份之后的新记录（用电统计数据量很小，每次都完整备份）
+  - 恢复时按 全量 + 后续增量 的顺序批量写入
+
+用法：
+  python3 backup.py backup                    # 有全量备份时做增量备份，否则做全量备份
+  python3 backup.py backup --full --compression lzma
+  python3 backup.py restore                   # 恢复最新的备份链
+  python3 backup.py restore --file backups/backup_20250918_093824_full.jsonl.gz
+  python3 backup.py list
+"""
+
+import argparse
+import gzip
+import json
+import lzma
+import os
+import time
+from datetime import datetime
+import pytz
+from storage import get_storage_backend, empty_state, USAGE_STAT_TYPES
+
+BEIJING_TZ = pytz.timezone('Asia/Shanghai')
+DEFAULT_BACKUP_DIR = 'backups'
+MANIFEST_FILE = 'manifest.json'
+CHUNK_SIZE = 1000
+BACKUP_FORMAT = 1
+
+COMPRESSORS = {
+    'gzip': ('.gz', gzip.open),
+    'lzma': ('.xz', lzma.open),
+}
+
+
+def open_backup(path, mode='rt'):
+    """按扩展名打开压缩的备份文件"""
+    for _, (ext, opener) in COMPRESSORS.items():
+        if path.endswith(ext):
+            return opener(path, mode, encoding='utf-8')
+    return open(path, mode.replace('t', ''), encoding='utf-8')
+
+
+def load_manifest(backup_dir):
+    """读取备份清单"""
+    path = os.path.join(backup_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {'snapshots': []}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_manifest(backup_dir, manifest):
+    """原子写入备份清单"""
+    path = os.path.join(backup_dir, MANIFEST_FILE)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def create_backup(backend=None, backup_dir=DEFAULT_BACKUP_DIR, compression='gzip',
+                  full=False, chunk_size=CHUNK_SIZE):
+    """创建备份，返回清单中的快照信息"""
+    backend = backend or get_storage_backend()
+    if not backend.wait_until_available(10):
+        raise RuntimeError(f'{backend.label}不可用')
+
+    os.makedirs(backup_dir, exist_ok=True)
+    manifest = load_manifest(backup_dir)
+    previous = manifest['snapshots'][-1] if manifest['snapshots'] else None
+    kind = 'full' if full or previous is None else 'incremental'
+    since = previous['last_timestamp'] if kind == 'incremental' else None
+
+    ext, opener = COMPRESSORS[compression]
+    created_at = datetime.now(BEIJING_TZ)
+    filename = f"backup_{created_at.strftime('%Y%m%d_%H%M%S')}_{kind}.jsonl{ext}"
+    path = os.path.join(backup_dir, filename)
+    tmp_path = f'{path}.tmp'
+
+    started = time.perf_counter()
+    records = 0
+    buckets = 0
+    last_timestamp = since
+    with opener(tmp_path, 'wt', encoding='utf-8') as f:
+        header = {'format': BACKUP_FORMAT, 'kind': kind, 'since': since,
+                  'backend': backend.name, 'created_at': created_at.isoformat()}
+        f.write(json.dumps(['h', header], ensure_ascii=False) + '\n')
+
+        for chunk in backend.iter_records(after=since, chunk_size=chunk_size):
+            f.write(''.join(json.dumps(['r', record], ensure_ascii=False) + '\n' for record in chunk))
+            records += len(chunk)
+            last_timestamp = chunk[-1]['timestamp']
+
+        for stat_type, _ in USAGE_STAT_TYPES:
+            for key, value in backend.load_usage(stat_type).items():
+                f.write(json.dumps(['u', stat_type, key, value], ensure_ascii=False) + '\n')
+                buckets += 1
+    os.replace(tmp_path, path)
+
+    snapshot = {
+        'file': filename,
+        'kind': kind,
+        'since': since,
+        'last_timestamp': last_timestamp,
+        'records': records,
+        'usage_buckets': buckets,
+        'bytes': os.path.getsize(path),
+        'created_at': created_at.isoformat()
+    }
+    manifest['snapshots'].append(snapshot)
+    save_manifest(backup_dir, manifest)
+
+    elapsed = time.perf_counter() - started
+    print(f"✅ {'全量' if kind == 'full' else '增量'}备份已保存到: {path}")
+    print(f"   历史记录 {records} 条，统计时间桶 {buckets} 个，{snapshot['bytes']:,} 字节，用时 {elapsed:.1f}s")
+    return snapshot
+
+
+def read_backup(path):
+    """逐行读取备份文件，产出 ('record', 记录) 或 ('usage', (统计类型, 键, 值))"""
+    with open_backup(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if entry[0] == 'r':
+                yield 'record', entry[1]
+            elif entry[0] == 'u':
+                yield 'usage', tuple(entry[1:])
+
+
+def get_restore_chain(backup_dir):
+    """最新的全量备份及其之后的所有增量备份"""
+    snapshots = load_manifest(backup_dir)['snapshots']
+    for i in range(len(snapshots) - 1, -1, -1):
+        if snapshots[i]['kind'] == 'full':
+            return [os.path.join(backup_dir, s['file']) for s in snapshots[i:]]
+    return []
+
+
+def restore_backup(paths, backend=None, chunk_size=CHUNK_SIZE):
+    """按顺序恢复备份文件到存储后端"""
+    backend = backend or get_storage_backend()
+    if not backend.wait_until_available(10):
+        raise RuntimeError(f'{backend.label}不可用')
+
+    started = time.perf_counter()
+    usage = {state_key: {} for _, state_key in USAGE_STAT_TYPES}
+    state_keys = dict(USAGE_STAT_TYPES)
+    restored = 0
+
+    if backend.stores_records_individually:
+        # 逐条存储的后端：分块批量写入，内存只保留一个块
+        chunk = []
+        for path in paths:
+            for kind, item in read_backup(path):
+                if kind == 'record':
+                    chunk.append(item)
+                    if len(chunk) >= chunk_size:
+                        restored += backend.bulk_insert_records(chunk)
+                        chunk = []
+                else:
+                    stat_type, key, value = item
+                    usage[state_keys[stat_type]][key] = value
+        if chunk:
+            restored += backend.bulk_insert_records(chunk)
+        # 此类后端的 save_state 只写入用电统计
+        state = empty_state()
+        state.update(usage)
+        backend.save_state(state)
+    else:
+        # 整体存储的后端（JSON文件）：合并后一次写入
+        state = backend.load_state()
+        existing = {record.get('timestamp') for record in state['historical_data']}
+        for path in paths:
+            for kind, item in read_backup(path):
+                if kind == 'record':
+                    if item.get('timestamp') not in existing:
+                        existing.add(item.get('timestamp'))
+                        state['historical_data'].append(item)
+                        restored += 1
+                else:
+                    stat_type, key, value = item
+                    usage[state_keys[stat_type]][key] = value
+        state['historical_data'].sort(key=lambda record: record.get('timestamp', ''))
+        for state_key, buckets in usage.items():
+            state[state_key].update(buckets)
+        backend.save_state(state)
+
+    elapsed = time.perf_counter() - started
+    print(f"✅ 已恢复 {restored} 条历史记录到{backend.label}，用时 {elapsed:.1f}s")
+    return restored
+
+
+def list_backups(backup_dir=DEFAULT_BACKUP_DIR):
+    """显示备份清单"""
+    snapshots = load_manifest(backup_dir)['snapshots']
+    if not snapshots:
+        print("暂无备份")
+        return
+    for s in snapshots:
+        print(f"{s['created_at']}  {s['kind']:<11} {s['records']:>8} 条  {s['bytes']:>12,} 字节  {s['file']}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='监控数据备份与恢复')
+    parser.add_argument('--dir', default=DEFAULT_BACKUP_DIR, help='备份目录')
+    parser.add_argument('--backend', help='存储后端 json/mongodb（默认使用 STORAGE_BACKEND 配置）')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    backup_parser = subparsers.add_parser('backup', help='创建备份')
+    backup_parser.add_argument('--full', action='store_true', help='强制全量备份')
+    backup_parser.add_argument('--compression', choices=sorted(COMPRESSORS), default='gzip')
+
+    restore_parser = subparsers.add_parser('restore', help='恢复备份')
+    restore_parser.add_argument('--file', action='append', help='要恢复的备份文件（可多次指定，默认恢复最新的备份链）')
+
+    subparsers.add_parser('list', help='列出备份')
+    args = parser.parse_args()
+
+    if args.command == 'list':
+        list_backups(args.dir)
+    elif args.command == 'backup':
+        create_backup(get_storage_backend(args.backend), args.dir, args.compression, args.full)
+    else:
+        files = args.file or get_restore_chain(args.dir)
+        if not files:
+            print("❌ 没有可恢复的全量备份")
+        else:
+            restore_backup(files, get_storage_backend(args.backend))
@@ -0,0 +1,5 @@
+# -*- coding: utf-8 -*-
+"""
+性能基准测试
+在仓库根目录运行，例如：python3 -m benchmarks.bench_storage
+"""
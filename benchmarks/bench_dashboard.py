@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+仪表盘接口基准测试
+比较页面加载的两种方式：
+  - sequential: 旧的 fetchData，依次请求7个接口
+  - dashboard:  一次请求 /api/dashboard
+每种方式分别测量缓存未命中（每轮之前数据版本变化）和缓存命中的 p50/p99。
+默认在进程内用 Flask 测试客户端请求（不含网络延迟），--rtt-ms 为每个请求模拟一次网络往返，
+也可以用 --url 直接请求运行中的服务。
+
+用法：
+  python3 -m benchmarks.bench_dashboard --rounds 200 --rtt-ms 30
+  python3 -m benchmarks.bench_dashboard --url http://localhost:8080
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import sys
+import tempfile
+import time
+
+from benchmarks.bench_storage import percentile
+from benchmarks.synthetic import default_end_time, generate_readings, generate_usage_state
+
+SEQUENTIAL_PATHS = [
+    '/api/meter-data',
+    '/api/historical-data',
+    '/api/hourly-usage',
+    '/api/daily-usage',
+    '/api/monthly-usage',
+    '/api/10min-usage',
+    '/api/usage-summary',
+]
+DASHBOARD_PATH = '/api/dashboard?sections=meter,summary,historical,ten_minute,hourly,daily,monthly'
+
+
+@contextlib.contextmanager
+def synthetic_app(history_records):
+    """导入app并填入合成数据
+
+    在临时目录中运行（不读写项目的数据文件），退出时恢复工作目录、删除临时目录并恢复限流配置。
+    app模块只导入一次，每次进入时重新填入数据并清空上一次留下的缓存和读数事件。
+    """
+    previous_cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix='bench_app_') as workdir:
+        os.chdir(workdir)
+        try:
+            import app as app_module
+
+            limiters = (app_module.refresh_limiter, app_module.upstream_refresh_limiter, app_module.query_limiter)
+            limits = [(limiter.per_client, limiter.global_limit) for limiter in limiters]
+            try:
+                populate_synthetic_app(app_module, history_records)
+                yield app_module
+            finally:
+                for limiter, (per_client, global_limit) in zip(limiters, limits):
+                    limiter.configure(per_client=per_client, global_limit=global_limit)
+        finally:
+            os.chdir(previous_cwd)
+
+
+def populate_synthetic_app(app_module, history_records):
+    """把合成数据设为app的当前状态"""
+    from monitor_state import MonitorState
+
+    state = generate_usage_state()
+    state['historical_data'] = list(generate_readings(history_records))
+    latest_data = {
+        'name': '基准测试电表',
+        'meter_id': '18100071580',
+        'remaining_power': 50.0,
+        'remaining_amount': 30.0,
+        'unit_price': 0.6,
+        'update_time': default_end_time().isoformat()
+    }
+    for stat_type in app_module.usage_loaded:
+        app_module.usage_loaded[stat_type] = True
+    # 测试客户端的所有请求来自同一地址，基准测试不应被限流
+    for limiter in (app_module.refresh_limiter, app_module.upstream_refresh_limiter, app_module.query_limiter):
+        limiter.configure(per_client=None, global_limit=None)
+    app_module.last_reading = None
+    app_module.response_cache.clear()
+    app_module.commit_state(lambda base: (MonitorState.from_state(state, latest_data), None))
+
+
+def make_local_getter(app_module, rtt):
+    """进程内请求，每个请求额外等待 rtt 秒模拟网络往返"""
+    client = app_module.app.test_client()
+
+    def get(path):
+        if rtt:
+            time.sleep(rtt)
+        response = client.get(path, headers={'Accept-Encoding': 'gzip'})
+        if response.status_code != 200:
+            raise RuntimeError(f'{path} 返回 {response.status_code}')
+        return len(response.data)
+
+    return get
+
+
+def make_remote_getter(base_url):
+    """请求运行中的服务"""
+    import requests
+
+    session = requests.Session()
+
+    def get(path):
+        response = session.get(base_url.rstrip('/') + path, timeout=30)
+        response.raise_for_status()
+        return len(response.content)
+
+    return get
+
+
+def run_rounds(get, paths, rounds, invalidate=None):
+    """执行 rounds 轮，每轮依次请求 paths，返回每轮耗时（毫秒）和每轮传输字节数"""
+    timings = []
+    transferred = 0
+    for _ in range(rounds):
+        if invalidate:
+            invalidate()
+        start = time.perf_counter()
+        transferred = sum(get(path) for path in paths)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings, transferred
+
+
+def summarize(name, timings, transferred):
+    """输出并返回一种方式的统计"""
+    result = {
+        'p50_ms': round(percentile(timings, 50), 3),
+        'p99_ms': round(percentile(timings, 99), 3),
+        'mean_ms': round(sum(timings) / len(timings), 3),
+        'bytes_per_load': transferred
+    }
+    print(f"  {name:<22} p50 {result['p50_ms']:>9.3f} ms   p99 {result['p99_ms']:>9.3f} ms   {transferred:>9,} 字节/次")
+    return result
+
+
+def run(args, output, stack):
+    """执行测量，stack 负责在结束时清理进程内测试的app"""
+    results = {'rounds': args.rounds, 'rtt_ms': args.rtt_ms, 'url': args.url}
+    if args.url:
+        get = make_remote_getter(args.url)
+        invalidate = None
+        print(f"📊 请求 {args.url}，每种方式 {args.rounds} 轮")
+    else:
+        app_module = stack.enter_context(synthetic_app(args.history))
+        get = make_local_getter(app_module, args.rtt_ms / 1000.0)
+        invalidate = app_module.data_version.bump
+        print(f"📊 进程内请求，{args.history} 条历史记录，模拟往返 {args.rtt_ms} ms，每种方式 {args.rounds} 轮")
+
+    # 预热（导入、首次序列化）
+    run_rounds(get, SEQUENTIAL_PATHS + [DASHBOARD_PATH], 3)
+
+    modes = [('cached', None)]
+    if invalidate:
+        modes.insert(0, ('uncached', invalidate))
+    for mode, invalidate_fn in modes:
+        print(f"\n{'缓存未命中（每轮数据版本变化）' if invalidate_fn else '缓存命中'}:")
+        sequential = summarize(f'sequential ({len(SEQUENTIAL_PATHS)} 请求)', *run_rounds(get, SEQUENTIAL_PATHS, args.rounds, invalidate_fn))
+        dashboard = summarize('dashboard (1 请求)', *run_rounds(get, [DASHBOARD_PATH], args.rounds, invalidate_fn))
+        speedup = sequential['p50_ms'] / dashboard['p50_ms'] if dashboard['p50_ms'] else 0
+        print(f"  p50 加速: {speedup:.1f}x")
+        results[mode] = {'sequential': sequential, 'dashboard': dashboard, 'p50_speedup': round(speedup, 2)}
+
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\n✅ 结果已保存到 {output}")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='仪表盘接口与逐个接口请求的延迟对比')
+    parser.add_argument('--rounds', type=int, default=200, help='每种方式的测量轮数')
+    parser.add_argument('--history', type=int, default=1000, help='进程内测试时内存中的历史记录条数')
+    parser.add_argument('--rtt-ms', type=float, default=0.0, help='进程内测试时每个请求模拟的网络往返（毫秒）')
+    parser.add_argument('--url', help='请求运行中的服务（例如 http://localhost:8080），不使用合成数据')
+    parser.add_argument('--output', help='把结果写入JSON文件')
+    args = parser.parse_args()
+    output = os.path.abspath(args.output) if args.output else None
+
+    with contextlib.ExitStack() as stack:
+        return run(args, output, stack)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+写入路径基准测试
+用合成读数逐条驱动写入路径上的各个函数，测量吞吐（条/秒）、单条耗时的 p50/p99 和峰值内存：
+  - update:  app.update_historical_data（追加记录、更新各维度时间桶并清理过期时间桶、替换状态）
+  - rollup:  app.roll_up_usage + expired_bucket_cutoffs（各维度的累加和过期清理，不替换状态）
+  - parse:   MeterDataScraper.parse_meter_data（解析电表页面）
+  - save:    app.save_historical_data，分别以 json / mongodb 为存储后端（每条读数后 append_record + 保存状态）
+app.get_beijing_time 被替换为模拟时钟，每条读数前进2分钟，不需要真实等待，
+一年的读数（262,800条）计时一遍约一分钟；update 用例不提交写盘任务（持久化由 save 用例单独测量）。
+峰值内存在计时之后用 tracemalloc 单独跑一遍测量（比计时的一遍慢几倍），不影响计时结果。
+
+结果可以保存为基线（benchmarks/baselines/ingest.json），之后的运行会与基线比较，
+吞吐下降或 p99 上升超过 --tolerance 时标记为退化。
+
+用法：
+  python3 -m benchmarks.bench_ingest --days 30 --history 1000,100000
+  python3 -m benchmarks.bench_ingest --days 365 --cases update,rollup
+  python3 -m benchmarks.bench_ingest --save-baseline
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+from benchmarks.bench_dashboard import synthetic_app
+from benchmarks.bench_storage import create_mongo_manager, percentile
+from benchmarks.synthetic import READING_INTERVAL, default_end_time, generate_readings
+
+CASES = ('update', 'rollup', 'parse', 'save')
+READINGS_PER_DAY = 720
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines', 'ingest.json')
+
+METER_PAGE = (
+    '<div><span>表&ensp;名&ensp;称:</span> <label class="v">基准测试电表</label></div>'
+    '<div><span>表&ensp;&ensp;&ensp;&ensp;号:</span> <label class="v">18100071580</label></div>'
+    '<div><span>剩余电量:</span> <label class="v">{power}</label></div>'
+    '<div><span>剩余金额:</span> <label class="v">{amount}</label></div>'
+    '<div><span>综合费用:</span> <label class="v">0.6</label></div>'
+)
+
+
+class SimulatedClock:
+    """可控的北京时间：每次 advance 前进一个读数间隔"""
+
+    def __init__(self, start, step=READING_INTERVAL):
+        self.current = start
+        self.step = step
+
+    def advance(self):
+        self.current += self.step
+        return self.current
+
+    def __call__(self):
+        return self.current
+
+
+def patch(stack, target, name, value):
+    """替换 target.name，stack 退出时恢复原值"""
+    stack.callback(setattr, target, name, getattr(target, name))
+    setattr(target, name, value)
+
+
+@contextlib.contextmanager
+def detached_persistence(app_module):
+    """暂时不向持久化队列提交任务"""
+    submit = app_module.persistence_queue.submit
+    app_module.persistence_queue.submit = lambda *args, **kwargs: True
+    try:
+        yield
+    finally:
+        app_module.persistence_queue.submit = submit
+
+
+def future_readings(samples):
+    """合成数据结束时间之后的 samples 条读数（与模拟时钟同步）"""
+    end_time = default_end_time() + READING_INTERVAL * samples
+    return list(generate_readings(samples, end_time=end_time))
+
+
+def prepare_app(history, stack):
+    """导入app并填入 history 条历史记录和满保留期的时间桶，时钟从合成数据的结束时间开始
+
+    临时目录、被替换的全局对象都由 stack 在用例结束时清理和恢复，后面的用例不受影响。
+    """
+    app_module = stack.enter_context(synthetic_app(history))
+    clock = SimulatedClock(default_end_time())
+    patch(stack, app_module, 'get_beijing_time', clock)
+    return app_module, clock
+
+
+def case_update(history, samples, stack):
+    app_module, clock = prepare_app(history, stack)
+    readings = future_readings(samples)
+
+    def step(i):
+        clock.advance()
+        app_module.update_historical_data(readings[i])
+
+    return step, detached_persistence(app_module)
+
+
+def case_rollup(history, samples, stack):
+    app_module, clock = prepare_app(history, stack)
+    readings = future_readings(samples)
+    stat_types = [stat_type for stat_type, _ in app_module.USAGE_STAT_TYPES]
+    current = {
+        stat_type: (app_module.app_state.usage[stat_type], app_module.app_state.usage_index[stat_type])
+        for stat_type in stat_types
+    }
+
+    def step(i):
+        now = clock.advance()
+        bucket_keys = app_module.get_bucket_keys(now)
+        cutoff_keys = app_module.expired_bucket_cutoffs(now)
+        for stat_type in stat_types:
+            buckets, index = current[stat_type]
+            current[stat_type] = app_module.roll_up_usage(
+                stat_type, buckets, index, bucket_keys[stat_type], cutoff_keys[stat_type],
+                0.01, readings[i]['remaining_power'])
+
+    return step, contextlib.nullcontext()
+
+
+def case_parse(history, samples, stack):
+    app_module, clock = prepare_app(history, stack)
+    import scraper as scraper_module
+    patch(stack, scraper_module, 'get_beijing_time', clock)
+    pages = [METER_PAGE.format(power=r['remaining_power'], amount=r['remaining_amount'])
+             for r in future_readings(samples)]
+
+    def step(i):
+        clock.advance()
+        if app_module.scraper.parse_meter_data(pages[i]) is None:
+            raise RuntimeError('解析失败')
+
+    # parse_meter_data 每次都会打印结果
+    return step, contextlib.redirect_stdout(io.StringIO())
+
+
+def make_save_case(backend_name, args):
+    def case_save(history, samples, stack):
+        from storage import JsonFileStorage, MongoStorage
+
+        app_module, clock = prepare_app(history, stack)
+        if backend_name == 'json':
+            backend = JsonFileStorage(os.path.abspath('data_history.json'))
+        else:
+            manager = create_mongo_manager(args.mongo_uri, args.mongo_db)
+            if manager is None:
+                return None, None
+            backend = MongoStorage(manager)
+            backend.clear()
+            stack.callback(backend.clear)
+        patch(stack, app_module, 'storage', backend)
+        patch(stack, app_module, 'fallback_storage', backend)
+        readings = future_readings(samples)
+
+        # 先完整保存一次（之后只写入变化的部分），之后每条读数与app一样：追加记录并保存状态
+        with contextlib.redirect_stdout(io.StringIO()):
+            app_module.save_historical_data()
+
+        def step(i):
+            clock.advance()
+            with detached_persistence(app_module):
+                app_module.update_historical_data(readings[i])
+            app_module.append_historical_record(app_module.app_state.historical_data[-1])
+            app_module.save_historical_data()
+
+        return step, contextlib.redirect_stdout(io.StringIO())
+
+    return case_save
+
+
+def measure(build, history, samples):
+    """计时运行一遍，再用 tracemalloc 运行一遍测量峰值内存（每一遍都重新准备app，结束后清理）"""
+    with contextlib.ExitStack() as stack:
+        step, context = build(history, samples, stack)
+        if step is None:
+            return None
+        latencies = []
+        with context:
+            started = time.perf_counter()
+            for i in range(samples):
+                t = time.perf_counter()
+                step(i)
+                latencies.append(time.perf_counter() - t)
+            elapsed = time.perf_counter() - started
+
+    with contextlib.ExitStack() as stack:
+        step, context = build(history, samples, stack)
+        tracemalloc.start()
+        try:
+            tracemalloc.reset_peak()
+            baseline_bytes = tracemalloc.get_traced_memory()[0]
+            with context:
+                for i in range(samples):
+                    step(i)
+            peak_bytes = tracemalloc.get_traced_memory()[1] - baseline_bytes
+        finally:
+            tracemalloc.stop()
+
+    return {
+        'samples': samples,
+        'samples_per_second': round(samples / elapsed, 1) if elapsed else 0.0,
+        'p50_us': round(percentile(latencies, 50) * 1e6, 2),
+        'p99_us': round(percentile(latencies, 99) * 1e6, 2),
+        'peak_memory_kb': round(peak_bytes / 1024, 1)
+    }
+
+
+def load_baseline(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def compare(result, baseline_result, tolerance):
+    """与基线比较，返回 (说明, 是否退化)"""
+    throughput = result['samples_per_second'] / baseline_result['samples_per_second'] - 1 if baseline_result['samples_per_second'] else 0
+    p99 = result['p99_us'] / baseline_result['p99_us'] - 1 if baseline_result['p99_us'] else 0
+    regressed = throughput < -tolerance or p99 > tolerance
+    return f"吞吐 {throughput:+.0%}，p99 {p99:+.0%}", regressed
+
+
+def run(args):
+    cases = [c.strip() for c in args.cases.split(',') if c.strip()]
+    unknown = set(cases) - set(CASES)
+    if unknown:
+        raise SystemExit(f"未知的用例: {', '.join(sorted(unknown))}（可选: {', '.join(CASES)}）")
+    histories = [int(s) for s in args.history.split(',') if s.strip()]
+    samples = args.samples or args.days * READINGS_PER_DAY
+
+    builders = []
+    for case in cases:
+        if case == 'save':
+            for backend_name in args.backends.split(','):
+                builders.append((f'save_{backend_name.strip()}', make_save_case(backend_name.strip(), args),
+                                 min(samples, args.save_samples)))
+        else:
+            builders.append((case, {'update': case_update, 'rollup': case_rollup, 'parse': case_parse}[case], samples))
+
+    baseline = None if args.no_compare else load_baseline(args.baseline)
+    baseline_results = {(r['case'], r['history']): r for r in (baseline or {}).get('results', [])}
+    results = []
+    regressions = 0
+    for history in histories:
+        print(f"\n📊 历史记录 {history:,} 条")
+        for name, build, count in builders:
+            result = measure(build, history, count)
+            if result is None:
+                continue
+            result = dict(case=name, history=history, **result)
+            results.append(result)
+            line = (f"   {name:<12} {result['samples_per_second']:>12,.1f} 条/秒   "
+                    f"p50 {result['p50_us']:>9.1f} µs   p99 {result['p99_us']:>9.1f} µs   "
+                    f"峰值内存 {result['peak_memory_kb']:>9,.1f} KB   ({count:,} 条)")
+            previous = baseline_results.get((name, history))
+            if previous:
+                note, regressed = compare(result, previous, args.tolerance)
+                regressions += regressed
+                line += f"   {'⚠️' if regressed else '✅'} {note}"
+            print(line)
+
+    report = {
+        'benchmark': 'ingest',
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'days': samples / READINGS_PER_DAY,
+        'results': results
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n✅ 结果已保存到 {args.output}")
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n✅ 基线已保存到 {args.baseline}")
+    elif baseline is None and not args.no_compare:
+        print(f"\n⚠️ 没有基线（{args.baseline}），用 --save-baseline 保存本次结果")
+    if regressions:
+        print(f"\n❌ {regressions} 项相对基线退化超过 {args.tolerance:.0%}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='写入路径基准测试')
+    parser.add_argument('--cases', default=','.join(CASES), help=f"要运行的用例，逗号分隔（默认: {','.join(CASES)}）")
+    parser.add_argument('--history', default='1000', help='预先填入的历史记录条数，逗号分隔（默认: 1000）')
+    parser.add_argument('--days', type=int, default=30, help='模拟的天数，每天720条读数（默认: 30）')
+    parser.add_argument('--samples', type=int, help='直接指定读数条数（覆盖 --days）')
+    parser.add_argument('--save-samples', type=int, default=200, help='save 用例最多写入的读数条数（默认: 200）')
+    parser.add_argument('--backends', default='json,mongodb', help='save 用例的存储后端，逗号分隔')
+    parser.add_argument('--mongo-uri', default=os.getenv('BENCH_MONGODB_URI', 'mongomock'),
+                        help='MongoDB本地替身：mongomock 或 mongodb://localhost:27017')
+    parser.add_argument('--mongo-db', default='electricity_monitor_bench', help='基准测试使用的数据库名')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='基线文件路径')
+    parser.add_argument('--save-baseline', action='store_true', help='把本次结果保存为基线')
+    parser.add_argument('--no-compare', action='store_true', help='不与基线比较')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='判定退化的阈值（默认: 0.2，即20%%）')
+    parser.add_argument('--fail-on-regression', action='store_true', help='有退化时以非零状态退出')
+    parser.add_argument('--output', help='结果JSON文件路径')
+    args = parser.parse_args(argv)
+    args.baseline = os.path.abspath(args.baseline)
+    if args.output:
+        args.output = os.path.abspath(args.output)
+
+    print("=== 写入路径基准测试 ===")
+    regressions = run(args)
+    return 1 if regressions and args.fail_on_regression else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+存储后端基准测试
+对每个存储后端、每个数据规模测量：
+  - 写入吞吐：按app的方式逐条追加读数并保存统计（条/秒）
+  - 启动加载耗时：新建后端实例，按app启动的方式加载热数据（load_hot_state）
+  - 全量加载耗时：新建后端实例并读出全部历史记录（两个后端读出的条数相同）
+  - 时间范围查询延迟：随机查询1天窗口的 p50/p99
+  - 磁盘占用
+默认规模为 10,000 / 1,000,000 / 10,000,000 条。
+MongoDB默认使用 mongomock 作为本地替身，也可以用 --mongo-uri 指向本地 mongod。
+mongomock 是纯Python的内存实现，逐条检查唯一索引，准备数据的耗时随规模平方增长（5,000条约40秒），
+使用 mongomock 且未指定 --sizes 时 MongoDB 只测试 1,000 / 5,000 条；
+mongomock 的结果只能用来检查流程，不代表MongoDB的实际性能，也没有磁盘占用。
+
+用法：
+  python3 -m benchmarks.bench_storage --backends json
+  python3 -m benchmarks.bench_storage --mongo-uri mongodb://localhost:27017
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import timedelta
+
+from benchmarks.synthetic import default_end_time, generate_readings, generate_usage_state
+from storage import JsonFileStorage, MongoStorage, get_bucket_keys
+
+DEFAULT_SIZES = '10000,1000000,10000000'
+MONGOMOCK_SIZES = '1000,5000'   # mongomock 准备数据的耗时随规模平方增长
+POPULATE_CHUNK = 50000
+HOT_RECORDS = 200           # 与 app.HOT_HISTORY_RECORDS 相同
+FULL_LOAD_CHUNK = 10000
+
+
+def percentile(values, pct):
+    """计算百分位数"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def create_mongo_manager(mongo_uri, db_name):
+    """创建连接到本地替身的 DatabaseManager"""
+    from database import DatabaseManager
+
+    if mongo_uri == 'mongomock':
+        try:
+            import mongomock
+        except ImportError:
+            print("⚠️  未安装 mongomock（pip install mongomock），跳过MongoDB基准测试")
+            return None
+        client = mongomock.MongoClient()
+    else:
+        from pymongo import MongoClient
+        client = MongoClient(mongo_uri, serverSelectionTimeoutMS=5000)
+
+    manager = DatabaseManager(client=client, db_name=db_name)
+    if not manager.wait_until_available(10):
+        print(f"⚠️  无法连接 {mongo_uri}，跳过MongoDB基准测试")
+        return None
+    return manager
+
+
+def make_backend_factory(name, workdir, args):
+    """返回创建后端实例的函数（每次调用都是一个全新实例，用于测量启动加载）"""
+    if name == 'json':
+        path = os.path.join(workdir, 'data_history.json')
+        return lambda: JsonFileStorage(path)
+    if name == 'mongodb':
+        manager = create_mongo_manager(args.mongo_uri, args.mongo_db)
+        if manager is None:
+            return None
+        return lambda: MongoStorage(manager)
+    raise ValueError(f'未知的存储后端: {name}')
+
+
+def populate(backend, size):
+    """写入 size 条合成读数和统计数据（不计时）"""
+    backend.clear()
+    if isinstance(backend, JsonFileStorage):
+        # JSON文件每次写入都会重写整个文件，一次性写入
+        backend.bulk_insert_records(list(generate_readings(size)))
+    else:
+        chunk = []
+        for record in generate_readings(size):
+            chunk.append(record)
+            if len(chunk) >= POPULATE_CHUNK:
+                backend.bulk_insert_records(chunk)
+                chunk = []
+        if chunk:
+            backend.bulk_insert_records(chunk)
+
+    state = backend.load_state()
+    state.update(generate_usage_state())
+    backend.save_state(state)
+    return state
+
+
+def bench_ingest(backend, state, ops):
+    """按app的写入路径逐条追加读数：append_record + save_state"""
+    end_time = default_end_time()
+    records = state['historical_data']
+    hourly = state['hourly_usage_data']
+    start = time.perf_counter()
+    for i in range(ops):
+        now = end_time + timedelta(minutes=2 * (i + 1))
+        record = {
+            'timestamp': now.isoformat(),
+            'remaining_power': 50.0,
+            'remaining_amount': 30.0,
+            'unit_price': 0.6
+        }
+        records.append(record)
+        bucket = hourly.setdefault(now.strftime('%Y-%m-%d-%H'), {'usage': 0, 'count': 0, 'avg_power': 0})
+        bucket['usage'] += 0.01
+        bucket['count'] += 1
+        backend.append_record(record)
+        backend.save_state(state)
+    elapsed = time.perf_counter() - start
+    return ops / elapsed if elapsed else 0.0
+
+
+def bench_startup_load(factory):
+    """新建后端实例并按app启动的方式加载热数据（不支持按需加载的后端会读出全部数据）"""
+    start = time.perf_counter()
+    state = factory().load_hot_state(HOT_RECORDS, get_bucket_keys(default_end_time()))
+    elapsed = time.perf_counter() - start
+    return elapsed, len(state['historical_data'])
+
+
+def bench_full_load(factory):
+    """新建后端实例并读出全部历史记录"""
+    start = time.perf_counter()
+    backend = factory()
+    if backend.stores_records_individually:
+        loaded = sum(len(chunk) for chunk in backend.iter_records(chunk_size=FULL_LOAD_CHUNK))
+    else:
+        loaded = len(backend.load_state()['historical_data'])
+    elapsed = time.perf_counter() - start
+    return elapsed, loaded
+
+
+def bench_range_queries(backend, size, queries):
+    """随机查询1天窗口"""
+    end_time = default_end_time()
+    span_minutes = max(1, size * 2 - 24 * 60)
+    rng = random.Random(42)
+    latencies = []
+    for _ in range(queries):
+        window_start = end_time - timedelta(minutes=rng.randrange(span_minutes)) - timedelta(days=1)
+        window_end = window_start + timedelta(days=1)
+        start = time.perf_counter()
+        backend.get_records_range(window_start.isoformat(), window_end.isoformat())
+        latencies.append((time.perf_counter() - start) * 1000)
+    return percentile(latencies, 50), percentile(latencies, 99)
+
+
+def parse_sizes(value):
+    return [int(s) for s in value.split(',') if s.strip()]
+
+
+def backend_sizes(name, args):
+    """后端的测试规模：未指定 --sizes 时 mongomock 使用较小的规模"""
+    if args.sizes:
+        return parse_sizes(args.sizes)
+    if name == 'mongodb' and args.mongo_uri == 'mongomock':
+        return parse_sizes(MONGOMOCK_SIZES)
+    return parse_sizes(DEFAULT_SIZES)
+
+
+def run(args):
+    backends = [b.strip() for b in args.backends.split(',') if b.strip()]
+    results = []
+
+    for name in backends:
+        workdir = tempfile.mkdtemp(prefix=f'bench_{name}_')
+        try:
+            factory = make_backend_factory(name, workdir, args)
+            if factory is None:
+                continue
+
+            stand_in = name == 'mongodb' and args.mongo_uri == 'mongomock'
+            if stand_in:
+                print("\n⚠️ MongoDB 使用 mongomock 内存替身：结果只用于检查流程，不代表实际的存储性能，磁盘占用不可用")
+
+            for size in backend_sizes(name, args):
+                print(f"\n📊 {name}{'（mongomock）' if stand_in else ''} - {size:,} 条读数")
+                backend = factory()
+                populate_start = time.perf_counter()
+                state = populate(backend, size)
+                print(f"   准备数据: {time.perf_counter() - populate_start:.1f}s")
+
+                ingest_rate = bench_ingest(backend, state, args.ingest_ops)
+                del state
+                load_seconds, loaded = bench_startup_load(factory)
+                full_load_seconds, full_loaded = bench_full_load(factory)
+                p50, p99 = bench_range_queries(backend, size, args.queries)
+                disk_bytes = backend.storage_size()
+
+                result = {
+                    'backend': name,
+                    'stand_in': stand_in,
+                    'size': size,
+                    'ingest_per_second': round(ingest_rate, 2),
+                    'startup_load_seconds': round(load_seconds, 4),
+                    'startup_loaded_records': loaded,
+                    'full_load_seconds': round(full_load_seconds, 4),
+                    'full_loaded_records': full_loaded,
+                    'range_query_p50_ms': round(p50, 3),
+                    'range_query_p99_ms': round(p99, 3),
+                    'disk_bytes': disk_bytes
+                }
+                results.append(result)
+
+                print(f"   写入吞吐: {ingest_rate:,.1f} 条/秒")
+                startup_note = '热数据' if backend.supports_lazy_loading else '不支持按需加载，读出全部'
+                print(f"   启动加载: {load_seconds:.3f}s（{loaded:,} 条，{startup_note}）")
+                print(f"   全量加载: {full_load_seconds:.3f}s（{full_loaded:,} 条）")
+                print(f"   范围查询: p50 {p50:.2f}ms / p99 {p99:.2f}ms")
+                print(f"   磁盘占用: {disk_bytes if disk_bytes is not None else 'N/A'} 字节")
+
+                backend.clear()
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'benchmark': 'storage', 'results': results}, f, ensure_ascii=False, indent=2)
+        print(f"\n✅ 结果已保存到 {args.output}")
+
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='存储后端基准测试')
+    parser.add_argument('--sizes', help=f'数据规模，逗号分隔（默认: {DEFAULT_SIZES}，mongomock 为 {MONGOMOCK_SIZES}）')
+    parser.add_argument('--backends', default='json,mongodb', help='要测试的后端，逗号分隔')
+    parser.add_argument('--mongo-uri', default=os.getenv('BENCH_MONGODB_URI', 'mongomock'),
+                        help='MongoDB本地替身：mongomock 或 mongodb://localhost:27017')
+    parser.add_argument('--mongo-db', default='electricity_monitor_bench', help='基准测试使用的数据库名')
+    parser.add_argument('--ingest-ops', type=int, default=50, help='写入吞吐测试的读数条数')
+    parser.add_argument('--queries', type=int, default=100, help='范围查询次数')
+    parser.add_argument('--output', help='结果JSON文件路径')
+    args = parser.parse_args(argv)
+
+    print("=== 存储后端基准测试 ===")
+    run(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+基准测试用的合成电表数据
+按每2分钟一条读数生成，时间戳格式与 app.update_historical_data 一致
+"""
+
+from datetime import datetime, timedelta
+import pytz
+
+BEIJING_TZ = pytz.timezone('Asia/Shanghai')
+READING_INTERVAL = timedelta(minutes=2)
+
+
+def default_end_time():
+    """合成数据的结束时间（固定值，保证多次运行结果可比较）"""
+    return BEIJING_TZ.localize(datetime(2025, 9, 18, 12, 0, 0))
+
+
+def generate_readings(count, end_time=None, interval=READING_INTERVAL):
+    """生成 count 条按时间升序排列的读数，最后一条落在 end_time"""
+    end_time = end_time or default_end_time()
+    current = end_time - interval * (count - 1)
+    power = 100.0 + count * 0.01
+    for i in range(count):
+        # 每条读数消耗0~0.02度电，夜间偶尔有充值
+        power -= (i % 3) * 0.01
+        if i % 5000 == 4999:
+            power += 50.0
+        yield {
+            'timestamp': current.isoformat(),
+            'remaining_power': round(power, 2),
+            'remaining_amount': round(power * 0.6, 2),
+            'unit_price': 0.6
+        }
+        current += interval
+
+
+def generate_usage_state(end_time=None):
+    """生成与app保留窗口大小一致的各维度用电统计"""
+    end_time = end_time or default_end_time()
+
+    def buckets(count, step, fmt, extra=None):
+        result = {}
+        for i in range(count):
+            key = (end_time - step * i).strftime(fmt)
+            result[key] = {'usage': 0.5, 'count': 5, 'avg_power': 100.0}
+            if extra:
+                result[key].update(extra)
+        return result
+
+    return {
+        'ten_minute_usage': buckets(144, timedelta(minutes=10), '%Y-%m-%d %H:%M'),
+        'hourly_usage_data': buckets(720, timedelta(hours=1), '%Y-%m-%d-%H'),
+        'daily_usage_data': buckets(365, timedelta(days=1), '%Y-%m-%d', {'peak_power': 100.0}),
+        'weekly_usage_data': buckets(52, timedelta(weeks=1), '%Y-W%U'),
+        'monthly_usage_data': buckets(24, timedelta(days=30), '%Y-%m'),
+    }
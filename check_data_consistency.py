@@ -54,7 +54,7 @@ def check_database_consistency():
     """检查数据库一致性"""
     print("\n=== 数据库一致性检查 ===")
     
-    if not db_manager.is_connected():
+    if not db_manager.wait_until_available(10):
         print("❌ 数据库未连接")
         return False
     
@@ -2,137 +2,122 @@
 # -*- coding: utf-8 -*-
 """
 云数据库数据清理脚本
-删除2025年9月之前的所有数据
+删除指定日期（默认2025年9月1日）之前的所有历史记录和用电统计
+删除在数据库服务端按索引范围分批完成，不会把数据拉到本地
+
+用法：
+  python3 clean_cloud_data.py --dry-run              # 只统计将删除的数量
+  python3 clean_cloud_data.py --before 2025-09-01 --yes
 """
 
-import os
+import argparse
 from datetime import datetime
+import pytz
 from database import db_manager, is_database_available
+from storage import get_bucket_keys
+
+BEIJING_TZ = pytz.timezone('Asia/Shanghai')
+DEFAULT_CUTOFF = '2025-09-01'
+DEFAULT_BATCH_SIZE = 1000
+
+def get_cutoff_keys(cutoff_date):
+    """各维度统计的截止时间键"""
+    cutoff = BEIJING_TZ.localize(datetime.strptime(cutoff_date, '%Y-%m-%d'))
+    return get_bucket_keys(cutoff)
 
-def clean_old_data():
-    """清理云数据库中2025年9月之前的数据"""
-    
-    if not is_database_available():
+def clean_old_data(cutoff_date=DEFAULT_CUTOFF, dry_run=False, assume_yes=False,
+                   batch_size=DEFAULT_BATCH_SIZE):
+    """清理云数据库中 cutoff_date 之前的历史记录"""
+
+    if not is_database_available(wait=10):
         print("❌ 云数据库不可用，请检查配置")
         return False
-    
+
     print("🧹 开始清理云数据库中的旧数据...")
-    print("📅 删除目标：2025年9月之前的所有数据")
-    
+    print(f"📅 删除目标：{cutoff_date} 之前的所有数据")
+
     try:
-        # 获取当前数据统计
-        historical_data = db_manager.get_historical_data()
-        print(f"📊 当前历史记录总数: {len(historical_data)}")
-        
-        # 统计需要删除的数据
-        delete_count = 0
-        keep_count = 0
-        
-        for record in historical_data:
-            timestamp = record.get('timestamp', '')
-            if timestamp:
-                # 检查是否为2025年9月之前的数据
-                if timestamp.startswith('2025-01') or timestamp.startswith('2025-02') or \
-                   timestamp.startswith('2025-03') or timestamp.startswith('2025-04') or \
-                   timestamp.startswith('2025-05') or timestamp.startswith('2025-06') or \
-                   timestamp.startswith('2025-07') or timestamp.startswith('2025-08'):
-                    delete_count += 1
-                else:
-                    keep_count += 1
-        
+        # 统计需要删除的数据（服务端计数）
+        stats = db_manager.get_database_stats()
+        delete_count = db_manager.delete_historical_before(cutoff_date, dry_run=True)
+        print(f"📊 当前历史记录总数: {stats.get('historical_records', 0)}")
         print(f"🗑️  需要删除的记录: {delete_count} 条")
-        print(f"✅ 保留的记录: {keep_count} 条")
-        
-        if delete_count == 0:
-            print("✨ 没有需要删除的旧数据")
+
+        if dry_run or delete_count == 0:
+            if delete_count == 0:
+                print("✨ 没有需要删除的旧数据")
             return True
-        
+
         # 确认删除
-        confirm = input(f"\n⚠️  确认删除 {delete_count} 条旧数据？(y/N): ").strip().lower()
-        if confirm != 'y':
-            print("❌ 取消删除操作")
-            return False
-        
+        if not assume_yes:
+            confirm = input(f"\n⚠️  确认删除 {delete_count} 条旧数据？(y/N): ").strip().lower()
+            if confirm != 'y':
+                print("❌ 取消删除操作")
+                return False
+
         # 执行删除操作
         print("🔄 正在删除旧数据...")
-        
-        # 删除历史记录中的旧数据
-        deleted_count = 0
-        if hasattr(db_manager, 'collections') and 'historical_data' in db_manager.collections:
-            collection = db_manager.collections['historical_data']
-            
-            # 删除2025年1-8月的数据
-            for month in ['01', '02', '03', '04', '05', '06', '07', '08']:
-                result = collection.delete_many({
-                    'timestamp': {'$regex': f'^2025-{month}'}
-                })
-                deleted_count += result.deleted_count
-                print(f"🗑️  删除2025年{month}月数据: {result.deleted_count} 条")
-        
+        deleted_count = db_manager.delete_historical_before(cutoff_date, batch_size=batch_size)
         print(f"\n✅ 删除完成！共删除 {deleted_count} 条历史记录")
-        
+
         # 验证删除结果
-        remaining_data = db_manager.get_historical_data()
-        print(f"📊 剩余历史记录: {len(remaining_data)} 条")
-        
+        remaining = db_manager.get_database_stats().get('historical_records', 0)
+        print(f"📊 剩余历史记录: {remaining} 条")
+
         # 显示剩余数据的时间范围
-        if remaining_data:
-            timestamps = [record.get('timestamp', '') for record in remaining_data if record.get('timestamp')]
-            if timestamps:
-                timestamps.sort()
+        if remaining:
+            first = db_manager.get_historical_range(limit=1)
+            last = db_manager.get_historical_page(limit=1)
+            if first and last:
                 print(f"📅 剩余数据时间范围:")
-                print(f"   - 开始时间: {timestamps[0]}")
-                print(f"   - 结束时间: {timestamps[-1]}")
-        
+                print(f"   - 开始时间: {first[0].get('timestamp')}")
+                print(f"   - 结束时间: {last[0].get('timestamp')}")
+
         return True
-        
+
     except Exception as e:
         print(f"❌ 清理数据失败: {e}")
         return False
 
-def clean_usage_stats():
+def clean_usage_stats(cutoff_date=DEFAULT_CUTOFF, dry_run=False, batch_size=DEFAULT_BATCH_SIZE):
     """清理统计数据中的旧数据"""
     print("\n🧹 清理统计数据中的旧数据...")
-    
+
     try:
-        stats_types = ['ten_minute', 'hourly', 'daily', 'weekly', 'monthly']
-        
-        for stat_type in stats_types:
-            if hasattr(db_manager, 'collections') and f'{stat_type}_stats' in db_manager.collections:
-                collection = db_manager.collections[f'{stat_type}_stats']
-                
-                # 删除2025年1-8月的统计数据
-                deleted_count = 0
-                for month in ['01', '02', '03', '04', '05', '06', '07', '08']:
-                    result = collection.delete_many({
-                        'time_key': {'$regex': f'^2025-{month}'}
-                    })
-                    deleted_count += result.deleted_count
-                
-                if deleted_count > 0:
-                    print(f"🗑️  删除{stat_type}统计数据: {deleted_count} 条")
-        
+        cutoff_keys = get_cutoff_keys(cutoff_date)
+        result = db_manager.delete_usage_stats_before(cutoff_keys, dry_run=dry_run, batch_size=batch_size)
+
+        action = '将删除' if dry_run else '删除'
+        for stat_type, count in result.items():
+            if count > 0:
+                print(f"🗑️  {action}{stat_type}统计数据: {count} 条")
+
         print("✅ 统计数据清理完成")
         return True
-        
+
     except Exception as e:
         print(f"❌ 清理统计数据失败: {e}")
         return False
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='删除云数据库中指定日期之前的数据')
+    parser.add_argument('--before', default=DEFAULT_CUTOFF, help=f'截止日期 YYYY-MM-DD（默认: {DEFAULT_CUTOFF}）')
+    parser.add_argument('--dry-run', action='store_true', help='只统计将删除的数量，不执行删除')
+    parser.add_argument('--yes', action='store_true', help='不询问确认，直接删除')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='每批删除的记录数')
+    args = parser.parse_args()
+
     print("=== 云数据库数据清理工具 ===")
-    print("删除2025年9月之前的所有数据...")
-    
-    # 设置环境变量
-    if os.path.exists('.env.sh'):
-        print("📝 加载数据库配置...")
-        os.system('source .env.sh')
-    
-    success = clean_old_data()
-    
+    print(f"删除{args.before}之前的所有数据...")
+
+    success = clean_old_data(args.before, args.dry_run, args.yes, args.batch_size)
+
     if success:
-        clean_usage_stats()
-        print("\n🎉 数据清理完成！")
-        print("💡 云数据库现在只包含2025年9月及之后的数据")
+        clean_usage_stats(args.before, args.dry_run, args.batch_size)
+        if args.dry_run:
+            print("\n💡 以上为预估结果（--dry-run），未删除任何数据")
+        else:
+            print("\n🎉 数据清理完成！")
+            print(f"💡 云数据库现在只包含{args.before}及之后的数据")
     else:
-        print("\n❌ 数据清理失败，请检查错误信息")
\ No newline at end of file
+        print("\n❌ 数据清理失败，请检查错误信息")
@@ -8,25 +8,24 @@
 import json
 import os
 from datetime import datetime
+from backup import create_backup
+from storage import JsonFileStorage
 
 def clean_historical_data():
     """清理历史数据中的假数据"""
     data_file = 'data_history.json'
-    backup_file = 'data_history_backup.json'
     
     if not os.path.exists(data_file):
         print(f"❌ 文件 {data_file} 不存在")
         return
     
-    # 备份原文件
+    # 备份原文件（压缩的全量备份，可用 python3 backup.py restore 恢复）
     print("📁 创建备份文件...")
+    create_backup(JsonFileStorage(data_file), full=True)
+    
     with open(data_file, 'r', encoding='utf-8') as f:
         original_data = json.load(f)
     
-    with open(backup_file, 'w', encoding='utf-8') as f:
-        json.dump(original_data, f, ensure_ascii=False, indent=2)
-    print(f"✅ 备份文件已创建: {backup_file}")
-    
     # 清理historical_data中的1月份数据
     cleaned_historical = []
     removed_count = 0
@@ -7,47 +7,77 @@
 
 import os
 import json
+import threading
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Any
 import pytz
-from pymongo import MongoClient
-from pymongo.errors import ConnectionFailure, OperationFailure
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import ConnectionFailure, OperationFailure, BulkWriteError, ServerSelectionTimeoutError
 import logging
+from traffic_stats import VISIT_DETAILS_SIZE, empty_visit_stats, merge_sketches
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 健康探测间隔（秒）：连接正常时的探测周期，以及连接失败后的重试退避上限
+HEALTH_CHECK_INTERVAL = int(os.getenv('MONGODB_HEALTH_CHECK_INTERVAL', '30'))
+RECONNECT_MAX_BACKOFF = 60
+
 class DatabaseManager:
-    """数据库管理器"""
+    """数据库管理器
+
+    创建实例不会发起任何网络请求：首次使用时才创建客户端并启动后台健康探测线程，
+    is_connected() 只读取探测线程缓存的可用状态，不会阻塞。
+    """
     
-    def __init__(self):
-        self.client = None
+    def __init__(self, client=None, db_name: Optional[str] = None):
+        self.client = client
         self.db = None
         self.collections = {}
         self.beijing_tz = pytz.timezone('Asia/Shanghai')
-        self._connect()
+        # 云端历史记录保留天数，0表示全部保留（由 prune_expired_history 定期清理，不在写入时清理）
+        self.historical_retention_days = int(os.getenv('MONGODB_HISTORY_RETENTION_DAYS', '0'))
+        self._db_name = db_name
+        self._available = False
+        self._indexes_created = False
+        self._lock = threading.Lock()
+        self._available_event = threading.Event()
+        self._probe_wakeup = threading.Event()
+        self._stop_event = threading.Event()
+        self._probe_thread = None
+        self._pid = None
     
-    def _connect(self):
-        """连接到MongoDB Atlas"""
-        try:
-            # 从环境变量获取数据库连接字符串
-            mongodb_uri = os.getenv('MONGODB_URI')
-            if not mongodb_uri:
-                logger.warning("未找到MONGODB_URI环境变量，使用本地文件存储")
-                return False
-            
-            # 连接到MongoDB Atlas
-            self.client = MongoClient(mongodb_uri, serverSelectionTimeoutMS=5000)
-            
-            # 测试连接
-            self.client.admin.command('ping')
+    def _ensure_started(self) -> bool:
+        """首次使用时创建客户端（不连接）并启动健康探测线程"""
+        if self._probe_thread is not None and self._pid == os.getpid():
+            return self.client is not None
+        
+        with self._lock:
+            if self._probe_thread is not None and self._pid == os.getpid():
+                return self.client is not None
+            
+            if self._pid is not None and self._pid != os.getpid():
+                # fork后的子进程不能复用父进程的客户端和线程
+                self.client = None
+                self._available = False
+                self._available_event.clear()
+            
+            if self.client is None:
+                # 从环境变量获取数据库连接字符串
+                mongodb_uri = os.getenv('MONGODB_URI')
+                if not mongodb_uri:
+                    logger.warning("未找到MONGODB_URI环境变量，使用本地文件存储")
+                    self._pid = os.getpid()
+                    self._probe_thread = False
+                    return False
+                
+                # connect=False：创建客户端时不连接，由探测线程在后台完成
+                self.client = MongoClient(mongodb_uri, serverSelectionTimeoutMS=5000, connect=False)
             
-            # 获取数据库
-            db_name = os.getenv('MONGODB_DB_NAME', 'electricity_monitor')
+            # 获取数据库和集合（不会产生网络请求）
+            db_name = self._db_name or os.getenv('MONGODB_DB_NAME', 'electricity_monitor')
             self.db = self.client[db_name]
-            
-            # 初始化集合
             self.collections = {
                 'historical_data': self.db.historical_data,
                 'meter_data': self.db.meter_data,
@@ -55,40 +85,87 @@ class DatabaseManager:
                 'visit_stats': self.db.visit_stats
             }
             
-            # 创建索引
-            self._create_indexes()
-            
-            logger.info("✅ 成功连接到MongoDB Atlas")
+            self._pid = os.getpid()
+            self._stop_event.clear()
+            self._probe_thread = threading.Thread(target=self._health_probe_loop, name='mongodb-health-probe', daemon=True)
+            self._probe_thread.start()
             return True
-            
-        except ConnectionFailure as e:
-            logger.error(f"❌ MongoDB连接失败: {e}")
-            return False
-        except Exception as e:
-            logger.error(f"❌ 数据库初始化失败: {e}")
-            return False
+    
+    def _health_probe_loop(self):
+        """后台健康探测：定期ping，失败时按指数退避重试，恢复后自动重新可用"""
+        backoff = 1
+        while not self._stop_event.is_set():
+            try:
+                self.client.admin.command('ping')
+                if not self._available:
+                    logger.info("✅ 成功连接到MongoDB Atlas")
+                self._set_available(True)
+                backoff = 1
+                
+                # 索引创建放在探测线程里，不占用启动路径
+                if not self._indexes_created:
+                    self._create_indexes()
+                
+                interval = HEALTH_CHECK_INTERVAL
+            except Exception as e:
+                if self._available or backoff == 1:
+                    logger.error(f"❌ MongoDB连接失败: {e}")
+                self._set_available(False)
+                interval = backoff
+                backoff = min(backoff * 2, RECONNECT_MAX_BACKOFF)
+            
+            self._probe_wakeup.wait(interval)
+            self._probe_wakeup.clear()
+    
+    def _set_available(self, available: bool):
+        """更新缓存的可用状态"""
+        self._available = available
+        if available:
+            self._available_event.set()
+        else:
+            self._available_event.clear()
+    
+    def _handle_operation_error(self, error: Exception):
+        """数据库操作出现连接类错误时标记为不可用，并唤醒探测线程尽快重连"""
+        if isinstance(error, (ConnectionFailure, ServerSelectionTimeoutError)):
+            self._set_available(False)
+            self._probe_wakeup.set()
     
     def _create_indexes(self):
         """创建数据库索引"""
         try:
-            # 历史数据索引
-            self.collections['historical_data'].create_index('timestamp')
+            # 历史数据索引（迁移工具可能已建立同键的唯一索引）
+            existing = self.collections['historical_data'].index_information().values()
+            if not any(info.get('key') == [('timestamp', 1)] for info in existing):
+                self.collections['historical_data'].create_index('timestamp')
             self.collections['historical_data'].create_index([('timestamp', -1)])
             
             # 使用统计索引
             self.collections['usage_stats'].create_index('time_key')
             self.collections['usage_stats'].create_index('stat_type')
+            existing = self.collections['usage_stats'].index_information().values()
+            if not any(info.get('key') == [('stat_type', 1), ('time_key', 1)] for info in existing):
+                self.collections['usage_stats'].create_index([('stat_type', 1), ('time_key', 1)])
             
             # 访问统计索引
             self.collections['visit_stats'].create_index('date')
             
+            self._indexes_created = True
             logger.info("✅ 数据库索引创建完成")
         except Exception as e:
             logger.error(f"创建索引失败: {e}")
     
     def is_connected(self) -> bool:
-        """检查数据库连接状态"""
-        return self.client is not None and self.db is not None
+        """检查数据库连接状态（读取缓存的探测结果，不阻塞）"""
+        if not self._ensure_started():
+            return False
+        return self._available
+    
+    def wait_until_available(self, timeout: float) -> bool:
+        """最多等待 timeout 秒直到数据库可用，用于启动和命令行脚本"""
+        if not self._ensure_started():
+            return False
+        return self._available_event.wait(timeout)
     
     def save_historical_record(self, record: Dict[str, Any]) -> bool:
         """保存历史记录"""
@@ -101,18 +178,15 @@ class DatabaseManager:
             
             # 插入记录
             result = self.collections['historical_data'].insert_one(record)
-            
-            # 清理过期数据（保留最近1000条记录）
-            self._cleanup_historical_data()
-            
             return result.inserted_id is not None
             
         except Exception as e:
+            self._handle_operation_error(e)
             logger.error(f"保存历史记录失败: {e}")
             return False
     
     def get_historical_data(self, limit: int = 1000) -> List[Dict[str, Any]]:
-        """获取历史数据"""
+        """获取历史数据（按时间倒序，最新的在前）"""
         if not self.is_connected():
             return []
         
@@ -125,6 +199,7 @@ class DatabaseManager:
             return list(cursor)
             
         except Exception as e:
+            self._handle_operation_error(e)
             logger.error(f"获取历史数据失败: {e}")
             return []
     
@@ -147,6 +222,7 @@ class DatabaseManager:
             return result.acknowledged
             
         except Exception as e:
+            self._handle_operation_error(e)
             logger.error(f"保存电表数据失败: {e}")
             return False
     
@@ -163,6 +239,7 @@ class DatabaseManager:
             return data
             
         except Exception as e:
+            self._handle_operation_error(e)
             logger.error(f"获取电表数据失败: {e}")
             return None
     
@@ -189,112 +266,448 @@ class DatabaseManager:
             return result.acknowledged
             
         except Exception as e:
+            self._handle_operation_error(e)
             logger.error(f"保存用电统计失败: {e}")
             return False
     
     def get_usage_stats(self, stat_type: str) -> Dict[str, Any]:
         """获取用电统计数据"""
+        return self.get_usage_stats_range(stat_type)
+    
+    def get_usage_stats_range(self, stat_type: str, start_key: Optional[str] = None,
+                              end_key: Optional[str] = None) -> Dict[str, Any]:
+        """按时间键范围 [start_key, end_key) 获取用电统计数据"""
         if not self.is_connected():
             return {}
         
         try:
+            query = {'stat_type': stat_type}
+            if start_key or end_key:
+                key_range = {}
+                if start_key:
+                    key_range['$gte'] = start_key
+                if end_key:
+                    key_range['$lt'] = end_key
+                # 旧结构文档（time_key='data'）总是一并取回，展开后再按范围过滤
+                query['$or'] = [{'time_key': key_range}, {'time_key': 'data'}]
+            
             cursor = self.collections['usage_stats'].find(
-                {'stat_type': stat_type},
+                query,
                 {'_id': 0, 'time_key': 1, 'data': 1}
             )
             
             result = {}
             for doc in cursor:
-                result[doc['time_key']] = doc['data']
+                if doc['time_key'] == 'data' and isinstance(doc.get('data'), dict):
+                    # 兼容旧结构：整个统计字典存放在 time_key='data' 的单个文档里
+                    legacy = doc['data']
+                    if isinstance(legacy.get('data'), dict):
+                        legacy = {**legacy['data'], **{k: v for k, v in legacy.items() if k != 'data'}}
+                    for key, value in legacy.items():
+                        if (start_key and key < start_key) or (end_key and key >= end_key):
+                            continue
+                        result.setdefault(key, value)
+                else:
+                    result[doc['time_key']] = doc['data']
             
             return result
             
         except Exception as e:
+            self._handle_operation_error(e)
             logger.error(f"获取用电统计失败: {e}")
             return {}
     
-    def save_visit_stats(self, stats: Dict[str, Any]) -> bool:
-        """保存访问统计"""
+    def save_usage_buckets(self, stat_type: str, buckets: Dict[str, Any],
+                           removed_keys: Optional[List[str]] = None) -> bool:
+        """按时间桶批量保存用电统计（每个时间桶一个文档）"""
         if not self.is_connected():
             return False
         
         try:
-            # 转换set为list以便JSON序列化
-            stats_copy = stats.copy()
-            if 'unique_visitors' in stats_copy and isinstance(stats_copy['unique_visitors'], set):
-                stats_copy['unique_visitors'] = list(stats_copy['unique_visitors'])
+            collection = self.collections['usage_stats']
+            now = datetime.now(self.beijing_tz)
+            operations = [
+                UpdateOne(
+                    {'stat_type': stat_type, 'time_key': time_key},
+                    {'$set': {'data': data, 'updated_at': now}},
+                    upsert=True
+                )
+                for time_key, data in buckets.items()
+            ]
+            if operations:
+                collection.bulk_write(operations, ordered=False)
+            
+            if removed_keys:
+                collection.delete_many({'stat_type': stat_type, 'time_key': {'$in': list(removed_keys)}})
             
-            stats_copy['updated_at'] = datetime.now(self.beijing_tz)
-            
-            # 使用当前日期作为文档ID
-            date_key = datetime.now(self.beijing_tz).strftime('%Y-%m-%d')
+            return True
             
-            result = self.collections['visit_stats'].replace_one(
-                {'date': date_key},
-                {'date': date_key, 'stats': stats_copy},
-                upsert=True
+        except Exception as e:
+            self._handle_operation_error(e)
+            logger.error(f"批量保存用电统计失败: {e}")
+            return False
+    
+    def delete_legacy_usage_stats(self, stat_type: str) -> int:
+        """删除旧结构（time_key='data'）的统计文档"""
+        if not self.is_connected():
+            return 0
+        
+        try:
+            result = self.collections['usage_stats'].delete_many({'stat_type': stat_type, 'time_key': 'data'})
+            return result.deleted_count
+        except Exception as e:
+            self._handle_operation_error(e)
+            logger.error(f"删除旧结构统计文档失败: {e}")
+            return 0
+    
+    def _ensure_unique_index(self, collection_name: str, keys: List[tuple]) -> bool:
+        """确保集合上有指定键的唯一索引（已有同键普通索引时替换）"""
+        if not self.is_connected():
+            return False
+        
+        collection = self.collections[collection_name]
+        try:
+            for name, info in collection.index_information().items():
+                if info.get('key') == keys:
+                    if info.get('unique'):
+                        return True
+                    # 普通索引和唯一索引的键相同，需要先删除普通索引
+                    collection.drop_index(name)
+            collection.create_index(keys, unique=True)
+            return True
+        except Exception as e:
+            self._handle_operation_error(e)
+            logger.error(f"创建{collection_name}唯一索引失败（可能存在重复记录）: {e}")
+            try:
+                collection.create_index(keys)
+            except Exception:
+                pass
+            return False
+    
+    def ensure_unique_timestamp_index(self) -> bool:
+        """确保历史记录的timestamp上有唯一索引，用于批量写入时去重"""
+        return self._ensure_unique_index('historical_data', [('timestamp', 1)])
+    
+    def insert_historical_records(self, records: List[Dict[str, Any]]) -> int:
+        """批量插入历史记录，返回成功插入的条数（依赖timestamp唯一索引跳过重复记录）"""
+        if not self.is_connected() or not records:
+            return 0
+        
+        try:
+            result = self.collections['historical_data'].insert_many(
+                [dict(record) for record in records], ordered=False
             )
+            return len(result.inserted_ids)
+        except BulkWriteError as e:
+            other_errors = [err for err in e.details.get('writeErrors', []) if err.get('code') != 11000]
+            if other_errors:
+                logger.error(f"批量插入历史记录部分失败: {other_errors[0].get('errmsg')}")
+            return e.details.get('nInserted', 0)
+        except Exception as e:
+            self._handle_operation_error(e)
+            logger.error(f"批量插入历史记录失败: {e}")
+            return 0
+    
+    def upsert_historical_records(self, records: List[Dict[str, Any]]) -> int:
+        """按timestamp批量upsert历史记录（不依赖唯一索引），返回新增条数"""
+        if not self.is_connected() or not records:
+            return 0
+        
+        try:
+            operations = [
+                UpdateOne({'timestamp': record['timestamp']}, {'$setOnInsert': record}, upsert=True)
+                for record in records if record.get('timestamp')
+            ]
+            if not operations:
+                return 0
+            result = self.collections['historical_data'].bulk_write(operations, ordered=False)
+            return result.upserted_count
+        except Exception as e:
+            self._handle_operation_error(e)
+            logger.error(f"批量upsert历史记录失败: {e}")
+            return 0
+    
+    def get_historical_range(self, start: Optional[str] = None, end: Optional[str] = None,
+                             limit: int = 0) -> List[Dict[str, Any]]:
+        """按时间范围获取历史数据（按时间升序，走timestamp索引）"""
+        if not self.is_connected():
+            return []
+        
+        try:
+            query = {}
+            if start or end:
+                query['timestamp'] = {}
+                if start:
+                    query['timestamp']['$gte'] = start
+                if end:
+                    query['timestamp']['$lt'] = end
             
-            return result.acknowledged
+            cursor = self.collections['historical_data'].find(
+                query,
+                {'_id': 0, 'created_at': 0}
+            ).sort('timestamp', 1)
+            if limit:
+                cursor = cursor.limit(limit)
+            
+            return list(cursor)
             
         except Exception as e:
-            logger.error(f"保存访问统计失败: {e}")
-            return False
+            self._handle_operation_error(e)
+            logger.error(f"按范围获取历史数据失败: {e}")
+            return []
     
-    def get_visit_stats(self) -> Dict[str, Any]:
-        """获取访问统计"""
+    def get_historical_page(self, before: Optional[str] = None, after: Optional[str] = None,
+                            limit: int = 100) -> List[Dict[str, Any]]:
+        """按时间戳游标分页获取历史数据（按时间升序）
+
+        指定 after 时返回其后的 limit 条，否则返回 before（不含）之前最近的 limit 条，
+        两种情况都只在timestamp索引上定位，不需要跳过前面的记录。
+        """
         if not self.is_connected():
-            return {}
+            return []
         
         try:
-            # 获取今天的统计数据
-            date_key = datetime.now(self.beijing_tz).strftime('%Y-%m-%d')
+            query = {}
+            if before or after:
+                query['timestamp'] = {}
+                if before:
+                    query['timestamp']['$lt'] = before
+                if after:
+                    query['timestamp']['$gt'] = after
+            
+            direction = 1 if after else -1
+            cursor = self.collections['historical_data'].find(
+                query,
+                {'_id': 0, 'created_at': 0}
+            ).sort('timestamp', direction).limit(limit)
             
-            doc = self.collections['visit_stats'].find_one(
-                {'date': date_key},
-                {'_id': 0, 'stats': 1}
-            )
+            records = list(cursor)
+            if direction == -1:
+                records.reverse()
+            return records
             
-            if doc and 'stats' in doc:
-                stats = doc['stats']
-                # 转换list回set
-                if 'unique_visitors' in stats and isinstance(stats['unique_visitors'], list):
-                    stats['unique_visitors'] = set(stats['unique_visitors'])
-                return stats
+        except Exception as e:
+            self._handle_operation_error(e)
+            logger.error(f"分页获取历史数据失败: {e}")
+            return []
+    
+    def get_storage_size(self) -> Optional[int]:
+        """获取数据库占用的磁盘空间（字节），不支持时返回None"""
+        if not self.is_connected():
+            return None
+        
+        try:
+            stats = self.db.command('dbStats')
+            return int(stats.get('storageSize', 0) + stats.get('indexSize', 0))
+        except Exception as e:
+            logger.warning(f"获取数据库存储大小失败: {e}")
+            return None
+    
+    # ---------- 维护操作（在服务端完成，不把数据拉到本地） ----------
+    
+    def delete_historical_before(self, cutoff: str, dry_run: bool = False,
+                                 batch_size: int = 1000) -> int:
+        """删除timestamp早于 cutoff 的历史记录，返回删除（或dry_run时将删除）的条数
+
+        按timestamp索引分批删除，每批只取回 _id，避免长时间占用数据库。
+        """
+        if not self.is_connected():
+            return 0
+        
+        collection = self.collections['historical_data']
+        query = {'timestamp': {'$lt': cutoff}}
+        try:
+            if dry_run:
+                return collection.count_documents(query)
             
-            return {}
+            deleted = 0
+            while True:
+                ids = [doc['_id'] for doc in collection.find(query, {'_id': 1}).sort('timestamp', 1).limit(batch_size)]
+                if not ids:
+                    break
+                deleted += collection.delete_many({'_id': {'$in': ids}}).deleted_count
+            return deleted
             
         except Exception as e:
-            logger.error(f"获取访问统计失败: {e}")
-            return {}
+            self._handle_operation_error(e)
+            logger.error(f"删除历史记录失败: {e}")
+            return 0
     
-    def _cleanup_historical_data(self, max_records: int = 1000):
-        """清理过期的历史数据"""
+    def prune_expired_history(self) -> int:
+        """删除超过保留天数的历史记录（未设置保留天数时不删除），返回删除的条数"""
+        if not self.historical_retention_days:
+            return 0
+        cutoff = (datetime.now(self.beijing_tz) - timedelta(days=self.historical_retention_days)).strftime('%Y-%m-%d')
+        deleted = self.delete_historical_before(cutoff)
+        if deleted:
+            logger.info(f"清理了 {deleted} 条 {cutoff} 之前的历史记录")
+        return deleted
+    
+    def delete_usage_stats_before(self, cutoff_keys: Dict[str, str], dry_run: bool = False,
+                                  batch_size: int = 1000) -> Dict[str, int]:
+        """按统计类型删除time_key早于对应截止键的时间桶，返回各类型删除（或将删除）的数量"""
+        if not self.is_connected():
+            return {}
+        
+        collection = self.collections['usage_stats']
+        result = {}
         try:
-            # 获取记录总数
-            total_count = self.collections['historical_data'].count_documents({})
-            
-            if total_count > max_records:
-                # 删除最旧的记录
-                excess_count = total_count - max_records
+            for stat_type, cutoff_key in cutoff_keys.items():
+                query = {'stat_type': stat_type, 'time_key': {'$lt': cutoff_key}}
+                if dry_run:
+                    result[stat_type] = collection.count_documents(query)
+                    continue
                 
-                # 获取要删除的记录ID
-                old_records = self.collections['historical_data'].find(
-                    {},
-                    {'_id': 1}
-                ).sort('timestamp', 1).limit(excess_count)
+                deleted = 0
+                while True:
+                    ids = [doc['_id'] for doc in collection.find(query, {'_id': 1}).limit(batch_size)]
+                    if not ids:
+                        break
+                    deleted += collection.delete_many({'_id': {'$in': ids}}).deleted_count
+                result[stat_type] = deleted
+            return result
+            
+        except Exception as e:
+            self._handle_operation_error(e)
+            logger.error(f"删除用电统计失败: {e}")
+            return result
+    
+    def flatten_legacy_usage_stats(self, cutoff_keys: Optional[Dict[str, str]] = None,
+                                   dry_run: bool = False) -> Dict[str, int]:
+        """把旧结构（time_key='data'，含嵌套 data.data）的统计文档展开为每个时间桶一个文档
+
+        展开通过聚合管道和 $merge 在服务端完成；已存在的时间桶文档保持不变，
+        早于 cutoff_keys 中对应截止键的时间桶直接丢弃。返回各类型展开（或将展开）的时间桶数量。
+        """
+        if not self.is_connected():
+            return {}
+        
+        collection = self.collections['usage_stats']
+        result = {}
+        try:
+            if not dry_run and not self._ensure_unique_index('usage_stats', [('stat_type', 1), ('time_key', 1)]):
+                logger.error("usage_stats 缺少 (stat_type, time_key) 唯一索引，无法展开旧结构文档")
+                return {}
+            
+            stat_types = collection.distinct('stat_type', {'time_key': 'data'})
+            for stat_type in stat_types:
+                pipeline = [
+                    {'$match': {'stat_type': stat_type, 'time_key': 'data'}},
+                    {'$project': {
+                        '_id': 0,
+                        'stat_type': 1,
+                        'entries': {'$concatArrays': [
+                            {'$filter': {
+                                'input': {'$objectToArray': '$data'},
+                                'as': 'entry',
+                                'cond': {'$ne': ['$$entry.k', 'data']}
+                            }},
+                            {'$objectToArray': {'$ifNull': ['$data.data', {}]}}
+                        ]}
+                    }},
+                    {'$unwind': '$entries'}
+                ]
+                if cutoff_keys and stat_type in cutoff_keys:
+                    pipeline.append({'$match': {'entries.k': {'$gte': cutoff_keys[stat_type]}}})
+                pipeline.append({'$project': {
+                    'stat_type': 1,
+                    'time_key': '$entries.k',
+                    'data': '$entries.v',
+                    'updated_at': datetime.now(self.beijing_tz)
+                }})
                 
-                old_ids = [doc['_id'] for doc in old_records]
+                counted = list(collection.aggregate(pipeline + [{'$count': 'buckets'}]))
+                result[stat_type] = counted[0]['buckets'] if counted else 0
+                if dry_run:
+                    continue
                 
-                # 删除旧记录
-                if old_ids:
-                    result = self.collections['historical_data'].delete_many(
-                        {'_id': {'$in': old_ids}}
-                    )
-                    logger.info(f"清理了 {result.deleted_count} 条过期历史记录")
-                    
+                collection.aggregate(pipeline + [{'$merge': {
+                    'into': collection.name,
+                    'on': ['stat_type', 'time_key'],
+                    'whenMatched': 'keepExisting',
+                    'whenNotMatched': 'insert'
+                }}])
+                collection.delete_many({'stat_type': stat_type, 'time_key': 'data'})
+            return result
+            
+        except Exception as e:
+            self._handle_operation_error(e)
+            logger.error(f"展开旧结构统计文档失败: {e}")
+            return result
+    
+    def save_visit_stats(self, delta: Dict[str, Any], cutoff_day: Optional[str] = None) -> bool:
+        """合并一批访问统计增量（格式见 traffic_stats）
+
+        汇总文档（date='total'）保存总计数、全部时间的草图和最近的访问记录，每天一个文档保存当天的访问次数和草图。
+        计数用 $inc、访问记录用 $push 原子更新，多个工作进程可以同时写入；
+        草图读出后合并再写回，并发写入时可能丢失对方的部分寄存器，但各进程下次合并完整草图时会补上。
+        """
+        if not self.is_connected():
+            return False
+        
+        try:
+            collection = self.collections['visit_stats']
+            now = datetime.now(self.beijing_tz)
+            daily_sketches = delta.get('daily_unique_visitors', {})
+            days = set(delta.get('daily_visits', {})) | set(daily_sketches)
+            stored_sketches = {
+                doc['date']: doc.get('unique_sketch')
+                for doc in collection.find({'date': {'$in': ['total'] + sorted(days)}}, {'_id': 0, 'date': 1, 'unique_sketch': 1})
+            }
+            
+            summary = {
+                '$inc': {'total_visits': delta.get('total_visits', 0), 'refresh_count': delta.get('refresh_count', 0)},
+                '$set': {'updated_at': now},
+                '$push': {'visitor_details': {'$each': list(delta.get('visitor_details', [])), '$slice': -VISIT_DETAILS_SIZE}}
+            }
+            if delta.get('unique_visitors'):
+                summary['$set']['unique_sketch'] = merge_sketches(stored_sketches.get('total'), delta['unique_visitors'])
+            operations = [UpdateOne({'date': 'total'}, summary, upsert=True)]
+            
+            for day in sorted(days):
+                update = {'$inc': {'visits': delta.get('daily_visits', {}).get(day, 0)}, '$set': {'updated_at': now}}
+                if day in daily_sketches:
+                    update['$set']['unique_sketch'] = merge_sketches(stored_sketches.get(day), daily_sketches[day])
+                operations.append(UpdateOne({'date': day}, update, upsert=True))
+            collection.bulk_write(operations, ordered=False)
+            
+            if cutoff_day:
+                # 过期的按天草图不再保留，访问次数保留
+                collection.update_many(
+                    {'date': {'$lt': cutoff_day}, 'unique_sketch': {'$exists': True}},
+                    {'$unset': {'unique_sketch': ''}}
+                )
+            return True
+            
+        except Exception as e:
+            self._handle_operation_error(e)
+            logger.error(f"保存访问统计失败: {e}")
+            return False
+    
+    def get_visit_stats(self) -> Optional[Dict[str, Any]]:
+        """获取访问统计（格式见 traffic_stats），失败时返回None"""
+        if not self.is_connected():
+            return None
+        
+        try:
+            stats = empty_visit_stats()
+            for doc in self.collections['visit_stats'].find({}, {'_id': 0}):
+                sketch = doc.get('unique_sketch')
+                if doc.get('date') == 'total':
+                    stats['total_visits'] = doc.get('total_visits', 0)
+                    stats['refresh_count'] = doc.get('refresh_count', 0)
+                    stats['visitor_details'] = doc.get('visitor_details', [])
+                    stats['unique_visitors'] = bytes(sketch) if sketch else None
+                elif 'visits' in doc:
+                    stats['daily_visits'][doc['date']] = doc['visits']
+                    if sketch:
+                        stats['daily_unique_visitors'][doc['date']] = bytes(sketch)
+            return stats
+            
         except Exception as e:
-            logger.error(f"清理历史数据失败: {e}")
+            self._handle_operation_error(e)
+            logger.error(f"获取访问统计失败: {e}")
+            return None
     
     def get_database_stats(self) -> Dict[str, Any]:
         """获取数据库统计信息"""
@@ -313,21 +726,27 @@ class DatabaseManager:
             return stats
             
         except Exception as e:
+            self._handle_operation_error(e)
             logger.error(f"获取数据库统计失败: {e}")
             return {'connected': False, 'error': str(e)}
     
     def close(self):
         """关闭数据库连接"""
+        self._stop_event.set()
+        self._probe_wakeup.set()
+        self._set_available(False)
         if self.client:
             self.client.close()
             logger.info("数据库连接已关闭")
 
-# 全局数据库管理器实例
+# 全局数据库管理器实例（不会在导入时连接数据库）
 db_manager = DatabaseManager()
 
 # 兼容性函数，用于逐步迁移
-def is_database_available() -> bool:
-    """检查数据库是否可用"""
+def is_database_available(wait: float = 0) -> bool:
+    """检查数据库是否可用（读取缓存状态；wait>0 时最多等待 wait 秒的探测结果）"""
+    if wait:
+        return db_manager.wait_until_available(wait)
     return db_manager.is_connected()
 
 def get_database_manager() -> DatabaseManager:
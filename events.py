@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+实时事件推送（Server-Sent Events）
+每次写入新读数时发布一个精简事件，/api/stream 的连接在条件变量上等待，不再需要客户端轮询。
+事件ID由共享数据决定（读数事件用读数的时间戳），各进程发布的同一条读数ID相同，
+断线后重连到任何一个进程都能按 Last-Event-ID 补发错过的事件。
+"""
+
+import json
+import threading
+import time
+from collections import deque
+
+
+class EventBroker:
+    """事件发布与订阅
+
+    - 事件ID由发布方给出，须按发布顺序递增（可以按字符串比较，例如同一时区的ISO时间戳）
+    - 重连时由调用方提供的 replay 按 Last-Event-ID 重建错过的事件；无法重建时
+      客户端会收到 resync 事件，需要重新获取完整数据
+    - 环形缓冲区只保存最近的事件，供已连接的客户端在两次唤醒之间取走
+    - 同时保持的连接数有上限，超过时由调用方返回503
+    """
+
+    def __init__(self, buffer_size=100, max_connections=8):
+        self.max_connections = max_connections
+        self._cond = threading.Condition()
+        self._events = deque(maxlen=buffer_size)
+        self._seq = 0
+        self._connections = 0
+        self._stats = {'published': 0, 'connections_total': 0, 'rejected': 0}
+
+    def publish(self, event, data, event_id):
+        """发布事件，唤醒所有等待的连接，返回进程内的事件序号"""
+        payload = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+        with self._cond:
+            self._seq += 1
+            self._events.append((self._seq, event_id, event, payload))
+            self._stats['published'] += 1
+            self._cond.notify_all()
+            return self._seq
+
+    def wait(self, after_seq, timeout):
+        """等待序号大于 after_seq 的事件，超时返回空列表"""
+        with self._cond:
+            self._cond.wait_for(lambda: self._seq > after_seq, timeout)
+            return [entry for entry in self._events if entry[0] > after_seq]
+
+    @staticmethod
+    def format(event_id, event, payload):
+        """按SSE格式编码一个事件"""
+        return f'id: {event_id}\nevent: {event}\ndata: {payload}\n\n'
+
+    def try_connect(self):
+        """占用一个连接名额，已满时返回False"""
+        with self._cond:
+            if self._connections >= self.max_connections:
+                self._stats['rejected'] += 1
+                return False
+            self._connections += 1
+            self._stats['connections_total'] += 1
+            return True
+
+    def disconnect(self):
+        """释放连接名额"""
+        with self._cond:
+            self._connections -= 1
+
+    def stream(self, last_event_id=None, heartbeat=15, max_lifetime=300, retry_ms=5000, replay=None, resync_id=''):
+        """单个连接的事件流生成器（调用前须已 try_connect 成功，响应关闭时由调用方 disconnect）
+
+        带 Last-Event-ID 重连时，replay(last_event_id) 返回其后错过的 [(事件ID, 事件名, 数据), ...]，
+        无法补发时返回None，此时发送ID为 resync_id 的 resync 事件。
+        之后只发送ID大于客户端已收到的事件，补发和新发布的同一事件不会重复。
+        空闲时每 heartbeat 秒发送注释行保持连接，也借此发现已断开的客户端；
+        连接最多保持 max_lifetime 秒后正常结束，浏览器会带着 Last-Event-ID 自动重连，
+        这样空闲客户端不会无限期占用工作线程。
+        """
+        yield f'retry: {retry_ms}\n\n'
+        with self._cond:
+            seq = self._seq
+        delivered = last_event_id or None
+        if delivered:
+            missed = replay(delivered) if replay else None
+            if missed is None:
+                # 无法补发错过的事件，让客户端重新获取完整数据
+                delivered = resync_id or None
+                yield self.format(resync_id, 'resync', '{}')
+            elif missed:
+                yield ''.join(self.format(event_id, event, json.dumps(data, ensure_ascii=False, separators=(',', ':')))
+                              for event_id, event, data in missed)
+                delivered = missed[-1][0]
+
+        deadline = time.monotonic() + max_lifetime
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            events = self.wait(seq, min(heartbeat, remaining))
+            if events:
+                seq = events[-1][0]
+                fresh = [entry for entry in events if delivered is None or entry[1] > delivered]
+                if fresh:
+                    yield ''.join(self.format(*entry[1:]) for entry in fresh)
+                    delivered = fresh[-1][1]
+                    continue
+            yield ': heartbeat\n\n'
+
+    def stats(self):
+        """推送统计"""
+        with self._cond:
+            stats = dict(self._stats)
+            stats['connections'] = self._connections
+            stats['max_connections'] = self.max_connections
+            stats['last_event'] = self._seq
+            stats['last_event_id'] = self._events[-1][1] if self._events else None
+            stats['buffered'] = len(self._events)
+            return stats
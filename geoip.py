@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+IP地理位置查询
+  - 本地IP段数据库：CSV文件，每行 "起始IP,结束IP,国家,地区,城市,运营商[,纬度,经度]"（IP可以是点分十进制或整数），
+    启动时加载为按起始地址排序的数组，查询时二分查找
+  - 查询结果放在有容量上限的LRU缓存里（包括查不到的结果，避免重复查询）
+  - 本地数据库没有结果时可以回退到 ip-api.com；查询只在后台的访问记录线程中进行，不阻塞请求
+"""
+
+import bisect
+import csv
+import ipaddress
+import os
+import threading
+from array import array
+from collections import OrderedDict
+
+import requests
+
+UNKNOWN_LOCATION = {
+    'country': '未知',
+    'region': '未知',
+    'city': '未知',
+    'isp': '未知',
+    'lat': 0,
+    'lon': 0
+}
+LOCAL_LOCATION = {
+    'country': '局域网',
+    'region': '局域网',
+    'city': '局域网',
+    'isp': '内网',
+    'lat': 0,
+    'lon': 0
+}
+
+
+def _parse_ipv4(value):
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+    return int(ipaddress.IPv4Address(value))
+
+
+class IpRangeDatabase:
+    """本地IPv4地址段数据库（起始地址、结束地址和位置编号存放在紧凑数组中）"""
+
+    def __init__(self, path=None):
+        self.starts = array('I')
+        self.ends = array('I')
+        self.location_ids = array('I')
+        self.locations = []
+        if path:
+            self.load(path)
+
+    def load(self, path):
+        """加载CSV文件，文件不存在时保持为空"""
+        if not os.path.exists(path):
+            print(f"⚠️ 本地IP数据库不存在: {path}")
+            return
+
+        rows = []
+        location_index = {}
+        with open(path, 'r', encoding='utf-8', newline='') as f:
+            for line_number, row in enumerate(csv.reader(f), 1):
+                if not row or row[0].startswith('#'):
+                    continue
+                try:
+                    start, end = _parse_ipv4(row[0]), _parse_ipv4(row[1])
+                    country, region, city, isp = (row + [''] * 6)[2:6]
+                    lat = float(row[6]) if len(row) > 6 and row[6] else 0
+                    lon = float(row[7]) if len(row) > 7 and row[7] else 0
+                except (ValueError, IndexError):
+                    print(f"⚠️ 跳过无法解析的IP段（第{line_number}行）")
+                    continue
+                location = (country or '未知', region or '未知', city or '未知', isp or '未知', lat, lon)
+                rows.append((start, end, location_index.setdefault(location, len(location_index))))
+
+        rows.sort()
+        self.starts = array('I', (row[0] for row in rows))
+        self.ends = array('I', (row[1] for row in rows))
+        self.location_ids = array('I', (row[2] for row in rows))
+        self.locations = list(location_index)
+        print(f"✅ 已加载本地IP数据库: {len(rows)} 个地址段")
+
+    def lookup(self, ip):
+        """查询IP所在的地址段，返回位置字典；不在数据库中时返回None"""
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return None
+        if address.is_private or address.is_loopback:
+            return dict(LOCAL_LOCATION)
+        if address.version != 4:
+            return None
+
+        value = int(address)
+        i = bisect.bisect_right(self.starts, value) - 1
+        if i < 0 or value > self.ends[i]:
+            return None
+        country, region, city, isp, lat, lon = self.locations[self.location_ids[i]]
+        return {'country': country, 'region': region, 'city': city, 'isp': isp, 'lat': lat, 'lon': lon}
+
+    def __len__(self):
+        return len(self.starts)
+
+
+def remote_lookup(ip, timeout=2):
+    """通过 ip-api.com 查询，失败时返回None"""
+    try:
+        response = requests.get(f'http://ip-api.com/json/{ip}?lang=zh-CN', timeout=timeout)
+        if response.status_code == 200:
+            data = response.json()
+            if data['status'] == 'success':
+                return {
+                    'country': data.get('country', '未知'),
+                    'region': data.get('regionName', '未知'),
+                    'city': data.get('city', '未知'),
+                    'isp': data.get('isp', '未知'),
+                    'lat': data.get('lat', 0),
+                    'lon': data.get('lon', 0)
+                }
+    except Exception as e:
+        print(f"获取IP地理位置失败: {e}")
+    return None
+
+
+class LocationResolver:
+    """带LRU缓存的IP位置查询：缓存 -> 本地数据库 -> 远程查询（可选）"""
+
+    def __init__(self, database, cache_size=4096, remote=True, remote_timeout=2):
+        self.database = database
+        self.cache_size = cache_size
+        self.remote = remote
+        self.remote_timeout = remote_timeout
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._stats = {'cache_hits': 0, 'local_hits': 0, 'remote_lookups': 0, 'remote_failures': 0, 'unknown': 0}
+
+    def resolve(self, ip):
+        """返回IP的位置字典（查不到时为"未知"）；可能进行远程查询，不要在请求线程中调用"""
+        with self._lock:
+            location = self._cache.get(ip)
+            if location is not None:
+                self._cache.move_to_end(ip)
+                self._stats['cache_hits'] += 1
+                return location
+
+        location = self.database.lookup(ip)
+        if location is not None:
+            stat = 'local_hits'
+        elif self.remote:
+            location = remote_lookup(ip, self.remote_timeout)
+            stat = 'remote_lookups' if location is not None else 'remote_failures'
+        else:
+            stat = 'unknown'
+        if location is None:
+            location = dict(UNKNOWN_LOCATION)
+
+        with self._lock:
+            self._stats[stat] += 1
+            self._cache[ip] = location
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return location
+
+    def stats(self):
+        """缓存和查询统计"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['cached'] = len(self._cache)
+        stats['cache_size'] = self.cache_size
+        stats['database_ranges'] = len(self.database)
+        stats['remote_enabled'] = self.remote
+        return stats
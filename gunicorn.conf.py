@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+gunicorn 配置
+每个工作进程启动后调用 app.start_runtime()：通过文件锁选出唯一的采集进程负责抓取和写入，
+其他工作进程加载共享快照，增加工作进程只提高读取吞吐，不会重复抓取。
+"""
+
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8080')}"
+workers = int(os.getenv('WEB_CONCURRENCY', '2'))
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', '16'))
+timeout = 120
+keepalive = 2
+# 定期回收工作进程；回收采集进程时文件锁随之释放，其他进程会接替采集
+max_requests = 1000
+max_requests_jitter = 100
+
+
+def post_worker_init(worker):
+    """工作进程初始化完成后启动运行时"""
+    import app
+    app.start_runtime()
+
+
+def worker_exit(server, worker):
+    """工作进程退出前把排队中的数据写盘并释放采集锁"""
+    import app
+    app.stop_runtime(timeout=30)
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+HTTP缓存辅助
+数据版本号在每次写入新数据时递增，接口的ETag和Last-Modified都由它生成，
+客户端带 If-None-Match / If-Modified-Since 请求且数据未变化时直接返回304，不需要重新序列化。
+ResponseCache 按 路径+参数 缓存已经序列化（以及gzip压缩）的响应体，每个数据版本只构建一次，
+之后的请求直接返回不可变的字节串。
+"""
+
+import functools
+import gzip
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from email.utils import formatdate
+
+from flask import current_app, make_response, request
+
+
+class DataVersion:
+    """数据版本号：每次写入新数据时递增"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # 进程启动标识：不同进程（或重启后）的版本号不会产生相同的ETag
+        self.instance_id = os.urandom(4).hex()
+        self.value = 1
+        self.updated_at = time.time()
+
+    def bump(self):
+        """数据发生变化，版本号加一"""
+        with self._lock:
+            self.value += 1
+            self.updated_at = time.time()
+            return self.value
+
+    def adopt(self, version_tag, updated_at):
+        """采用其他进程发布的版本（多个工作进程对相同数据返回相同的ETag）"""
+        instance_id, _, value = version_tag.rpartition('-')
+        with self._lock:
+            self.instance_id = instance_id
+            self.value = int(value)
+            self.updated_at = updated_at
+
+    def current(self):
+        """返回 (版本标识, 最后更新时间戳)，版本标识包含进程启动标识"""
+        with self._lock:
+            return f'{self.instance_id}-{self.value}', self.updated_at
+
+
+def cache_key(path, args=None):
+    """由路径和查询参数（MultiDict）生成规范化的缓存键"""
+    if not args:
+        return path
+    return path + '?' + '&'.join(f'{k}={v}' for k, v in sorted(args.items(multi=True)))
+
+
+def make_etag(version_tag, path, args=None):
+    """由数据版本、路径和查询参数生成强ETag的值（不含引号）"""
+    digest = hashlib.blake2b(cache_key(path, args).encode('utf-8'), digest_size=6).hexdigest()
+    return f'{version_tag}-{digest}'
+
+
+def is_not_modified(etag, updated_at):
+    """判断请求的条件头是否命中（If-None-Match 优先于 If-Modified-Since）"""
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    if request.if_modified_since:
+        return int(updated_at) <= request.if_modified_since.timestamp()
+    return False
+
+
+def set_cache_headers(response, etag, updated_at):
+    """设置ETag、Last-Modified，并要求客户端每次使用前重新验证"""
+    response.set_etag(etag)
+    response.headers['Last-Modified'] = formatdate(int(updated_at), usegmt=True)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+class RawBody:
+    """视图返回的非JSON响应体（例如二进制序列），由 cached_json 原样缓存"""
+
+    __slots__ = ('body', 'mimetype', 'headers')
+
+    def __init__(self, body, mimetype, headers=None):
+        self.body = body
+        self.mimetype = mimetype
+        self.headers = headers or {}
+
+
+class CachedResponse:
+    """一个已序列化的响应（构建后不再修改）"""
+
+    __slots__ = ('version_tag', 'updated_at', 'etag', 'body', 'gzip_body', 'mimetype', 'headers', 'size')
+
+    def __init__(self, version_tag, updated_at, etag, body, gzip_body, mimetype, headers):
+        self.version_tag = version_tag
+        self.updated_at = updated_at
+        self.etag = etag
+        self.body = body
+        self.gzip_body = gzip_body
+        self.mimetype = mimetype
+        self.headers = headers
+        self.size = len(body) + (len(gzip_body) if gzip_body else 0)
+
+
+class ResponseCache:
+    """按字节数限制大小的LRU响应缓存
+
+    - 每个 路径+参数 只保留当前数据版本的一份，数据版本变化后首次请求时重建
+    - 同一个键同时只有一个请求在构建，其余请求等待后直接使用构建结果
+      （构建锁是按键哈希分段的固定锁池，任意多的不同参数也不会让锁的数量增长）
+    - 响应体不小于 min_gzip_size 时同时保存gzip压缩版本
+    """
+
+    def __init__(self, max_bytes=16 * 1024 * 1024, min_gzip_size=1024, compresslevel=6, build_lock_stripes=64):
+        self.max_bytes = max_bytes
+        self.min_gzip_size = min_gzip_size
+        self.compresslevel = compresslevel
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._build_locks = [threading.Lock() for _ in range(build_lock_stripes)]
+        self._size = 0
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def get(self, key, version_tag):
+        """读取当前版本的缓存，没有或已过期时返回None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.version_tag != version_tag:
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return entry
+
+    def build_lock(self, key):
+        """某个键的构建锁（不同的键可能共用一把锁）"""
+        return self._build_locks[hash(key) % len(self._build_locks)]
+
+    def put(self, key, version_tag, updated_at, etag, body, mimetype='application/json', headers=None):
+        """保存序列化后的响应体，返回缓存项"""
+        gzip_body = None
+        if len(body) >= self.min_gzip_size:
+            gzip_body = gzip.compress(body, compresslevel=self.compresslevel, mtime=0)
+        entry = CachedResponse(version_tag, updated_at, etag, body, gzip_body, mimetype, headers or {})
+        if entry.size > self.max_bytes:
+            return entry
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= old.size
+            self._entries[key] = entry
+            self._size += entry.size
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= evicted.size
+                self._stats['evictions'] += 1
+        return entry
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self):
+        """缓存统计"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+            stats['bytes'] = self._size
+            stats['max_bytes'] = self.max_bytes
+            return stats
+
+
+def accepts_gzip():
+    """客户端是否接受gzip编码"""
+    return request.accept_encodings['gzip'] > 0
+
+
+def cached_json(data_version, response_cache, vary=None):
+    """接口装饰器：视图返回字典时序列化一次并缓存，同一数据版本内的请求直接返回缓存的字节串
+
+    视图返回 RawBody 时按其类型缓存原始字节；返回其他值（例如出错时的 jsonify(...), 500）时原样返回，不缓存。
+    gzip版本的ETag带 -gz 后缀，与未压缩版本区分。
+    响应内容除数据版本外还依赖其他条件（例如当前日期）时，vary 返回 (条件标识, 条件开始的时间戳)：
+    条件标识计入缓存版本和ETag，Last-Modified 不早于条件开始的时间。
+    """
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            version_tag, updated_at = data_version.current()
+            if vary is not None:
+                variant, variant_since = vary()
+                version_tag = f'{version_tag}.{variant}'
+                updated_at = max(updated_at, variant_since)
+            key = cache_key(request.path, request.args)
+            etag = make_etag(version_tag, request.path, request.args)
+            use_gzip = accepts_gzip()
+
+            # 数据未变化，不需要读取缓存
+            candidates = (f'{etag}-gz', etag) if use_gzip else (etag,)
+            for candidate in candidates:
+                if is_not_modified(candidate, updated_at):
+                    response = set_cache_headers(make_response('', 304), candidate, updated_at)
+                    response.vary.add('Accept-Encoding')
+                    return response
+
+            entry = response_cache.get(key, version_tag)
+            if entry is None:
+                with response_cache.build_lock(key):
+                    entry = response_cache.get(key, version_tag)
+                    if entry is None:
+                        result = view(*args, **kwargs)
+                        if isinstance(result, RawBody):
+                            entry = response_cache.put(key, version_tag, updated_at, etag, result.body,
+                                                       result.mimetype, result.headers)
+                        elif isinstance(result, dict):
+                            # 与 jsonify 相同的输出（非调试模式下为紧凑格式）
+                            body = current_app.json.response(result).get_data()
+                            entry = response_cache.put(key, version_tag, updated_at, etag, body)
+                        else:
+                            return result
+
+            if use_gzip and entry.gzip_body is not None:
+                response = current_app.response_class(entry.gzip_body, mimetype=entry.mimetype)
+                response.headers['Content-Encoding'] = 'gzip'
+                response_etag = f'{entry.etag}-gz'
+            else:
+                response = current_app.response_class(entry.body, mimetype=entry.mimetype)
+                response_etag = entry.etag
+            response.headers.extend(entry.headers)
+            response.vary.add('Accept-Encoding')
+            return set_cache_headers(response, response_etag, entry.updated_at)
+
+        return wrapper
+
+    return decorator
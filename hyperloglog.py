@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+HyperLogLog 基数估计
+用固定大小的寄存器数组（精度12时为4096字节）估计不重复元素的个数，标准误差约 1.04/√m（精度12时约1.6%）。
+两个相同精度的草图可以合并（逐个寄存器取最大值），合并结果等于对两组元素的并集计数，
+因此按天的草图可以合并为任意天数范围的草图，不同进程的草图也可以合并。
+"""
+
+import hashlib
+import math
+
+DEFAULT_PRECISION = 12
+# 2^-r 查表，计算估计值时避免逐个求幂
+_INVERSE_POWERS = [2.0 ** -r for r in range(65)]
+
+
+def _hash64(value):
+    """元素的64位哈希（与进程无关，保存后的草图在重启后仍然可以继续添加）"""
+    return int.from_bytes(hashlib.blake2b(str(value).encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+class HyperLogLog:
+    """HyperLogLog 草图"""
+
+    __slots__ = ('precision', 'registers', '_estimate')
+
+    def __init__(self, precision=DEFAULT_PRECISION, registers=None):
+        if not 4 <= precision <= 16:
+            raise ValueError(f'HyperLogLog 精度必须在4到16之间: {precision}')
+        self.precision = precision
+        size = 1 << precision
+        if registers is None:
+            registers = bytearray(size)
+        elif len(registers) != size:
+            raise ValueError(f'寄存器数量 {len(registers)} 与精度 {precision} 不匹配')
+        self.registers = bytearray(registers)
+        self._estimate = None  # 上次计算的估计值，寄存器变化时清除
+
+    def add(self, value):
+        """添加一个元素，寄存器发生变化时返回True"""
+        hashed = _hash64(value)
+        width = 64 - self.precision
+        index = hashed >> width
+        rank = width - (hashed & ((1 << width) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+            self._estimate = None
+            return True
+        return False
+
+    def count(self):
+        """不重复元素个数的估计值"""
+        if self._estimate is not None:
+            return self._estimate
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(_INVERSE_POWERS[r] for r in self.registers)
+        if estimate <= 2.5 * m:
+            # 小基数时用线性计数修正
+            zeros = self.registers.count(0)
+            if zeros:
+                estimate = m * math.log(m / zeros)
+        self._estimate = int(round(estimate))
+        return self._estimate
+
+    def merge(self, other):
+        """把另一个草图合并到当前草图（并集），返回自身"""
+        if other.precision != self.precision:
+            raise ValueError(f'无法合并不同精度的草图: {self.precision} 和 {other.precision}')
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        self._estimate = None
+        return self
+
+    def copy(self):
+        return HyperLogLog(self.precision, self.registers)
+
+    @classmethod
+    def union(cls, sketches, precision=DEFAULT_PRECISION):
+        """多个草图的并集（不修改参数）"""
+        result = cls(precision)
+        for sketch in sketches:
+            result.merge(sketch)
+        return result
+
+    def to_bytes(self):
+        """序列化：1字节精度 + 寄存器数组"""
+        return bytes([self.precision]) + bytes(self.registers)
+
+    @classmethod
+    def from_bytes(cls, data):
+        if not data:
+            raise ValueError('HyperLogLog 数据为空')
+        return cls(data[0], data[1:])
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+内存映射的二进制状态快照
+采集进程把历史记录和各维度时间桶编码为一个不可变的二进制文件（写临时文件后原子替换），
+其他进程用 mmap 映射后直接在映射上读取：
+  - 时间戳和时间桶键是定宽字节串，按序存放，可以直接在映射上二分查找
+  - 数值字段按列存放为 float64（小端序），只在访问某条记录时才解码
+  - 不能按数值列存放的值（RECORD_FIELDS 以外的记录字段、非数值的字段值）按行号另存为JSON，
+    解码时合并回对应的记录或时间桶，跟随进程读到的数据与采集进程完全一致
+映射的页面由操作系统在进程间共享，每个进程的读取开销不随数据量增长；
+文件被替换后旧映射仍然有效，读取方不会被写入方阻塞。
+
+文件布局：
+  8字节魔数（含格式版本） | uint32 头部长度 | 头部JSON | 填充到8字节对齐 | 数据块
+"""
+
+import bisect
+import json
+import math
+import mmap
+import os
+import struct
+from collections.abc import Mapping, Sequence
+
+MAGIC = b'EBMSNAP\x01'
+PREFIX = struct.Struct('<8sI')
+FLOAT = struct.Struct('<d')
+RECORD_FIELDS = ('remaining_power', 'remaining_amount', 'unit_price')
+
+
+class SnapshotFormatError(ValueError):
+    """快照文件格式不正确或版本不支持"""
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+class _Builder:
+    """按8字节对齐追加数据块，返回各块的偏移（相对数据区开头）"""
+
+    def __init__(self):
+        self.parts = []
+        self.size = 0
+
+    def add(self, data):
+        offset = self.size
+        self.parts.append(data)
+        self.size += len(data)
+        padding = -self.size % 8
+        if padding:
+            self.parts.append(b'\0' * padding)
+            self.size += padding
+        return offset
+
+    def add_strings(self, values):
+        """定宽字节串（不足部分补\\0），返回 (偏移, 宽度)"""
+        encoded = [value.encode('utf-8') for value in values]
+        width = max((len(value) for value in encoded), default=1)
+        return self.add(b''.join(value.ljust(width, b'\0') for value in encoded)), width
+
+    def add_extras(self, extras):
+        """按行号保存的其他字段 {行号: {字段: 值}}（JSON），没有时返回None"""
+        if not extras:
+            return None
+        data = json.dumps(extras, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        return {'offset': self.add(data), 'length': len(data)}
+
+    def add_column(self, values):
+        """float64 数值列，缺失值为NaN；列中的值全是整数时记录类型为int"""
+        kind = 'int'
+        data = bytearray(8 * len(values))
+        for i, value in enumerate(values):
+            if not _is_number(value):
+                value = math.nan
+            if not isinstance(value, int):
+                kind = 'float'
+            FLOAT.pack_into(data, 8 * i, value)
+        return {'offset': self.add(bytes(data)), 'type': kind}
+
+
+def encode_snapshot(meta, state, usage_types):
+    """把元数据和状态编码为快照文件内容
+
+    meta: 可JSON序列化的元数据（版本号、最新读数等）
+    state: current_state() 形式的状态
+    usage_types: [(维度, 状态键)]
+    """
+    builder = _Builder()
+    records = state['historical_data']
+    offset, width = builder.add_strings(record.get('timestamp', '') for record in records)
+    record_extras = {}
+    for i, record in enumerate(records):
+        for field, value in record.items():
+            if field != 'timestamp' and (field not in RECORD_FIELDS or not _is_number(value)):
+                record_extras.setdefault(i, {})[field] = value
+    header = {
+        'meta': meta,
+        'records': {
+            'count': len(records),
+            'timestamps': {'offset': offset, 'width': width},
+            'fields': {field: builder.add_column([record.get(field) for record in records])
+                       for field in RECORD_FIELDS},
+            'extras': builder.add_extras(record_extras)
+        },
+        'usage': {}
+    }
+
+    for stat_type, state_key in usage_types:
+        buckets = state[state_key]
+        keys = sorted(buckets)
+        fields = {}
+        bucket_extras = {}
+        for i, key in enumerate(keys):
+            value = buckets[key]
+            if not isinstance(value, dict):
+                fields.setdefault('usage', None)
+                continue
+            for field, field_value in value.items():
+                if _is_number(field_value):
+                    fields.setdefault(field, None)
+                else:
+                    bucket_extras.setdefault(i, {})[field] = field_value
+        # 旧数据中个别时间桶直接是用电量数值，单独标记以便原样还原
+        scalar = [i for i, key in enumerate(keys) if not isinstance(buckets[key], dict)]
+        scalar_int = [i for i in scalar if isinstance(buckets[keys[i]], int)]
+        offset, width = builder.add_strings(keys)
+        header['usage'][stat_type] = {
+            'count': len(keys),
+            'keys': {'offset': offset, 'width': width},
+            'scalar': scalar,
+            'scalar_int': scalar_int,
+            'fields': {
+                field: builder.add_column([
+                    value.get(field) if isinstance(value, dict) else value
+                    for value in (buckets[key] for key in keys)
+                ])
+                for field in fields
+            },
+            'extras': builder.add_extras(bucket_extras)
+        }
+
+    header_bytes = json.dumps(header, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    data_start = PREFIX.size + len(header_bytes)
+    padding = -data_start % 8
+    return b''.join([PREFIX.pack(MAGIC, len(header_bytes)), header_bytes, b'\0' * padding] + builder.parts)
+
+
+def write_snapshot(path, meta, state, usage_types):
+    """写入临时文件后原子替换"""
+    body = encode_snapshot(meta, state, usage_types)
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(body)
+    os.replace(temp_path, path)
+    return len(body)
+
+
+class FixedWidthStrings(Sequence):
+    """映射中的定宽字节串序列（只在访问时解码）"""
+
+    def __init__(self, buffer, offset, width, count):
+        self._buffer = buffer
+        self._offset = offset
+        self._width = width
+        self._count = count
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._count))]
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError(index)
+        start = self._offset + index * self._width
+        return self._buffer[start:start + self._width].rstrip(b'\0').decode('utf-8')
+
+
+class _Columns:
+    """映射中的一组float64数值列，以及按行号另存的其他字段"""
+
+    def __init__(self, buffer, base, fields, extras=None):
+        self._buffer = buffer
+        self._fields = [(name, base + spec['offset'], spec['type'] == 'int') for name, spec in fields.items()]
+        self._extras = {}
+        if extras:
+            start = base + extras['offset']
+            decoded = json.loads(buffer[start:start + extras['length']].decode('utf-8'))
+            self._extras = {int(index): values for index, values in decoded.items()}
+
+    def row(self, index):
+        """第 index 行的字段字典（NaN视为缺失，另存的字段覆盖数值列）"""
+        row = {}
+        for name, offset, is_int in self._fields:
+            value = FLOAT.unpack_from(self._buffer, offset + 8 * index)[0]
+            if math.isnan(value):
+                continue
+            row[name] = int(value) if is_int else value
+        extras = self._extras.get(index)
+        if extras:
+            row.update(extras)
+        return row
+
+
+class RecordsView(Sequence):
+    """映射中的历史记录（按时间升序），访问时才构造记录字典"""
+
+    def __init__(self, buffer, base, spec):
+        timestamps = spec['timestamps']
+        self.timestamps = FixedWidthStrings(buffer, base + timestamps['offset'], timestamps['width'], spec['count'])
+        self._columns = _Columns(buffer, base, spec['fields'], spec.get('extras'))
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        record = {'timestamp': self.timestamps[index]}
+        if index < 0:
+            index += len(self)
+        record.update(self._columns.row(index))
+        return record
+
+
+class BucketsView(Mapping):
+    """映射中某个维度的时间桶（键有序），按键二分查找，访问时才构造时间桶字典"""
+
+    def __init__(self, buffer, base, spec):
+        keys = spec['keys']
+        self.keys_sequence = FixedWidthStrings(buffer, base + keys['offset'], keys['width'], spec['count'])
+        self._columns = _Columns(buffer, base, spec['fields'], spec.get('extras'))
+        self._scalar = frozenset(spec['scalar'])
+        self._scalar_int = frozenset(spec['scalar_int'])
+
+    def _position(self, key):
+        index = bisect.bisect_left(self.keys_sequence, key)
+        if index < len(self.keys_sequence) and self.keys_sequence[index] == key:
+            return index
+        return None
+
+    def _value(self, index):
+        row = self._columns.row(index)
+        if index in self._scalar:
+            value = row.get('usage', 0)
+            return int(value) if index in self._scalar_int else value
+        return row
+
+    def __getitem__(self, key):
+        index = self._position(key)
+        if index is None:
+            raise KeyError(key)
+        return self._value(index)
+
+    def items(self):
+        """按键的顺序依次解码（不需要逐个二分查找）"""
+        return [(key, self._value(i)) for i, key in enumerate(self.keys_sequence)]
+
+    def values(self):
+        return [self._value(i) for i in range(len(self))]
+
+    def __contains__(self, key):
+        return self._position(key) is not None
+
+    def __iter__(self):
+        return iter(self.keys_sequence)
+
+    def __len__(self):
+        return len(self.keys_sequence)
+
+
+class MappedSnapshot:
+    """一个已映射的快照文件"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, header_len = PREFIX.unpack_from(self._buffer, 0)
+        if magic != MAGIC:
+            raise SnapshotFormatError(f'不支持的快照格式: {magic!r}')
+        header = json.loads(self._buffer[PREFIX.size:PREFIX.size + header_len].decode('utf-8'))
+        base = PREFIX.size + header_len
+        base += -base % 8
+
+        self.size = len(self._buffer)
+        self.meta = header['meta']
+        self.records = RecordsView(self._buffer, base, header['records'])
+        self.usage = {stat_type: BucketsView(self._buffer, base, spec)
+                      for stat_type, spec in header['usage'].items()}
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+请求和内部阶段的耗时统计
+  - 每个路由的请求数（按状态码）、进行中的请求数和延迟直方图
+  - 内部阶段（抓取、解析、统计更新、持久化）的耗时直方图
+直方图使用固定的对数刻度区间（0.25毫秒起每档翻倍，最高约33秒），计数按线程分散到多个分段，
+每个分段有自己的锁，请求线程之间几乎不会竞争；读取时逐个分段复制后汇总，不影响请求线程。
+PrometheusWriter 把计数和直方图输出为 Prometheus 文本格式（/metrics）。
+"""
+
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, request
+
+# 直方图区间上界（秒），超过最后一档的计入 +Inf
+LATENCY_BUCKETS = tuple(0.00025 * 2 ** i for i in range(18))
+STRIPES = 16
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+class _Striped:
+    """按线程分段的 {标签: 行} 存储，每个分段一把锁"""
+
+    def __init__(self, stripes=STRIPES):
+        self._stripes = [(threading.Lock(), {}) for _ in range(stripes)]
+
+    def _stripe(self):
+        # 线程标识通常是对齐的地址，去掉低位后再取模
+        return self._stripes[(threading.get_ident() >> 8) % len(self._stripes)]
+
+    def _rows(self):
+        """逐个分段复制各行（每个分段只短暂持有自己的锁）"""
+        for lock, rows in self._stripes:
+            with lock:
+                copied = [(label, list(row)) for label, row in rows.items()]
+            yield from copied
+
+
+class Counter(_Striped):
+    """按标签计数（也可以减少，用作进行中请求数之类的计量值）"""
+
+    def inc(self, label, amount=1):
+        lock, rows = self._stripe()
+        with lock:
+            row = rows.get(label)
+            if row is None:
+                rows[label] = [amount]
+            else:
+                row[0] += amount
+
+    def snapshot(self):
+        """{标签: 合计}"""
+        totals = {}
+        for label, row in self._rows():
+            totals[label] = totals.get(label, 0) + row[0]
+        return totals
+
+
+class Histogram(_Striped):
+    """按标签的耗时直方图：各区间计数、总次数和总耗时"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS, stripes=STRIPES):
+        super().__init__(stripes)
+        self.buckets = buckets
+
+    def observe(self, label, seconds):
+        index = bisect.bisect_left(self.buckets, seconds)
+        lock, rows = self._stripe()
+        with lock:
+            row = rows.get(label)
+            if row is None:
+                # 各区间计数（最后一个为 +Inf），然后是总次数和总耗时
+                row = rows[label] = [0] * (len(self.buckets) + 1) + [0, 0.0]
+            row[index] += 1
+            row[-2] += 1
+            row[-1] += seconds
+
+    @contextmanager
+    def time(self, label):
+        """记录 with 块的耗时（抛出异常时同样记录）"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(label, time.perf_counter() - started)
+
+    def snapshot(self):
+        """{标签: {'counts': 各区间计数（非累计，最后一个为 +Inf）, 'count': 总次数, 'sum': 总耗时}}"""
+        merged = {}
+        for label, row in self._rows():
+            total = merged.get(label)
+            if total is None:
+                merged[label] = row
+            else:
+                merged[label] = [a + b for a, b in zip(total, row)]
+        return {label: {'counts': row[:-2], 'count': row[-2], 'sum': row[-1]} for label, row in merged.items()}
+
+
+def histogram_quantile(buckets, counts, q):
+    """由直方图估计分位数（返回所在区间的上界，落在 +Inf 区间时返回最后一档的上界）"""
+    total = sum(counts)
+    if not total:
+        return None
+    rank = q * total
+    seen = 0
+    for bound, count in zip(buckets, counts):
+        seen += count
+        if seen >= rank:
+            return bound
+    return buckets[-1]
+
+
+def summarize_histogram(buckets, entry):
+    """直方图的JSON摘要：次数、平均值和 p50/p90/p99（毫秒）"""
+    def ms(value):
+        return round(value * 1000, 3) if value is not None else None
+
+    return {
+        'count': entry['count'],
+        'avg_ms': ms(entry['sum'] / entry['count']) if entry['count'] else None,
+        'p50_ms': ms(histogram_quantile(buckets, entry['counts'], 0.5)),
+        'p90_ms': ms(histogram_quantile(buckets, entry['counts'], 0.9)),
+        'p99_ms': ms(histogram_quantile(buckets, entry['counts'], 0.99))
+    }
+
+
+class RequestMetrics:
+    """Flask 请求统计：按 (方法, 路由规则) 记录请求数、状态码、进行中的请求数和延迟"""
+
+    def __init__(self, app=None):
+        self.requests = Counter()      # (方法, 路由, 状态码) -> 次数
+        self.in_flight = Counter()     # (方法, 路由) -> 进行中的请求数
+        self.latency = Histogram()     # (方法, 路由) -> 延迟直方图
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.before_request(self._before)
+        app.after_request(self._after)
+        app.teardown_request(self._teardown)
+
+    @staticmethod
+    def _label():
+        # 使用路由规则而不是实际路径，避免带参数的路径产生大量标签
+        rule = request.url_rule.rule if request.url_rule is not None else '<unmatched>'
+        return request.method, rule
+
+    def _before(self):
+        g.metrics_started = time.perf_counter()
+        g.metrics_label = self._label()
+        self.in_flight.inc(g.metrics_label)
+
+    def _after(self, response):
+        g.metrics_status = response.status_code
+        return response
+
+    def _teardown(self, exc):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return
+        label = g.pop('metrics_label')
+        status = g.pop('metrics_status', 500 if exc is not None else 200)
+        self.latency.observe(label, time.perf_counter() - started)
+        self.requests.inc(label + (status,))
+        self.in_flight.inc(label, -1)
+
+    def summary(self):
+        """各路由的请求数、5xx错误数、进行中的请求数和延迟摘要"""
+        routes = {}
+        for (method, rule, status), count in self.requests.snapshot().items():
+            route = routes.setdefault(f'{method} {rule}', {'count': 0, 'errors': 0, 'status': {}})
+            route['count'] += count
+            route['status'][str(status)] = route['status'].get(str(status), 0) + count
+            if status >= 500:
+                route['errors'] += count
+        for (method, rule), value in self.in_flight.snapshot().items():
+            routes.setdefault(f'{method} {rule}', {'count': 0, 'errors': 0, 'status': {}})['in_flight'] = value
+        for (method, rule), entry in self.latency.snapshot().items():
+            routes[f'{method} {rule}']['latency'] = summarize_histogram(self.latency.buckets, entry)
+        return routes
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class PrometheusWriter:
+    """按 Prometheus 文本格式（0.0.4）输出指标"""
+
+    def __init__(self):
+        self.lines = []
+
+    def _header(self, name, kind, help_text):
+        self.lines.append(f'# HELP {name} {help_text}')
+        self.lines.append(f'# TYPE {name} {kind}')
+
+    def metric(self, name, kind, help_text, samples, label_names=()):
+        """counter/gauge：samples 为 {标签值元组: 数值}，没有标签时用 {(): 数值}"""
+        self._header(name, kind, help_text)
+        for values, value in sorted(samples.items()):
+            if not isinstance(values, tuple):
+                values = (values,)
+            self.lines.append(f'{name}{_labels(label_names, values)} {_number(value)}')
+
+    def histogram(self, name, help_text, histogram, label_names=()):
+        """Histogram 的快照输出为累计区间计数、_sum 和 _count"""
+        self._header(name, 'histogram', help_text)
+        for values, entry in sorted(histogram.snapshot().items()):
+            if not isinstance(values, tuple):
+                values = (values,)
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + (float('inf'),), entry['counts']):
+                cumulative += count
+                le = 'le="' + ('+Inf' if bound == float('inf') else f'{bound:g}') + '"'
+                self.lines.append(f'{name}_bucket{_labels(label_names, values, le)} {cumulative}')
+            self.lines.append(f'{name}_sum{_labels(label_names, values)} {_number(entry["sum"])}')
+            self.lines.append(f'{name}_count{_labels(label_names, values)} {entry["count"]}')
+
+    def render(self):
+        return '\n'.join(self.lines) + '\n'
+
+
+def resident_memory_bytes():
+    """当前进程的常驻内存（读取 /proc/self/statm，不支持的平台返回None）"""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            resident_pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return resident_pages * PAGE_SIZE
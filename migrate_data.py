@@ -2,144 +2,306 @@
 # -*- coding: utf-8 -*-
 """
 数据迁移脚本
-将本地的9月份数据上传到云数据库作为基底数据
+将本地的历史数据（data_history.json 或 JSON Lines 文件）批量上传到云数据库
+  - 流式读取源文件，不会把整个文件读入内存
+  - 按批次 insert_many(ordered=False)，依靠timestamp唯一索引去重；无法建立唯一索引时改用批量upsert
+  - 每批写入后记录检查点，中断后重新运行会从检查点继续
+
+用法：
+  python3 migrate_data.py --source data_history.json --batch-size 1000
+  python3 migrate_data.py --reset        # 忽略检查点，从头开始
 """
 
+import argparse
 import json
 import os
+import time
 from database import db_manager, is_database_available
-from datetime import datetime
-
-def migrate_historical_data():
-    """迁移历史数据到云数据库"""
-    data_file = 'data_history.json'
-    
-    if not os.path.exists(data_file):
-        print(f"❌ 文件 {data_file} 不存在")
+from storage import USAGE_STAT_TYPES
+
+DEFAULT_SOURCE = 'data_history.json'
+DEFAULT_CHECKPOINT = '.migrate_checkpoint.json'
+DEFAULT_BATCH_SIZE = 1000
+READ_CHUNK_SIZE = 64 * 1024
+
+_decoder = json.JSONDecoder()
+
+
+class _StreamBuffer:
+    """按块读取文件的缓冲区，配合 JSONDecoder.raw_decode 逐个解析JSON值"""
+
+    def __init__(self, f):
+        self.f = f
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        """读取下一块数据，文件结束时返回False"""
+        if self.eof:
+            return False
+        chunk = self.f.read(READ_CHUNK_SIZE)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def skip_whitespace(self):
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in ' \t\r\n':
+                self.pos += 1
+            if self.pos < len(self.buf) or not self.fill():
+                return
+
+    def peek(self):
+        self.skip_whitespace()
+        return self.buf[self.pos] if self.pos < len(self.buf) else ''
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"JSON格式错误：期望 '{char}'，位置 {self.pos}")
+        self.pos += 1
+
+    def decode_value(self):
+        """解析下一个完整的JSON值，数据不完整时继续读取"""
+        self.skip_whitespace()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buf, self.pos)
+                # 数字可能恰好在块边界被截断，确认后面还有分隔符
+                if end == len(self.buf) and not self.eof and self.fill():
+                    continue
+                self.pos = end
+                return value
+            except json.JSONDecodeError:
+                if not self.fill():
+                    raise
+
+
+def stream_history_file(path, records_key='historical_data'):
+    """流式读取历史数据文件
+
+    依次产出 ('record', 记录) 和 ('section', (键, 值))。
+    .jsonl 文件每行是一条历史记录；.json 文件是 data_history.json 的格式，
+    其中 historical_data 数组逐条解析，其余字段（各维度用电统计）整体解析。
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        if path.endswith('.jsonl'):
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield 'record', json.loads(line)
+            return
+
+        stream = _StreamBuffer(f)
+        stream.expect('{')
+        if stream.peek() == '}':
+            return
+
+        while True:
+            key = stream.decode_value()
+            stream.expect(':')
+            if key == records_key:
+                stream.expect('[')
+                if stream.peek() == ']':
+                    stream.pos += 1
+                else:
+                    while True:
+                        yield 'record', stream.decode_value()
+                        if stream.peek() == ',':
+                            stream.pos += 1
+                            continue
+                        stream.expect(']')
+                        break
+            else:
+                yield 'section', (key, stream.decode_value())
+
+            if stream.peek() == ',':
+                stream.pos += 1
+                continue
+            stream.expect('}')
+            return
+
+
+def load_checkpoint(path, source):
+    """读取检查点，源文件发生变化时从头开始"""
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            checkpoint = json.load(f)
+    except Exception as e:
+        print(f"⚠️  读取检查点失败，从头开始: {e}")
+        return None
+
+    stat = os.stat(source)
+    if checkpoint.get('source') != os.path.abspath(source) or \
+       checkpoint.get('source_size') != stat.st_size or \
+       checkpoint.get('source_mtime') != stat.st_mtime:
+        print("⚠️  源文件与检查点不一致，从头开始")
+        return None
+    return checkpoint
+
+
+def save_checkpoint(path, checkpoint):
+    """原子写入检查点"""
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def migrate_historical_data(source=DEFAULT_SOURCE, batch_size=DEFAULT_BATCH_SIZE,
+                            checkpoint_path=DEFAULT_CHECKPOINT, mode='auto', reset=False):
+    """批量迁移历史数据和用电统计到云数据库"""
+    if not os.path.exists(source):
+        print(f"❌ 文件 {source} 不存在")
         return False
-    
+
     # 检查数据库连接
-    if not is_database_available():
+    if not is_database_available(wait=10):
         print("❌ 云数据库不可用，请检查配置")
         return False
-    
-    print("📊 开始迁移数据到云数据库...")
-    
+
+    if mode == 'auto':
+        mode = 'insert' if db_manager.ensure_unique_timestamp_index() else 'upsert'
+    elif mode == 'insert' and not db_manager.ensure_unique_timestamp_index():
+        print("❌ 无法建立timestamp唯一索引，insert模式无法保证幂等，请使用 --mode upsert")
+        return False
+    write_batch = db_manager.insert_historical_records if mode == 'insert' else db_manager.upsert_historical_records
+
+    checkpoint = None if reset else load_checkpoint(checkpoint_path, source)
+    stat = os.stat(source)
+    if checkpoint is None:
+        checkpoint = {
+            'source': os.path.abspath(source),
+            'source_size': stat.st_size,
+            'source_mtime': stat.st_mtime,
+            'records_done': 0,
+            'records_written': 0,
+            'stats_done': []
+        }
+    elif checkpoint['records_done']:
+        print(f"↩️  从检查点继续：已处理 {checkpoint['records_done']} 条历史记录")
+
+    print(f"📊 开始迁移数据到云数据库（{mode}模式，每批 {batch_size} 条）...")
+
+    skip = checkpoint['records_done']
+    seen = 0
+    batch = []
+    started = time.perf_counter()
+    processed_this_run = 0
+    stat_types = {state_key: stat_type for stat_type, state_key in USAGE_STAT_TYPES}
+
+    def flush():
+        nonlocal batch, processed_this_run
+        if not batch:
+            return
+        batch_started = time.perf_counter()
+        written = write_batch(batch)
+        elapsed = time.perf_counter() - batch_started
+        processed_this_run += len(batch)
+        checkpoint['records_done'] += len(batch)
+        checkpoint['records_written'] += written
+        save_checkpoint(checkpoint_path, checkpoint)
+        rate = len(batch) / elapsed if elapsed else 0
+        print(f"📈 已处理 {checkpoint['records_done']} 条（本批新增 {written} 条，{rate:,.0f} 条/秒）")
+        batch = []
+
     try:
-        # 读取本地数据
-        with open(data_file, 'r', encoding='utf-8') as f:
-            local_data = json.load(f)
-        
-        # 迁移历史记录数据
-        historical_data = local_data.get('historical_data', [])
-        if historical_data:
-            print(f"📈 迁移 {len(historical_data)} 条历史记录...")
-            for record in historical_data:
-                try:
-                    db_manager.save_historical_record(record)
-                except Exception as e:
-                    print(f"⚠️  保存历史记录失败: {e}")
-            print("✅ 历史记录迁移完成")
-        
-        # 迁移统计数据
-        stats_types = [
-            ('ten_minute_usage', '10分钟统计'),
-            ('hourly_usage_data', '小时统计'),
-            ('daily_usage_data', '日统计'),
-            ('weekly_usage_data', '周统计'),
-            ('monthly_usage_data', '月统计')
-        ]
-        
-        for data_key, description in stats_types:
-            usage_data = local_data.get(data_key, {})
-            if usage_data:
-                print(f"📊 迁移 {description}: {len(usage_data)} 条记录...")
-                try:
-                    # 提取时间维度名称
-                    time_dimension = data_key.replace('_usage_data', '').replace('_usage', '')
-                    if time_dimension == 'ten_minute':
-                        time_dimension = 'ten_minute'
-                    elif time_dimension == 'hourly':
-                        time_dimension = 'hourly'
-                    elif time_dimension == 'daily':
-                        time_dimension = 'daily'
-                    elif time_dimension == 'weekly':
-                        time_dimension = 'weekly'
-                    elif time_dimension == 'monthly':
-                        time_dimension = 'monthly'
-                    
-                    db_manager.save_usage_stats(time_dimension, 'data', usage_data)
-                    print(f"✅ {description}迁移完成")
-                except Exception as e:
-                    print(f"⚠️  {description}迁移失败: {e}")
-        
-        print("\n🎉 数据迁移完成！")
-        
-        # 验证迁移结果
-        print("\n🔍 验证迁移结果...")
-        try:
-            # 验证历史数据
-            cloud_historical = db_manager.get_historical_data()
-            print(f"☁️  云数据库历史记录: {len(cloud_historical)} 条")
-            
-            # 验证统计数据
-            for time_dim, desc in [('ten_minute', '10分钟'), ('hourly', '小时'), ('daily', '日'), ('weekly', '周'), ('monthly', '月')]:
-                cloud_stats = db_manager.get_usage_stats(time_dim)
-                print(f"☁️  云数据库{desc}统计: {len(cloud_stats)} 条")
-            
-            return True
-            
-        except Exception as e:
-            print(f"⚠️  验证迁移结果失败: {e}")
-            return False
-            
+        for kind, item in stream_history_file(source):
+            if kind == 'record':
+                seen += 1
+                if seen <= skip:
+                    continue
+                if not item.get('timestamp'):
+                    continue
+                batch.append(item)
+                if len(batch) >= batch_size:
+                    flush()
+                continue
+
+            # 迁移统计数据（按时间桶批量写入）
+            data_key, usage_data = item
+            stat_type = stat_types.get(data_key)
+            if not stat_type or not usage_data or stat_type in checkpoint['stats_done']:
+                continue
+            print(f"📊 迁移 {stat_type} 统计: {len(usage_data)} 个时间桶...")
+            if db_manager.save_usage_buckets(stat_type, usage_data):
+                checkpoint['stats_done'].append(stat_type)
+                save_checkpoint(checkpoint_path, checkpoint)
+                print(f"✅ {stat_type} 统计迁移完成")
+            else:
+                print(f"⚠️  {stat_type} 统计迁移失败")
+
+        flush()
     except Exception as e:
-        print(f"❌ 数据迁移失败: {e}")
+        print(f"❌ 数据迁移中断: {e}")
+        print("💡 重新运行本脚本会从检查点继续")
         return False
 
+    elapsed = time.perf_counter() - started
+    rate = processed_this_run / elapsed if elapsed else 0
+    print(f"\n🎉 数据迁移完成！本次处理 {processed_this_run} 条，用时 {elapsed:.1f}s，平均 {rate:,.0f} 条/秒")
+    print(f"   累计新增 {checkpoint['records_written']} 条历史记录（重复记录已跳过）")
+
+    # 迁移完成后删除检查点，下次运行重新开始（写入是幂等的）
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    return True
+
 def show_migration_summary():
     """显示迁移摘要"""
     print("\n" + "="*50)
     print("📋 数据迁移摘要")
     print("="*50)
-    
+
     try:
         if is_database_available():
-            # 获取云数据库数据统计
-            historical_count = len(db_manager.get_historical_data())
-            
+            # 获取云数据库数据统计（只做计数，不拉取全部记录）
+            historical_count = db_manager.get_database_stats().get('historical_records', 0)
+
             print(f"☁️  云数据库数据统计:")
             print(f"   - 历史记录: {historical_count} 条")
-            
+
             for time_dim, desc in [('ten_minute', '10分钟'), ('hourly', '小时'), ('daily', '日'), ('weekly', '周'), ('monthly', '月')]:
-                stats_count = len(db_manager.get_usage_stats(time_dim))
+                stats_count = db_manager.collections['usage_stats'].count_documents({'stat_type': time_dim})
                 print(f"   - {desc}统计: {stats_count} 条")
-            
+
             # 显示数据时间范围
             if historical_count > 0:
-                historical_data = db_manager.get_historical_data()
-                if historical_data:
-                    timestamps = [record.get('timestamp', '') for record in historical_data if record.get('timestamp')]
-                    if timestamps:
-                        timestamps.sort()
-                        print(f"\n📅 数据时间范围:")
-                        print(f"   - 开始时间: {timestamps[0]}")
-                        print(f"   - 结束时间: {timestamps[-1]}")
+                first = db_manager.get_historical_range(limit=1)
+                last = db_manager.get_historical_page(limit=1)
+                if first and last:
+                    print(f"\n📅 数据时间范围:")
+                    print(f"   - 开始时间: {first[0].get('timestamp')}")
+                    print(f"   - 结束时间: {last[0].get('timestamp')}")
         else:
             print("❌ 云数据库不可用")
-            
+
     except Exception as e:
         print(f"❌ 获取迁移摘要失败: {e}")
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='将本地历史数据批量迁移到云数据库')
+    parser.add_argument('--source', default=DEFAULT_SOURCE, help='源文件（data_history.json 格式或 .jsonl）')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='每批写入的记录数')
+    parser.add_argument('--checkpoint', default=DEFAULT_CHECKPOINT, help='检查点文件路径')
+    parser.add_argument('--mode', choices=['auto', 'insert', 'upsert'], default='auto',
+                        help='insert: insert_many + 唯一索引去重；upsert: 按timestamp批量upsert')
+    parser.add_argument('--reset', action='store_true', help='忽略检查点，从头开始')
+    args = parser.parse_args()
+
     print("=== 数据迁移工具 ===")
-    print("将本地9月份数据迁移到云数据库...")
-    
-    success = migrate_historical_data()
-    
+    print(f"将 {args.source} 迁移到云数据库...")
+
+    success = migrate_historical_data(args.source, args.batch_size, args.checkpoint, args.mode, args.reset)
+
     if success:
         show_migration_summary()
         print("\n✅ 数据迁移成功完成！")
         print("💡 现在可以启动应用程序，系统将优先使用云数据库数据")
     else:
-        print("\n❌ 数据迁移失败，请检查错误信息")
\ No newline at end of file
+        print("\n❌ 数据迁移失败，请检查错误信息")
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+不可变的监控状态
+写入方（抓取新读数、启动加载、按需加载旧时间桶、加载共享快照）以当前状态为基础构建新的 MonitorState，
+只复制发生变化的部分，然后整体替换引用；读取方取一次引用后不加锁，
+既不会遇到序列化过程中字典被修改，也不会看到更新到一半的数据。
+状态发布后，其中的列表、字典和索引都不能再修改。
+"""
+
+from storage import USAGE_STAT_TYPES
+from series_query import SortedKeyIndex
+
+
+class MonitorState:
+    """某一时刻的历史记录、各维度时间桶及其有序键索引和最新电表数据"""
+
+    __slots__ = ('historical_data', 'usage', 'usage_index', 'latest_data', 'version')
+
+    def __init__(self, historical_data=None, usage=None, usage_index=None, latest_data=None):
+        self.historical_data = historical_data if historical_data is not None else []
+        self.usage = usage if usage is not None else {stat_type: {} for stat_type, _ in USAGE_STAT_TYPES}
+        if usage_index is None:
+            usage_index = {stat_type: SortedKeyIndex(buckets) for stat_type, buckets in self.usage.items()}
+        self.usage_index = usage_index
+        self.latest_data = latest_data
+        # 发布时的数据版本 (版本标识, 更新时间)，由替换引用的一方在锁内设置
+        self.version = None
+
+    @classmethod
+    def from_state(cls, state, latest_data=None):
+        """由 {'historical_data': [...], 'hourly_usage_data': {...}, ...} 形式的字典构建"""
+        usage = {stat_type: state[state_key] for stat_type, state_key in USAGE_STAT_TYPES}
+        return cls(state['historical_data'], usage, latest_data=latest_data)
+
+    def replace(self, **changes):
+        """返回替换了部分字段的新状态，其余字段与当前状态共享；替换时间桶时重建对应的索引"""
+        fields = {name: getattr(self, name) for name in ('historical_data', 'usage', 'usage_index', 'latest_data')}
+        if 'usage' in changes and 'usage_index' not in changes:
+            changes['usage_index'] = {
+                stat_type: self.usage_index[stat_type] if buckets is self.usage[stat_type] else SortedKeyIndex(buckets)
+                for stat_type, buckets in changes['usage'].items()
+            }
+        fields.update(changes)
+        return MonitorState(**fields)
+
+    def as_dict(self):
+        """与状态共享数据的字典形式（供存储后端保存，不能修改）"""
+        state = {'historical_data': self.historical_data}
+        for stat_type, state_key in USAGE_STAT_TYPES:
+            state[state_key] = self.usage[stat_type]
+        return state
+
+    def window(self, stat_type, start_key=None, end_key=None, limit=None):
+        """某个维度 [start_key, end_key] 范围内的时间桶（状态不可变，不需要复制）"""
+        buckets = self.usage[stat_type]
+        keys = self.usage_index[stat_type].window(start_key, end_key, limit)
+        return {key: buckets[key] for key in keys if key in buckets}
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+异步持久化队列
+请求线程和后台抓取线程只负责把写盘任务放入有界队列，由专门的写线程依次执行，
+这样刷新接口的响应时间和 data_lock 的持有时间都不再包含数据库/文件的写入延迟。
+"""
+
+import os
+import threading
+import time
+from collections import deque
+
+
+class PersistenceQueue:
+    """有界持久化队列
+
+    - 队列满时 submit 最多等待 put_timeout 秒（背压），仍然没有空位则丢弃任务并计数
+    - 指定 coalesce_key 的任务在队列中只保留最新的一份（例如完整状态保存）
+    - flush() 等待已提交的任务全部完成，用于测试和退出前落盘
+    """
+
+    def __init__(self, maxsize=100, put_timeout=0.5, name='persistence-writer'):
+        self.maxsize = maxsize
+        self.put_timeout = put_timeout
+        self.name = name
+        self._cond = threading.Condition()
+        self._tasks = deque()
+        self._keyed = {}
+        self._unfinished = 0
+        self._thread = None
+        self._pid = None
+        self._stopping = False
+        self._stats = {
+            'enqueued': 0,
+            'completed': 0,
+            'failed': 0,
+            'dropped': 0,
+            'coalesced': 0,
+            'blocked_puts': 0,
+            'max_depth': 0
+        }
+        self._task_stats = {}
+
+    def _ensure_started(self):
+        """首次提交任务时启动写线程（fork后的子进程重新启动）"""
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def submit(self, name, fn, *args, coalesce_key=None):
+        """提交写盘任务，成功入队（或与已有任务合并）返回True，被丢弃返回False"""
+        with self._cond:
+            self._ensure_started()
+
+            if coalesce_key is not None and coalesce_key in self._keyed:
+                # 同一任务尚未执行，直接替换为最新的参数
+                entry = self._keyed[coalesce_key]
+                entry[2] = fn
+                entry[3] = args
+                self._stats['coalesced'] += 1
+                return True
+
+            if len(self._tasks) >= self.maxsize:
+                self._stats['blocked_puts'] += 1
+                self._cond.wait_for(lambda: len(self._tasks) < self.maxsize, self.put_timeout)
+                if len(self._tasks) >= self.maxsize:
+                    self._stats['dropped'] += 1
+                    print(f"⚠️ 队列已满（{self.name}），丢弃任务: {name}")
+                    return False
+
+            entry = [coalesce_key, name, fn, args, time.monotonic()]
+            self._tasks.append(entry)
+            if coalesce_key is not None:
+                self._keyed[coalesce_key] = entry
+            self._unfinished += 1
+            self._stats['enqueued'] += 1
+            self._stats['max_depth'] = max(self._stats['max_depth'], len(self._tasks))
+            self._cond.notify_all()
+            return True
+
+    def _run(self):
+        """写线程：依次执行队列中的任务"""
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._tasks or self._stopping)
+                if not self._tasks:
+                    return
+                coalesce_key, name, fn, args, enqueued_at = self._tasks.popleft()
+                if coalesce_key is not None:
+                    self._keyed.pop(coalesce_key, None)
+                self._cond.notify_all()
+
+            started = time.monotonic()
+            failed = False
+            try:
+                fn(*args)
+            except Exception as e:
+                failed = True
+                print(f"❌ 持久化任务失败 {name}: {e}")
+            finished = time.monotonic()
+
+            with self._cond:
+                task = self._task_stats.setdefault(name, {'count': 0, 'total_seconds': 0.0, 'last_seconds': 0.0, 'last_wait_seconds': 0.0})
+                task['count'] += 1
+                task['total_seconds'] += finished - started
+                task['last_seconds'] = finished - started
+                task['last_wait_seconds'] = started - enqueued_at
+                self._stats['failed' if failed else 'completed'] += 1
+                self._unfinished -= 1
+                self._cond.notify_all()
+
+    def flush(self, timeout=None):
+        """等待已提交的任务全部完成，超时返回False"""
+        with self._cond:
+            if self._unfinished and (self._thread is None or self._pid != os.getpid()):
+                self._ensure_started()
+            return self._cond.wait_for(lambda: self._unfinished == 0, timeout)
+
+    def stop(self, timeout=None):
+        """执行完剩余任务后停止写线程"""
+        self.flush(timeout)
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+
+    def depth(self):
+        """当前排队的任务数"""
+        return len(self._tasks)
+
+    def stats(self):
+        """队列统计（深度、背压、各任务耗时）"""
+        with self._cond:
+            stats = dict(self._stats)
+            stats['depth'] = len(self._tasks)
+            stats['in_flight'] = self._unfinished - len(self._tasks)
+            stats['maxsize'] = self.maxsize
+            stats['tasks'] = {
+                name: {
+                    'count': task['count'],
+                    'avg_ms': round(task['total_seconds'] / task['count'] * 1000, 2) if task['count'] else 0,
+                    'last_ms': round(task['last_seconds'] * 1000, 2),
+                    'last_wait_ms': round(task['last_wait_seconds'] * 1000, 2)
+                }
+                for name, task in self._task_stats.items()
+            }
+            return stats
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+令牌桶限流
+每个客户端IP一个令牌桶，另有一个全局令牌桶：请求需要同时从两个桶各取一个令牌，
+任一桶不足时立即拒绝，并给出可以重试的秒数。
+客户端的令牌桶放在按最近使用排序的有序字典里，超过上限时淘汰最久未访问的客户端
+（长期未访问的客户端令牌早已回满，淘汰后重新创建结果相同）。
+"""
+
+import math
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app, jsonify
+
+
+def parse_limit_spec(value):
+    """解析 "次数/秒数" 形式的限流配置，返回 (每秒补充的令牌数, 桶容量)；0 或空表示不限流"""
+    if not value or value.strip() == '0':
+        return None
+    count, _, period = value.partition('/')
+    count = float(count)
+    period = float(period or 1)
+    if count <= 0 or period <= 0:
+        raise ValueError(f'无效的限流配置: {value}')
+    return count / period, count
+
+
+class TokenBucketLimiter:
+    """按客户端和全局两级令牌桶限流"""
+
+    def __init__(self, name, per_client=None, global_limit=None, max_clients=10000, clock=time.monotonic):
+        self.name = name
+        self.per_client = per_client      # (每秒补充的令牌数, 桶容量) 或 None
+        self.global_limit = global_limit
+        self.max_clients = max_clients
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._clients = OrderedDict()     # 客户端 -> (令牌数, 上次补充时间)
+        self._global = (global_limit[1], clock()) if global_limit else None
+        self._stats = {'allowed': 0, 'limited_client': 0, 'limited_global': 0, 'evicted': 0}
+
+    def configure(self, per_client=None, global_limit=None):
+        """更换限流配置（None 表示不限流），已有的令牌桶重新开始计数"""
+        with self._lock:
+            self.per_client = per_client
+            self.global_limit = global_limit
+            self._clients.clear()
+            self._global = (global_limit[1], self._clock()) if global_limit else None
+
+    @staticmethod
+    def _refill(bucket, limit, now):
+        tokens, last = bucket
+        rate, capacity = limit
+        return min(capacity, tokens + (now - last) * rate)
+
+    def acquire(self, client):
+        """为 client 取一个令牌，成功返回0，否则返回需要等待的秒数"""
+        now = self._clock()
+        with self._lock:
+            client_tokens = None
+            if self.per_client:
+                bucket = self._clients.get(client)
+                client_tokens = self._refill(bucket, self.per_client, now) if bucket else self.per_client[1]
+                if client_tokens < 1:
+                    self._store_client(client, client_tokens, now)
+                    self._stats['limited_client'] += 1
+                    return (1 - client_tokens) / self.per_client[0]
+
+            if self._global:
+                global_tokens = self._refill(self._global, self.global_limit, now)
+                if global_tokens < 1:
+                    self._global = (global_tokens, now)
+                    self._stats['limited_global'] += 1
+                    return (1 - global_tokens) / self.global_limit[0]
+                self._global = (global_tokens - 1, now)
+
+            if client_tokens is not None:
+                self._store_client(client, client_tokens - 1, now)
+            self._stats['allowed'] += 1
+            return 0
+
+    def _store_client(self, client, tokens, now):
+        """保存客户端的令牌桶并淘汰超出上限的最久未访问客户端（调用方持有锁）"""
+        self._clients[client] = (tokens, now)
+        self._clients.move_to_end(client)
+        while len(self._clients) > self.max_clients:
+            self._clients.popitem(last=False)
+            self._stats['evicted'] += 1
+
+    def stats(self):
+        """限流统计"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['clients'] = len(self._clients)
+        stats['per_client'] = self.per_client
+        stats['global'] = self.global_limit
+        return stats
+
+
+def retry_after_seconds(wait):
+    """需要等待的秒数（向上取整，用于 Retry-After 头）"""
+    return max(1, math.ceil(wait))
+
+
+def limited_response(wait, on_limited=None):
+    """超过限流时的响应：on_limited 构造的响应或429，都带 Retry-After 头"""
+    if on_limited is not None:
+        response = current_app.make_response(on_limited(wait))
+    else:
+        response = jsonify({
+            'success': False,
+            'error': '请求过于频繁，请稍后重试',
+            'retry_after': retry_after_seconds(wait)
+        })
+        response.status_code = 429
+    response.headers['Retry-After'] = str(retry_after_seconds(wait))
+    return response
+
+
+def rate_limited(limiter, client_key, on_limited=None):
+    """路由装饰器：超过限流时立即返回，不执行视图函数
+
+    client_key: 返回当前请求客户端标识的函数
+    on_limited: 超限时构造响应的函数，参数为需要等待的秒数；未指定时返回429
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            wait = limiter.acquire(client_key())
+            if not wait:
+                return view(*args, **kwargs)
+            return limited_response(wait, on_limited)
+        return wrapper
+    return decorator
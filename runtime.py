@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+多进程运行时
+gunicorn 启动多个工作进程时，通过文件锁选出唯一的采集进程：
+  - 采集进程抓取电表数据、维护统计并写入存储，每次数据变化后把完整状态写入共享快照文件
+  - 其他进程（跟随进程）不抓取也不写存储，在快照文件变化时重新映射（见 mapped_snapshot），所有进程返回相同的数据
+采集进程退出（或被 max-requests 回收）时操作系统释放文件锁，跟随进程会接替采集。
+"""
+
+import os
+import time
+
+from mapped_snapshot import MappedSnapshot, write_snapshot
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+RUNTIME_DIR = os.getenv('RUNTIME_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.runtime'))
+
+
+class IngesterLock:
+    """采集进程的文件锁（非阻塞获取，进程持有打开的文件描述符期间有效）"""
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+
+    @property
+    def held(self):
+        return self._fd is not None
+
+    def try_acquire(self):
+        """尝试成为采集进程，已被其他进程持有时返回False"""
+        if self._fd is not None:
+            return True
+        if fcntl is None:
+            # 不支持文件锁的平台上只会运行单个进程
+            self._fd = -1
+            return True
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode('ascii'))
+        self._fd = fd
+        return True
+
+    def release(self):
+        """释放文件锁"""
+        if self._fd is None:
+            return
+        if self._fd >= 0:
+            os.close(self._fd)
+        self._fd = None
+
+    def holder_pid(self):
+        """当前采集进程的PID（读取不到时返回None）"""
+        try:
+            with open(self.path, 'r', encoding='ascii') as f:
+                return int(f.read().strip() or 0) or None
+        except (OSError, ValueError):
+            return None
+
+
+class SharedStateFile:
+    """采集进程发布、跟随进程映射读取的共享状态快照（二进制文件，原子替换）"""
+
+    def __init__(self, path):
+        self.path = path
+        self._loaded_stamp = None
+
+    def publish(self, meta, state, usage_types):
+        """编码并写入快照，读取方不会看到写了一半的文件"""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        return write_snapshot(self.path, meta, state, usage_types)
+
+    def _stamp(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def load_if_changed(self):
+        """快照文件在上次加载后发生变化时返回新的 MappedSnapshot，否则返回None"""
+        stamp = self._stamp()
+        if stamp is None or stamp == self._loaded_stamp:
+            return None
+        try:
+            snapshot = MappedSnapshot(self.path)
+        except (OSError, ValueError) as e:
+            print(f"⚠️ 读取共享快照失败: {e}")
+            return None
+        self._loaded_stamp = stamp
+        return snapshot
+
+
+class RefreshSignal:
+    """跟随进程请求采集进程立即抓取一次（通过修改信号文件的时间戳）"""
+
+    def __init__(self, path):
+        self.path = path
+        self._seen = self._mtime()
+
+    def _mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def request(self):
+        """发出刷新请求"""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, 'w', encoding='ascii') as f:
+            f.write(str(time.time()))
+
+    def reset(self):
+        """忽略此前发出的刷新请求（接替采集时调用，之前的请求已由上一个采集进程处理）"""
+        self._seen = self._mtime()
+
+    def consume(self):
+        """有尚未处理的刷新请求时返回True"""
+        mtime = self._mtime()
+        if mtime is None or mtime == self._seen:
+            return False
+        self._seen = mtime
+        return True
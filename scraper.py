@@ -30,12 +30,19 @@ class MeterDataScraper:
             'Connection': 'keep-alive',
             'Upgrade-Insecure-Requests': '1'
         }
+        # 最近一次 fetch_meter_data 各阶段的耗时（秒）：fetch 为请求电表网站，parse 为解析页面
+        self.last_timings = {}
         
     def fetch_meter_data(self, url):
         """获取电表数据"""
+        self.last_timings = {}
         try:
             print(f"正在获取电表数据: {url}")
-            response = requests.get(url, headers=self.headers, timeout=10)
+            started = time.perf_counter()
+            try:
+                response = requests.get(url, headers=self.headers, timeout=10)
+            finally:
+                self.last_timings['fetch'] = time.perf_counter() - started
             
             if response.status_code == 200:
                 # 检查是否被拦截
@@ -44,7 +51,10 @@ class MeterDataScraper:
                     return None
                     
                 print(f"✅ 请求成功，状态码: {response.status_code}")
-                return self.parse_meter_data(response.text)
+                started = time.perf_counter()
+                data = self.parse_meter_data(response.text)
+                self.last_timings['parse'] = time.perf_counter() - started
+                return data
             else:
                 print(f"❌ 请求失败，状态码: {response.status_code}")
                 return None
@@ -444,14 +444,42 @@ function updateRealTimeData() {
     const consumption = meterData.currentPower / 3600; // 每秒消耗
     meterData.remainingPower = Math.max(0, meterData.remainingPower - consumption);
     meterData.remainingAmount = meterData.remainingPower * meterData.unitPrice;
+    meterData.lastUpdate = new Date();
+    
+    renderRealTimeData();
+}
+
+// 订阅服务器推送的新读数；无法连接时退回本地模拟
+function connectRealTimeStream() {
+    if (typeof EventSource === 'undefined') {
+        setInterval(updateRealTimeData, 2000);
+        return;
+    }
     
-    // 更新显示
+    const source = new EventSource('/api/stream');
+    source.addEventListener('reading', (event) => {
+        const reading = JSON.parse(event.data);
+        meterData.remainingPower = reading.remaining_power;
+        meterData.remainingAmount = reading.remaining_amount;
+        meterData.unitPrice = reading.unit_price || meterData.unitPrice;
+        meterData.lastUpdate = new Date(reading.timestamp);
+        renderRealTimeData();
+    });
+    source.onerror = () => {
+        if (source.readyState === EventSource.CLOSED) {
+            console.warn('实时数据连接失败，使用模拟数据');
+            setInterval(updateRealTimeData, 2000);
+        }
+    };
+}
+
+// 更新实时数据显示
+function renderRealTimeData() {
     document.getElementById('currentPower').textContent = meterData.currentPower.toFixed(2);
     document.getElementById('remainingPower').textContent = meterData.remainingPower.toFixed(2) + ' kWh';
     document.getElementById('remainingAmount').textContent = '¥' + meterData.remainingAmount.toFixed(2);
     
     // 更新最后更新时间
-    meterData.lastUpdate = new Date();
     document.getElementById('lastUpdate').textContent = formatTime(meterData.lastUpdate);
     
     // 检查预警
@@ -635,7 +663,7 @@ function initializeApp() {
     updateHistoryTable();
     
     // 设置定时器
-    setInterval(updateRealTimeData, 2000); // 每2秒更新实时数据
+    connectRealTimeStream(); // 新读数由服务器推送
     setInterval(updateCurrentTime, 1000); // 每秒更新时间
     setInterval(updateDailyStats, 60000); // 每分钟更新统计数据
     setInterval(() => {
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+时间序列的紧凑传输格式
+  - columns: 列式JSON，一列Unix时间戳（秒）加上每个字段一列数值，键名只出现一次
+  - binary:  二进制，n 个 uint32 时间戳后依次是每个字段的 n 个 float32（小端序，缺失值为NaN），
+             字段和数量通过响应头 X-Series-Fields / X-Series-Count 描述
+时间桶的时间戳是桶的开始时间（按北京时间解析键）。
+"""
+
+import math
+import struct
+import sys
+from array import array
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+import pytz
+
+BEIJING_TZ = pytz.timezone('Asia/Shanghai')
+SERIES_FORMATS = ('json', 'columns', 'binary')
+RECORD_FIELDS = ('remaining_power', 'remaining_amount', 'unit_price')
+BINARY_MIMETYPE = 'application/octet-stream'
+
+# 时间桶键的格式（与 storage.get_bucket_keys 一致），周的键补上星期一再解析
+BUCKET_KEY_FORMATS = {
+    'ten_minute': '%Y-%m-%d %H:%M',
+    'hourly': '%Y-%m-%d-%H',
+    'daily': '%Y-%m-%d',
+    'weekly': '%Y-W%U-%w',
+    'monthly': '%Y-%m',
+}
+
+
+def parse_format(args, allowed=SERIES_FORMATS) -> str:
+    """解析 format 参数"""
+    value = args.get('format') or 'json'
+    if value not in allowed:
+        raise ValueError(f"不支持的format: {value}（可选: {', '.join(allowed)}）")
+    return value
+
+
+@lru_cache(maxsize=8192)
+def bucket_epoch(stat_type: str, key: str) -> Optional[int]:
+    """时间桶键对应的开始时间（Unix秒），无法解析时返回None"""
+    if stat_type == 'weekly':
+        key += '-1'
+    try:
+        parsed = datetime.strptime(key, BUCKET_KEY_FORMATS[stat_type])
+    except ValueError:
+        return None
+    return int(BEIJING_TZ.localize(parsed).timestamp())
+
+
+def _number(value: Any) -> Optional[float]:
+    """数值字段原样保留，其他值视为缺失"""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value
+    return None
+
+
+def usage_columns(stat_type: str, buckets: Dict[str, Any]) -> Dict[str, List]:
+    """把 {键: {字段: 值}} 形式的时间桶转换为列（历史数据里个别时间桶是数值，作为 usage）"""
+    times = []
+    rows = []
+    fields = {}
+    for key, value in buckets.items():
+        epoch = bucket_epoch(stat_type, key)
+        if epoch is None:
+            continue
+        if not isinstance(value, dict):
+            value = {'usage': value}
+        for field in value:
+            fields.setdefault(field, None)
+        times.append(epoch)
+        rows.append(value)
+
+    columns = {'t': times}
+    for field in fields:
+        columns[field] = [_number(row.get(field)) for row in rows]
+    return columns
+
+
+def records_columns(records: List[Dict[str, Any]]) -> Dict[str, List]:
+    """把历史记录列表转换为列"""
+    columns = {'t': [int(datetime.fromisoformat(record['timestamp']).timestamp()) for record in records]}
+    for field in RECORD_FIELDS:
+        columns[field] = [_number(record.get(field)) for record in records]
+    return columns
+
+
+def encode_binary(columns: Dict[str, List]):
+    """把列编码为二进制，返回 (字节串, 描述字段的响应头)"""
+    times = array('I', columns['t'])
+    parts = [times]
+    spec = ['t:uint32']
+    for field, values in columns.items():
+        if field == 't':
+            continue
+        parts.append(array('f', [math.nan if value is None else value for value in values]))
+        spec.append(f'{field}:float32')
+
+    if sys.byteorder != 'little':
+        for part in parts:
+            part.byteswap()
+
+    headers = {
+        'X-Series-Count': str(len(times)),
+        'X-Series-Fields': ','.join(spec),
+        'X-Series-Byte-Order': 'little',
+    }
+    return b''.join(part.tobytes() for part in parts), headers
+
+
+def decode_binary(body: bytes, fields_header: str) -> Dict[str, List]:
+    """解析 encode_binary 的结果（用于测试和Python客户端）"""
+    fields = [item.split(':') for item in fields_header.split(',')]
+    count = len(body) // (4 * len(fields))
+    columns = {}
+    offset = 0
+    for name, kind in fields:
+        fmt = '<%d%s' % (count, 'I' if kind == 'uint32' else 'f')
+        columns[name] = list(struct.unpack_from(fmt, body, offset))
+        offset += 4 * count
+    return columns
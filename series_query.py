@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+时间序列查询辅助
+解析接口的 from/to/limit 参数，并通过有序键索引二分查找时间窗口，
+只取出窗口内的时间桶和历史记录，不遍历全部数据。
+历史记录还支持按时间戳游标（before/after）分页，每一页都只在有序数据上定位，不需要跳过前面的记录。
+"""
+
+import base64
+import bisect
+import binascii
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+import pytz
+from storage import get_bucket_keys
+
+BEIJING_TZ = pytz.timezone('Asia/Shanghai')
+ONE_MICROSECOND = timedelta(microseconds=1)
+
+
+def parse_time_param(value: Optional[str]) -> Optional[datetime]:
+    """解析时间参数，支持ISO 8601（无时区时按北京时间）和Unix时间戳（秒）"""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return datetime.fromtimestamp(float(value), BEIJING_TZ)
+    except ValueError:
+        pass
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        raise ValueError(f'无法解析的时间: {value}')
+    if parsed.tzinfo is None:
+        return BEIJING_TZ.localize(parsed)
+    return parsed.astimezone(BEIJING_TZ)
+
+
+def parse_time_range(args) -> Tuple[Optional[datetime], Optional[datetime]]:
+    """从查询参数中解析时间窗口 [from, to)"""
+    start = parse_time_param(args.get('from'))
+    end = parse_time_param(args.get('to'))
+    if start and end and start >= end:
+        raise ValueError('from 必须早于 to')
+    return start, end
+
+
+def parse_limit(args, default: Optional[int] = None, maximum: Optional[int] = None) -> Optional[int]:
+    """解析 limit 参数（正整数）"""
+    value = args.get('limit')
+    if value is None or value == '':
+        return default
+    try:
+        limit = int(value)
+    except ValueError:
+        raise ValueError(f'limit 必须是整数: {value}')
+    if limit <= 0:
+        raise ValueError('limit 必须大于0')
+    return min(limit, maximum) if maximum else limit
+
+
+def bucket_key_range(stat_type: str, start: Optional[datetime],
+                     end: Optional[datetime]) -> Tuple[Optional[str], Optional[str]]:
+    """时间窗口对应的时间桶键范围（两端都包含），与窗口有交集的时间桶都会被选中"""
+    start_key = get_bucket_keys(start)[stat_type] if start else None
+    end_key = get_bucket_keys(end - ONE_MICROSECOND)[stat_type] if end else None
+    return start_key, end_key
+
+
+class SortedKeyIndex:
+    """时间桶键的有序索引（键的字典序即时间顺序），新键通常追加在末尾"""
+
+    def __init__(self, keys: Iterable[str] = ()):
+        self.keys: List[str] = sorted(keys)
+
+    def rebuild(self, keys: Iterable[str]) -> None:
+        """按给定的键重建索引"""
+        self.keys = sorted(keys)
+
+    def copy(self) -> 'SortedKeyIndex':
+        """复制索引（在副本上修改，已发布的索引保持不变）"""
+        index = SortedKeyIndex()
+        index.keys = list(self.keys)
+        return index
+
+    def attach(self, keys) -> None:
+        """直接使用已排序的只读序列作为索引（例如共享快照中的键），不复制；之后不能再 add"""
+        self.keys = keys
+
+    def add(self, key: str) -> None:
+        """添加一个键（已存在时忽略）"""
+        if self.keys and key > self.keys[-1]:
+            self.keys.append(key)
+            return
+        i = bisect.bisect_left(self.keys, key)
+        if i == len(self.keys) or self.keys[i] != key:
+            self.keys.insert(i, key)
+
+    def discard_before(self, cutoff_key: str) -> None:
+        """删除早于 cutoff_key 的键"""
+        del self.keys[:bisect.bisect_left(self.keys, cutoff_key)]
+
+    def window(self, start_key: Optional[str] = None, end_key: Optional[str] = None,
+               limit: Optional[int] = None) -> List[str]:
+        """[start_key, end_key] 范围内的键（升序），指定 limit 时只取最近的 limit 个"""
+        lo = bisect.bisect_left(self.keys, start_key) if start_key else 0
+        hi = bisect.bisect_right(self.keys, end_key) if end_key else len(self.keys)
+        if limit:
+            lo = max(lo, hi - limit)
+        return self.keys[lo:hi]
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+
+def records_window(records: List[Dict], start: Optional[str] = None, end: Optional[str] = None,
+                   limit: Optional[int] = None) -> Tuple[List[Dict], bool]:
+    """按时间戳二分查找 [start, end) 范围内的历史记录（records 按时间升序）
+
+    返回 (记录列表, 是否完整)：窗口开始时间早于内存中最早的记录、且记录数不足 limit 时，
+    内存中的数据不完整，需要到存储后端查询。
+    """
+    lo = bisect.bisect_left(records, start, key=lambda r: r.get('timestamp', '')) if start else 0
+    hi = bisect.bisect_left(records, end, key=lambda r: r.get('timestamp', '')) if end else len(records)
+    if limit and hi - lo >= limit:
+        return records[hi - limit:hi], True
+    covered = bool(records) and start is not None and records[0].get('timestamp', '') <= start
+    return records[lo:hi], covered
+
+
+def encode_cursor(timestamp: str, start: Optional[str] = None, end: Optional[str] = None) -> str:
+    """把记录的时间戳编码为分页游标（URL安全，不需要转义时区里的+号）
+
+    来自 from/to 窗口的游标同时带上窗口的起止时间，沿着游标翻页不会离开窗口。
+    """
+    payload = timestamp if not (start or end) else '|'.join((timestamp, start or '', end or ''))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(value: Optional[str]) -> Optional[Tuple[str, Optional[str], Optional[str]]]:
+    """解析分页游标，返回 (时间戳, 窗口开始时间, 窗口结束时间)，不在窗口内翻页时起止时间为None"""
+    if not value:
+        return None
+    try:
+        parts = base64.urlsafe_b64decode(value + '=' * (-len(value) % 4)).decode('utf-8').split('|')
+        if len(parts) not in (1, 3) or not parts[0]:
+            raise ValueError(value)
+        for part in parts:
+            if part:
+                datetime.fromisoformat(part)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ValueError(f'无效的分页游标: {value}')
+    timestamp, start, end = (parts + ['', ''])[:3]
+    return timestamp, start or None, end or None
+
+
+def records_page(records: List[Dict], before: Optional[str] = None, after: Optional[str] = None,
+                 limit: int = 100) -> Tuple[List[Dict], bool]:
+    """按游标在内存中的记录（按时间升序）上取一页
+
+    指定 after 时返回其后最早的 limit 条，否则返回 before（不含）之前最近的 limit 条。
+    返回 (记录列表, 是否完整)：内存中只有最近的记录，更早的部分需要到存储后端查询。
+    """
+    key = lambda r: r.get('timestamp', '')
+    hi = bisect.bisect_left(records, before, key=key) if before else len(records)
+    if after:
+        lo = bisect.bisect_right(records, after, key=key)
+        page = records[lo:min(hi, lo + limit)]
+        return page, bool(records) and key(records[0]) <= after
+    lo = max(0, hi - limit)
+    return records[lo:hi], hi - lo == limit
@@ -8,6 +8,8 @@
 import os
 import json
 from datetime import datetime
+from backup import create_backup
+from storage import JsonFileStorage
 
 def setup_database_config():
     """设置数据库配置"""
@@ -87,20 +89,13 @@ def create_local_backup():
             print("❌ 未找到 data_history.json 文件")
             return False
         
+        # 保存压缩的全量备份
+        create_backup(JsonFileStorage('data_history.json'), full=True)
+        
         # 读取数据
         with open('data_history.json', 'r', encoding='utf-8') as f:
             data = json.load(f)
         
-        # 创建备份文件名
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        backup_filename = f'data_backup_{timestamp}.json'
-        
-        # 保存备份
-        with open(backup_filename, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-        
-        print(f"✅ 数据备份已保存到: {backup_filename}")
-        
         # 显示数据统计
         historical_count = len(data.get('historical_data', []))
         hourly_count = len(data.get('hourly_usage_data', {}))
@@ -150,7 +145,7 @@ def show_current_config():
         # 测试连接
         try:
             from database import is_database_available
-            if is_database_available():
+            if is_database_available(wait=10):
                 print("✅ 数据库连接: 正常")
             else:
                 print("❌ 数据库连接: 失败")
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+静态资源服务
+启动时读取页面和脚本，预先压缩为 gzip（安装了 brotli 时还有 br）版本，按内容哈希生成ETag：
+  - 按 Accept-Encoding 选择压缩版本，每个版本有自己的ETag，If-None-Match 命中时返回304
+  - HTML 中引用的资源改写为带 ?v=<哈希> 的地址，带正确版本号的请求可以被浏览器长期缓存
+"""
+
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+
+from flask import current_app, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE_CONTROL = 'no-cache'
+
+
+class StaticAsset:
+    """一个静态资源的原始内容和各压缩版本"""
+
+    def __init__(self, name, body, mimetype):
+        self.name = name
+        self.mimetype = mimetype
+        self.version = hashlib.blake2b(body, digest_size=8).hexdigest()
+        self.variants = {'identity': body}
+
+        compressed = gzip.compress(body, compresslevel=9, mtime=0)
+        if len(compressed) < len(body):
+            self.variants['gzip'] = compressed
+        if brotli is not None:
+            compressed = brotli.compress(body, quality=11)
+            if len(compressed) < len(body):
+                self.variants['br'] = compressed
+
+    def etag(self, encoding):
+        """某个编码版本的ETag"""
+        return self.version if encoding == 'identity' else f'{self.version}-{encoding}'
+
+    def sizes(self):
+        """各版本的字节数"""
+        return {encoding: len(body) for encoding, body in self.variants.items()}
+
+
+class StaticAssets:
+    """预压缩的静态资源集合"""
+
+    # 优先使用压缩率更高的编码
+    ENCODING_PREFERENCE = ('br', 'gzip')
+
+    def __init__(self, root, names, html_names=()):
+        self.root = root
+        self.assets = {}
+        self.load(names, html_names)
+
+    def load(self, names, html_names=()):
+        """读取并压缩资源；先处理被引用的资源，再改写HTML中的引用"""
+        for name in names:
+            body = self._read(name)
+            if body is not None:
+                self.assets[name] = StaticAsset(name, body, self._mimetype(name))
+
+        for name in html_names:
+            body = self._read(name)
+            if body is not None:
+                html = self.rewrite_references(body.decode('utf-8'))
+                self.assets[name] = StaticAsset(name, html.encode('utf-8'), 'text/html')
+
+    def _read(self, name):
+        path = os.path.join(self.root, name)
+        if not os.path.exists(path):
+            print(f"⚠️ 静态资源不存在: {name}")
+            return None
+        with open(path, 'rb') as f:
+            return f.read()
+
+    @staticmethod
+    def _mimetype(name):
+        return mimetypes.guess_type(name)[0] or 'application/octet-stream'
+
+    def versioned_url(self, name):
+        """带内容版本号的资源地址"""
+        asset = self.assets.get(name)
+        return f'{name}?v={asset.version}' if asset else name
+
+    def rewrite_references(self, html):
+        """把 src/href 中对已知资源的引用改写为带版本号的地址"""
+        def replace(match):
+            attr, quote, path = match.group(1), match.group(2), match.group(3)
+            name = path[2:] if path.startswith('./') else path.lstrip('/')
+            if name not in self.assets:
+                return match.group(0)
+            return f'{attr}={quote}{self.versioned_url(name)}{quote}'
+
+        return re.sub(r'''\b(src|href)=(["'])([^"'?#]+)\2''', replace, html)
+
+    def negotiate(self, asset):
+        """按 Accept-Encoding 选择编码版本"""
+        for encoding in self.ENCODING_PREFERENCE:
+            if encoding in asset.variants and request.accept_encodings[encoding] > 0:
+                return encoding
+        return 'identity'
+
+    def response(self, name):
+        """返回资源的响应，资源不存在时返回None"""
+        asset = self.assets.get(name)
+        if asset is None:
+            return None
+
+        encoding = self.negotiate(asset)
+        etag = asset.etag(encoding)
+        if request.if_none_match.contains(etag):
+            response = current_app.response_class(status=304)
+        else:
+            response = current_app.response_class(asset.variants[encoding], mimetype=asset.mimetype)
+            if encoding != 'identity':
+                response.headers['Content-Encoding'] = encoding
+
+        response.set_etag(etag)
+        response.vary.add('Accept-Encoding')
+        # 地址带有当前版本号时内容不会再变化，可以长期缓存；否则每次使用前重新验证
+        if request.args.get('v') == asset.version:
+            response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+        else:
+            response.headers['Cache-Control'] = REVALIDATE_CACHE_CONTROL
+        return response
+
+    def stats(self):
+        """各资源的版本号和压缩后大小"""
+        return {name: {'version': asset.version, 'bytes': asset.sizes()} for name, asset in self.assets.items()}
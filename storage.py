@@ -0,0 +1,464 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+监控数据存储后端
+统一本地JSON文件和MongoDB两种存储方式，通过 STORAGE_BACKEND 环境变量选择：
+  - auto（默认）: 配置了 MONGODB_URI 时使用MongoDB，否则使用本地JSON文件
+  - json: 本地JSON文件
+  - mongodb: MongoDB
+新的后端只需继承 StorageBackend 并调用 register_storage_backend 注册即可。
+"""
+
+import base64
+import bisect
+import json
+import os
+from contextlib import contextmanager
+from datetime import timedelta
+from typing import Any, Dict, List, Optional
+
+from traffic_stats import empty_visit_stats, merge_visit_stats
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# 用电统计类型与状态字典键名的对应关系（与 data_history.json 的字段保持一致）
+USAGE_STAT_TYPES = [
+    ('ten_minute', 'ten_minute_usage'),
+    ('hourly', 'hourly_usage_data'),
+    ('daily', 'daily_usage_data'),
+    ('weekly', 'weekly_usage_data'),
+    ('monthly', 'monthly_usage_data'),
+]
+
+DEFAULT_HISTORY_FILE = 'data_history.json'
+DEFAULT_VISIT_STATS_FILE = 'visit_stats.json'
+
+
+def get_bucket_keys(now) -> Dict[str, str]:
+    """各时间维度中包含 now 的时间桶的键"""
+    ten_min_rounded = now.replace(minute=(now.minute // 10) * 10, second=0, microsecond=0)
+    week_start = now - timedelta(days=now.weekday())
+    return {
+        'ten_minute': ten_min_rounded.strftime('%Y-%m-%d %H:%M'),
+        'hourly': now.strftime('%Y-%m-%d-%H'),
+        'daily': now.strftime('%Y-%m-%d'),
+        'weekly': week_start.strftime('%Y-W%U'),
+        'monthly': now.strftime('%Y-%m')
+    }
+
+
+class StorageError(Exception):
+    """存储后端不可用或操作失败"""
+
+
+def copy_bucket(value):
+    """复制单个时间桶（历史数据里个别时间桶是数值而不是字典）"""
+    return dict(value) if isinstance(value, dict) else value
+
+
+def empty_state() -> Dict[str, Any]:
+    """返回空的监控状态"""
+    state = {'historical_data': []}
+    for _, state_key in USAGE_STAT_TYPES:
+        state[state_key] = {}
+    return state
+
+
+@contextmanager
+def _file_lock(path: str):
+    """跨进程的文件锁（多个工作进程合并写入同一个文件时使用），不支持文件锁的平台上不加锁"""
+    if fcntl is None:
+        yield
+        return
+    with open(path, 'a') as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class StorageBackend:
+    """存储后端接口
+
+    状态（state）是一个字典，包含 historical_data 列表（按时间升序）
+    以及 USAGE_STAT_TYPES 中列出的各维度用电统计字典。
+    """
+
+    name = 'base'
+    label = '存储后端'
+    # 是否支持启动时只加载热数据、旧数据按需读取
+    supports_lazy_loading = False
+    # 历史记录是否逐条存储（可以分块批量写入，而不是整体重写）
+    stores_records_individually = False
+
+    def is_available(self) -> bool:
+        """后端当前是否可用"""
+        return True
+
+    def wait_until_available(self, timeout: float) -> bool:
+        """最多等待 timeout 秒直到后端可用"""
+        return self.is_available()
+
+    def load_state(self) -> Dict[str, Any]:
+        """加载完整的监控状态"""
+        raise NotImplementedError
+
+    def load_hot_state(self, hot_records: int, bucket_keys: Dict[str, str]) -> Dict[str, Any]:
+        """加载启动所需的热数据：最近 hot_records 条历史记录，以及各维度从 bucket_keys 起的时间桶
+
+        不支持按需加载的后端直接返回完整状态。
+        """
+        return self.load_state()
+
+    def load_usage_before(self, stat_type: str, before_key: str) -> Dict[str, Any]:
+        """按需加载某个维度 before_key 之前的用电统计"""
+        state_key = dict(USAGE_STAT_TYPES)[stat_type]
+        return {key: value for key, value in self.load_state()[state_key].items() if key < before_key}
+
+    def get_records_page(self, before: Optional[str] = None, after: Optional[str] = None,
+                         limit: int = 100) -> List[Dict[str, Any]]:
+        """按时间戳游标分页获取历史记录（升序）
+
+        指定 after 时返回其后的 limit 条，否则返回 before（不含）之前最近的 limit 条。
+        """
+        raise NotImplementedError
+
+    def iter_records(self, after: Optional[str] = None, chunk_size: int = 1000):
+        """从 after 之后开始按时间升序分块遍历历史记录，每次产出一个列表"""
+        while True:
+            if after:
+                page = self.get_records_page(after=after, limit=chunk_size)
+            else:
+                page = self.get_records_range(limit=chunk_size)
+            if not page:
+                return
+            yield page
+            if len(page) < chunk_size:
+                return
+            after = page[-1]['timestamp']
+
+    def load_usage(self, stat_type: str) -> Dict[str, Any]:
+        """加载某个维度的全部用电统计"""
+        return self.load_state()[dict(USAGE_STAT_TYPES)[stat_type]]
+
+    def save_state(self, state: Dict[str, Any]) -> None:
+        """保存监控状态（用电统计，以及后端自身需要的历史记录）"""
+        raise NotImplementedError
+
+    def append_record(self, record: Dict[str, Any]) -> None:
+        """追加一条历史记录"""
+        raise NotImplementedError
+
+    def bulk_insert_records(self, records: List[Dict[str, Any]]) -> int:
+        """批量写入历史记录，返回写入条数"""
+        raise NotImplementedError
+
+    def get_records_range(self, start: Optional[str] = None, end: Optional[str] = None,
+                          limit: int = 0) -> List[Dict[str, Any]]:
+        """按时间范围 [start, end) 获取历史记录（升序）"""
+        raise NotImplementedError
+
+    def load_visit_stats(self) -> Dict[str, Any]:
+        """加载访问统计（格式见 traffic_stats）"""
+        raise NotImplementedError
+
+    def merge_visit_stats(self, delta: Dict[str, Any], cutoff_day: Optional[str] = None) -> Dict[str, Any]:
+        """把一批访问统计增量合并到存储（多个进程可以同时合并），返回合并后的完整统计
+
+        cutoff_day 之前的按天草图不再保留。
+        """
+        raise NotImplementedError
+
+    def prune_history(self) -> int:
+        """按保留策略删除过期的历史记录（维护任务，不在写入路径上执行），返回删除的条数"""
+        return 0
+
+    def storage_size(self) -> Optional[int]:
+        """占用的磁盘空间（字节），无法统计时返回None"""
+        return None
+
+    def clear(self) -> None:
+        """清空全部数据（仅用于基准测试和恢复）"""
+        raise NotImplementedError
+
+
+class JsonFileStorage(StorageBackend):
+    """本地JSON文件存储，整个状态保存在一个文件里"""
+
+    name = 'json'
+    label = '本地文件'
+
+    def __init__(self, path: str = DEFAULT_HISTORY_FILE, visit_stats_path: Optional[str] = None):
+        self.path = path
+        # 访问统计单独存放，由各工作进程加文件锁合并写入
+        self.visit_stats_path = visit_stats_path or os.path.join(os.path.dirname(path), DEFAULT_VISIT_STATS_FILE)
+        self._cache = None
+        self._cache_mtime = None
+
+    def _read(self) -> Dict[str, Any]:
+        """读取文件内容，文件未变化时直接返回缓存"""
+        if not os.path.exists(self.path):
+            return empty_state()
+
+        mtime = os.path.getmtime(self.path)
+        if self._cache is None or self._cache_mtime != mtime:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            state = empty_state()
+            state.update({k: v for k, v in data.items() if k in state})
+            self._cache = state
+            self._cache_mtime = mtime
+        return self._cache
+
+    def _write(self, state: Dict[str, Any]) -> None:
+        """原子写入文件：先写临时文件再替换，避免写到一半时崩溃导致文件损坏"""
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_path, self.path)
+        self._cache = state
+        self._cache_mtime = os.path.getmtime(self.path)
+
+    def load_state(self) -> Dict[str, Any]:
+        state = self._read()
+        loaded = {'historical_data': list(state['historical_data'])}
+        for _, state_key in USAGE_STAT_TYPES:
+            loaded[state_key] = {key: copy_bucket(value) for key, value in state[state_key].items()}
+        return loaded
+
+    def save_state(self, state: Dict[str, Any]) -> None:
+        snapshot = empty_state()
+        snapshot.update({k: v for k, v in state.items() if k in snapshot})
+        self._write(snapshot)
+
+    def append_record(self, record: Dict[str, Any]) -> None:
+        # 历史记录随 save_state 一起写入文件，这里不单独写盘
+        pass
+
+    def bulk_insert_records(self, records: List[Dict[str, Any]]) -> int:
+        state = self._read()
+        snapshot = dict(state)
+        snapshot['historical_data'] = state['historical_data'] + list(records)
+        self._write(snapshot)
+        return len(records)
+
+    def get_records_range(self, start: Optional[str] = None, end: Optional[str] = None,
+                          limit: int = 0) -> List[Dict[str, Any]]:
+        records = self._read()['historical_data']
+        lo = bisect.bisect_left(records, start, key=lambda r: r.get('timestamp', '')) if start else 0
+        hi = bisect.bisect_left(records, end, key=lambda r: r.get('timestamp', '')) if end else len(records)
+        if limit:
+            hi = min(hi, lo + limit)
+        return records[lo:hi]
+
+    def get_records_page(self, before: Optional[str] = None, after: Optional[str] = None,
+                         limit: int = 100) -> List[Dict[str, Any]]:
+        records = self._read()['historical_data']
+        if after:
+            lo = bisect.bisect_right(records, after, key=lambda r: r.get('timestamp', ''))
+            hi = len(records)
+            if before:
+                hi = bisect.bisect_left(records, before, key=lambda r: r.get('timestamp', ''))
+            return records[lo:min(hi, lo + limit)]
+        hi = bisect.bisect_left(records, before, key=lambda r: r.get('timestamp', '')) if before else len(records)
+        return records[max(0, hi - limit):hi]
+
+    def _read_visit_stats(self) -> Dict[str, Any]:
+        stats = empty_visit_stats()
+        if not os.path.exists(self.visit_stats_path):
+            return stats
+        with open(self.visit_stats_path, 'r', encoding='utf-8') as f:
+            stats.update(json.load(f))
+        # 草图在文件中是base64字符串
+        if stats['unique_visitors']:
+            stats['unique_visitors'] = base64.b64decode(stats['unique_visitors'])
+        stats['daily_unique_visitors'] = {day: base64.b64decode(sketch)
+                                          for day, sketch in stats['daily_unique_visitors'].items()}
+        return stats
+
+    def load_visit_stats(self) -> Dict[str, Any]:
+        return self._read_visit_stats()
+
+    def merge_visit_stats(self, delta: Dict[str, Any], cutoff_day: Optional[str] = None) -> Dict[str, Any]:
+        with _file_lock(f'{self.visit_stats_path}.lock'):
+            merged = merge_visit_stats(self._read_visit_stats(), delta, cutoff_day)
+            encoded = dict(merged)
+            if merged['unique_visitors']:
+                encoded['unique_visitors'] = base64.b64encode(merged['unique_visitors']).decode('ascii')
+            encoded['daily_unique_visitors'] = {day: base64.b64encode(sketch).decode('ascii')
+                                                for day, sketch in merged['daily_unique_visitors'].items()}
+            tmp_path = f'{self.visit_stats_path}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(encoded, f, ensure_ascii=False, separators=(',', ':'))
+            os.replace(tmp_path, self.visit_stats_path)
+        return merged
+
+    def storage_size(self) -> Optional[int]:
+        return os.path.getsize(self.path) if os.path.exists(self.path) else 0
+
+    def clear(self) -> None:
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self._cache = None
+        self._cache_mtime = None
+
+
+class MongoStorage(StorageBackend):
+    """MongoDB存储：历史记录逐条存放，用电统计按时间桶一个文档"""
+
+    name = 'mongodb'
+    label = '云数据库'
+    supports_lazy_loading = True
+    stores_records_individually = True
+
+    def __init__(self, manager=None):
+        if manager is None:
+            from database import db_manager
+            manager = db_manager
+        self.manager = manager
+        # 上次写入的统计数据，用于只写入发生变化的时间桶
+        self._saved = {stat_type: {} for stat_type, _ in USAGE_STAT_TYPES}
+        # 已清理过旧结构文档（time_key='data'）的统计类型
+        self._legacy_cleaned = set()
+        # 已完整加载到内存的统计类型，只有这些类型的旧结构文档可以安全删除
+        self._fully_loaded = set()
+        self._unique_index = None  # timestamp上是否有唯一索引（None表示尚未检查）
+
+    def is_available(self) -> bool:
+        return self.manager.is_connected()
+
+    def wait_until_available(self, timeout: float) -> bool:
+        return self.manager.wait_until_available(timeout)
+
+    def _require(self) -> None:
+        if not self.is_available():
+            raise StorageError('MongoDB不可用')
+
+    def load_state(self) -> Dict[str, Any]:
+        self._require()
+        state = empty_state()
+        # get_historical_data 按时间倒序返回，这里转成升序
+        state['historical_data'] = list(reversed(self.manager.get_historical_data()))
+        for stat_type, state_key in USAGE_STAT_TYPES:
+            buckets = self.manager.get_usage_stats(stat_type)
+            state[state_key] = buckets
+            # 加载后首次保存时全部时间桶都会写一遍，这样旧结构文档里的数据也会按时间桶落盘
+            self._saved[stat_type] = dict.fromkeys(buckets)
+            self._fully_loaded.add(stat_type)
+        return state
+
+    def load_hot_state(self, hot_records: int, bucket_keys: Dict[str, str]) -> Dict[str, Any]:
+        self._require()
+        state = empty_state()
+        state['historical_data'] = self.manager.get_historical_page(limit=hot_records)
+        for stat_type, state_key in USAGE_STAT_TYPES:
+            buckets = self.manager.get_usage_stats_range(stat_type, start_key=bucket_keys[stat_type])
+            state[state_key] = buckets
+            self._saved[stat_type] = dict.fromkeys(buckets)
+        return state
+
+    def load_usage_before(self, stat_type: str, before_key: str) -> Dict[str, Any]:
+        self._require()
+        buckets = self.manager.get_usage_stats_range(stat_type, end_key=before_key)
+        # 和 load_state 一样，旧时间桶在下次保存时按时间桶写一遍
+        self._saved[stat_type].update(dict.fromkeys(buckets))
+        self._fully_loaded.add(stat_type)
+        return buckets
+
+    def save_state(self, state: Dict[str, Any]) -> None:
+        self._require()
+        for stat_type, state_key in USAGE_STAT_TYPES:
+            buckets = state.get(state_key, {})
+            saved = self._saved[stat_type]
+            changed = {key: value for key, value in buckets.items() if saved.get(key) != value}
+            removed = [key for key in saved if key not in buckets]
+            if not changed and not removed:
+                continue
+            if not self.manager.save_usage_buckets(stat_type, changed, removed):
+                raise StorageError(f'保存{stat_type}统计失败')
+            if stat_type in self._fully_loaded and stat_type not in self._legacy_cleaned:
+                # 已按时间桶写入，旧结构文档可以删除
+                self.manager.delete_legacy_usage_stats(stat_type)
+                self._legacy_cleaned.add(stat_type)
+            self._saved[stat_type] = {key: copy_bucket(value) for key, value in buckets.items()}
+
+    def append_record(self, record: Dict[str, Any]) -> None:
+        self._require()
+        if not self.manager.save_historical_record(dict(record)):
+            raise StorageError('保存历史记录失败')
+
+    def bulk_insert_records(self, records: List[Dict[str, Any]]) -> int:
+        self._require()
+        if self._unique_index is None:
+            # 有timestamp唯一索引时重复写入会被跳过，批量写入是幂等的
+            self._unique_index = self.manager.ensure_unique_timestamp_index()
+        if self._unique_index:
+            return self.manager.insert_historical_records(records)
+        return self.manager.upsert_historical_records(records)
+
+    def load_usage(self, stat_type: str) -> Dict[str, Any]:
+        self._require()
+        return self.manager.get_usage_stats(stat_type)
+
+    def get_records_page(self, before: Optional[str] = None, after: Optional[str] = None,
+                         limit: int = 100) -> List[Dict[str, Any]]:
+        self._require()
+        return self.manager.get_historical_page(before, after, limit)
+
+    def get_records_range(self, start: Optional[str] = None, end: Optional[str] = None,
+                          limit: int = 0) -> List[Dict[str, Any]]:
+        self._require()
+        return self.manager.get_historical_range(start, end, limit)
+
+    def load_visit_stats(self) -> Dict[str, Any]:
+        self._require()
+        stats = self.manager.get_visit_stats()
+        if stats is None:
+            raise StorageError('读取访问统计失败')
+        return stats
+
+    def merge_visit_stats(self, delta: Dict[str, Any], cutoff_day: Optional[str] = None) -> Dict[str, Any]:
+        self._require()
+        if not self.manager.save_visit_stats(delta, cutoff_day):
+            raise StorageError('保存访问统计失败')
+        return self.load_visit_stats()
+
+    def prune_history(self) -> int:
+        self._require()
+        return self.manager.prune_expired_history()
+
+    def storage_size(self) -> Optional[int]:
+        return self.manager.get_storage_size()
+
+    def clear(self) -> None:
+        self._require()
+        for collection in ('historical_data', 'usage_stats'):
+            self.manager.collections[collection].delete_many({})
+        self._saved = {stat_type: {} for stat_type, _ in USAGE_STAT_TYPES}
+        self._fully_loaded = {stat_type for stat_type, _ in USAGE_STAT_TYPES}
+
+
+STORAGE_BACKENDS = {
+    JsonFileStorage.name: JsonFileStorage,
+    MongoStorage.name: MongoStorage,
+}
+
+
+def register_storage_backend(name: str, backend_class) -> None:
+    """注册新的存储后端"""
+    STORAGE_BACKENDS[name] = backend_class
+
+
+def get_storage_backend(name: Optional[str] = None, **kwargs) -> StorageBackend:
+    """根据配置创建存储后端"""
+    name = (name or os.getenv('STORAGE_BACKEND', 'auto')).lower()
+    if name == 'auto':
+        name = MongoStorage.name if os.getenv('MONGODB_URI') else JsonFileStorage.name
+
+    if name not in STORAGE_BACKENDS:
+        raise StorageError(f'未知的存储后端: {name}（可选: {", ".join(STORAGE_BACKENDS)}）')
+    return STORAGE_BACKENDS[name](**kwargs)
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+访问统计的持久化格式与合并
+每个工作进程在内存中累积一段时间内的增量，由后台线程定期合并到存储后端：
+  - 计数（访问次数、刷新次数、每天的访问次数）按增量相加
+  - HyperLogLog 草图按寄存器取最大值合并（重复合并结果不变，多个进程各自合并也不会重复计数）
+  - 最近的访问记录追加到末尾，只保留最近 VISIT_DETAILS_SIZE 条
+请求线程不做任何存储读写。
+
+存储格式：
+  {'total_visits': int, 'refresh_count': int, 'daily_visits': {日期: int},
+   'unique_visitors': 草图字节串或None, 'daily_unique_visitors': {日期: 草图字节串},
+   'visitor_details': [访问记录]}
+增量的格式相同，其中计数是增量，草图是完整的草图。
+"""
+
+from datetime import datetime, timedelta
+
+from hyperloglog import HyperLogLog
+
+VISIT_DETAILS_SIZE = 1000   # 保留的最近访问记录条数
+DAILY_SKETCH_DAYS = 31      # 按天的草图保留天数（更早的访客已计入全部时间的草图）
+
+
+def empty_visit_stats():
+    """空的访问统计（存储格式）"""
+    return {
+        'total_visits': 0,
+        'refresh_count': 0,
+        'daily_visits': {},
+        'unique_visitors': None,
+        'daily_unique_visitors': {},
+        'visitor_details': []
+    }
+
+
+def merge_sketches(stored, sketch):
+    """合并两个序列化的草图（任一为空时返回另一个）"""
+    if not stored:
+        return sketch
+    if not sketch:
+        return stored
+    return HyperLogLog.from_bytes(stored).merge(HyperLogLog.from_bytes(sketch)).to_bytes()
+
+
+def sketch_cutoff_day(days=DAILY_SKETCH_DAYS, today=None):
+    """按天的草图中最早保留的日期"""
+    today = today or datetime.now().date()
+    return (today - timedelta(days=days - 1)).isoformat()
+
+
+def merge_visit_stats(stored, delta, cutoff_day=None):
+    """把增量合并到存储的访问统计，返回新的统计（不修改参数）"""
+    merged = empty_visit_stats()
+    merged.update(stored)
+    merged['total_visits'] += delta.get('total_visits', 0)
+    merged['refresh_count'] += delta.get('refresh_count', 0)
+
+    daily_visits = dict(merged['daily_visits'])
+    for day, count in delta.get('daily_visits', {}).items():
+        daily_visits[day] = daily_visits.get(day, 0) + count
+    merged['daily_visits'] = daily_visits
+
+    merged['unique_visitors'] = merge_sketches(merged['unique_visitors'], delta.get('unique_visitors'))
+    daily_unique = dict(merged['daily_unique_visitors'])
+    for day, sketch in delta.get('daily_unique_visitors', {}).items():
+        daily_unique[day] = merge_sketches(daily_unique.get(day), sketch)
+    if cutoff_day:
+        daily_unique = {day: sketch for day, sketch in daily_unique.items() if day >= cutoff_day}
+    merged['daily_unique_visitors'] = daily_unique
+
+    merged['visitor_details'] = (list(merged['visitor_details']) + list(delta.get('visitor_details', [])))[-VISIT_DETAILS_SIZE:]
+    return merged